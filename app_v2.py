@@ -9,27 +9,139 @@ Enhanced with:
 """
 
 import os
+import sys
 import tempfile
 import random
 from datetime import datetime
 from flask import Flask, render_template, request, jsonify, session, Response
 from werkzeug.utils import secure_filename
-import PyPDF2
-import fitz  # PyMuPDF
-import pdfplumber
-import openai
 import pytz
 import base64
-import requests
-from bs4 import BeautifulSoup
-from pdf2image import convert_from_path, convert_from_bytes
-from PIL import Image
 import io
 from io import BytesIO
+import importlib
 import json
+import hashlib
+import difflib
+import mmap
+import multiprocessing
+from multiprocessing import shared_memory
+import re
+import resource
+import signal
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # Import database module
 import database as db
+import token_budget as tb
+
+# ============================================================================
+# LAZY IMPORTS (heavy libraries load on first use, not at worker startup)
+# ============================================================================
+# The PDF parsers, imaging libraries and the OpenAI SDK make up most of a
+# worker's import time and memory, yet the wizard pages, answers and TTS
+# never touch them. Each is a module proxy that imports the real module the
+# first time one of its attributes is used. LAZY_IMPORTS=false loads
+# everything at startup instead (compare with 'python benchmark.py startup').
+
+LAZY_IMPORTS = os.environ.get('LAZY_IMPORTS', 'true').lower() in ('1', 'true', 'yes')
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = sys.modules.get(name)  # Nothing to defer if it is already imported
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    # Already imported elsewhere (e.g. preloaded in the PDF forkserver): just bind it
+                    self._module = sys.modules.get(self._name)
+                if self._module is None:
+                    start = time.perf_counter()
+                    self._module = importlib.import_module(self._name)
+                    print(f"📦 Loaded {self._name} on first use ({time.perf_counter() - start:.2f}s)")
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+class LazyClient:
+    """Stand-in for an API client that is built by factory() on first use
+
+    The client is falsy if factory() fails, so 'if not client' checks fall
+    back to the non-AI path; on_failure() is called once when that happens.
+    A forked child never reuses its parent's client (HTTP connection pools
+    must not be shared across processes); it builds its own on first use.
+    """
+
+    def __init__(self, factory, on_failure=None):
+        self._factory = factory
+        self._on_failure = on_failure
+        self._client = None
+        self._failed = False
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    if self._failed:
+                        raise RuntimeError("client could not be created")
+                    try:
+                        self._client = self._factory()
+                    except Exception:
+                        self._failed = True
+                        if self._on_failure:
+                            self._on_failure()
+                        raise
+        return self._client
+
+    def __bool__(self):
+        try:
+            self._get()
+            return True
+        except Exception:
+            return False
+
+    def __getattr__(self, attr):
+        return getattr(self._get(), attr)
+
+PyPDF2 = LazyModule('PyPDF2')
+fitz = LazyModule('fitz')  # PyMuPDF
+pdfplumber = LazyModule('pdfplumber')
+openai = LazyModule('openai')
+Image = LazyModule('PIL.Image')
+np = LazyModule('numpy')
+
+# Preloaded in the forkserver that starts PDF worker processes, so each child doesn't import its own
+PDF_LIBRARIES = (fitz, pdfplumber, Image, np)
+
+# Loaded in the Gunicorn master when the app is preloaded (see gunicorn.conf.py),
+# so every worker shares one copy-on-write copy
+PRELOAD_MODULES = PDF_LIBRARIES + (openai,)
+
+def load_lazy_modules(*modules):
+    """Import the given lazy modules now"""
+    for module in modules:
+        module._load()
+
+if not LAZY_IMPORTS:
+    load_lazy_modules(PyPDF2, fitz, pdfplumber, openai, Image, np)
 
 CST = pytz.timezone('America/Chicago')
 
@@ -55,10 +167,10 @@ def cache_extraction(extraction_result):
     flask_sid = get_flask_session_id()
     db.save_progressive_cache_extraction(flask_sid, extraction_result)
 
-def cache_ai_analysis(key_details):
+def cache_ai_analysis(key_details, provisional=False):
     """Cache AI analysis results in database"""
     flask_sid = get_flask_session_id()
-    db.save_progressive_cache_analysis(flask_sid, key_details)
+    db.save_progressive_cache_analysis(flask_sid, key_details, provisional)
 
 def cache_web_research(company_research):
     """Cache web research results in database"""
@@ -85,41 +197,54 @@ app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # ✅ 50MB for larger files
 UPLOAD_FOLDER = tempfile.gettempdir()
 ALLOWED_AUDIO_EXTENSIONS = {'webm', 'mp3', 'wav', 'm4a', 'ogg'}
 
-# Initialize OpenAI client (direct or via Portkey gateway)
-openai_client = None
-openai_available = False
-
-try:
-    portkey_api_key = os.environ.get('PORTKEY_API_KEY')
-    portkey_virtual_key = os.environ.get('PORTKEY_VIRTUAL_KEY')
-    openai_api_key = os.environ.get('OPENAI_API_KEY')
-
-    if portkey_api_key and portkey_virtual_key:
-        # Route through UT Portkey gateway
-        from portkey_ai import PORTKEY_GATEWAY_URL, createHeaders
-        openai_client = openai.OpenAI(
-            api_key="portkey",
-            base_url=PORTKEY_GATEWAY_URL,
-            default_headers=createHeaders(
-                api_key=portkey_api_key,
-                virtual_key=portkey_virtual_key,
-                metadata={"app": "executive-panel-simulator"}
+# Initialize OpenAI client (direct or via Portkey gateway). The SDK is only
+# imported and the client only built when the first API call is made
+portkey_api_key = os.environ.get('PORTKEY_API_KEY')
+portkey_virtual_key = os.environ.get('PORTKEY_VIRTUAL_KEY')
+openai_api_key = os.environ.get('OPENAI_API_KEY')
+
+def create_openai_client():
+    """Build the OpenAI client, routed through the Portkey gateway when it is configured"""
+    try:
+        if portkey_api_key and portkey_virtual_key:
+            # Route through UT Portkey gateway
+            from portkey_ai import PORTKEY_GATEWAY_URL, createHeaders
+            client = openai.OpenAI(
+                api_key="portkey",
+                base_url=PORTKEY_GATEWAY_URL,
+                default_headers=createHeaders(
+                    api_key=portkey_api_key,
+                    virtual_key=portkey_virtual_key,
+                    metadata={"app": "executive-panel-simulator"}
+                )
             )
-        )
-        openai_available = True
-        print("✅ Portkey gateway configured - using UT API access")
-    elif openai_api_key:
-        # Fall back to direct OpenAI
-        openai_client = openai.OpenAI(api_key=openai_api_key)
-        openai_available = True
-        print("✅ Direct OpenAI API configured")
-    else:
-        print("⚠️  No API keys found - running in demo mode")
-except Exception as e:
-    print(f"❌ OpenAI initialization failed: {e}")
-    import traceback
-    traceback.print_exc()
+            print("✅ Portkey gateway client created - using UT API access")
+        else:
+            # Fall back to direct OpenAI
+            client = openai.OpenAI(api_key=openai_api_key)
+            print("✅ Direct OpenAI client created")
+        return client
+    except Exception as e:
+        print(f"❌ OpenAI initialization failed: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+def disable_openai():
+    """Fall back to demo mode when the client cannot be created"""
+    global openai_available
     openai_available = False
+    print("⚠️  Running in demo mode")
+
+openai_available = bool((portkey_api_key and portkey_virtual_key) or openai_api_key)
+openai_client = LazyClient(create_openai_client, on_failure=disable_openai) if openai_available else None
+
+if not openai_available:
+    print("⚠️  No API keys found - running in demo mode")
+elif not LAZY_IMPORTS:
+    bool(openai_client)  # Build it now; falls back to demo mode if that fails
+else:
+    print("✅ OpenAI API configured (client is created on first use)")
 
 # Executive Management
 EXECUTIVE_NAMES = {
@@ -172,47 +297,48 @@ def analyze_pdf_with_vision(pdf_path, company_name, industry, report_type):
     try:
         print(f"🔍 Analyzing PDF with Vision API...")
 
-        # Convert PDF to images (first 3 pages to manage costs and time)
-        images = convert_from_path(pdf_path, first_page=1, last_page=3)
-        print(f"📄 Converted {len(images)} pages to images")
+        # Render the first 3 pages in-process (manages costs and time)
+        doc = fitz.open(pdf_path)
+        try:
+            images = [render_page_for_vision(doc, page_num) for page_num in range(min(3, len(doc)))]
+        finally:
+            doc.close()
+        print(f"📄 Rendered {len(images)} pages to images")
 
         all_analysis = []
 
         # Analyze each page with Vision API
-        for i, img in enumerate(images[:3], 1):  # Limit to first 3 pages for speed
+        for i, img in enumerate(images, 1):
             print(f"   Analyzing page {i}...")
 
-            # Convert PIL Image to bytes
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG')
-            img_byte_arr.seek(0)
-
             # Encode image to base64
-            img_base64 = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
+            img_base64 = base64.b64encode(img['bytes']).decode('utf-8')
 
             # Call Vision API (using gpt-4o which supports vision)
+            messages = [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": f"Analyze this page from a {report_type} for {company_name} in the {industry} industry. Extract key business insights, data points from charts/graphs/tables, and strategic information. Be specific and comprehensive."
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{img_base64}",
+                                "detail": "low"  # Use "low" for faster processing
+                            }
+                        }
+                    ]
+                }
+            ]
             response = openai_client.chat.completions.create(
                 model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": f"Analyze this page from a {report_type} for {company_name} in the {industry} industry. Extract key business insights, data points from charts/graphs/tables, and strategic information. Be specific and comprehensive."
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{img_base64}",
-                                    "detail": "low"  # Use "low" for faster processing
-                                }
-                            }
-                        ]
-                    }
-                ],
+                messages=messages,
                 max_tokens=500  # Reduced for faster response
             )
+            record_prompt_usage('legacy_page_vision', messages, response)
 
             page_analysis = response.choices[0].message.content
             all_analysis.append(f"Page {i}: {page_analysis}")
@@ -232,114 +358,964 @@ def analyze_pdf_with_vision(pdf_path, company_name, industry, report_type):
 
 # ========== Enhanced PDF Processing with PyMuPDF + pdfplumber ==========
 
-def truncate_at_appendix(text_content):
+# Single precompiled matcher for the start of the appendix section. Looks for
+# appendix keywords that appear as section headers:
+#   - "Appendix A" / "Appendix 1" / "Appendix:" / "Appendices" right after a page break
+#   - "Appendix A" / "Appendices" after several blank lines
+# One search returns the leftmost match, i.e. the earliest boundary
+APPENDIX_BOUNDARY_RE = re.compile(
+    r'\n---\s+Page\s+\d+\s+---\s*\n+\s*(?:Appendix(?:\s+[A-Z0-9]|\s*[:\n])|Appendices\s*[:\n])'
+    r'|\n\n\n+\s*(?:Appendix\s+[A-Z0-9]|Appendices\s*[:\n])',
+    re.IGNORECASE
+)
+
+def find_appendix_start(text_content):
+    """Return the character offset where the appendix section starts, or None"""
+    match = APPENDIX_BOUNDARY_RE.search(text_content)
+    return match.start() if match else None
+
+def page_for_offset(page_offsets, offset):
+    """Map a character offset in the extracted text back to its 1-based page number
+
+    page_offsets[i] is the offset where page i+1 starts (built during extraction).
+    """
+    from bisect import bisect_right
+    return max(1, bisect_right(page_offsets, offset))
+
+def get_page_index(extraction):
+    """(page_offsets, text_end) of an extraction's text within its combined_content, or None
+
+    page_offsets are shifted to positions in combined_content, so spans of
+    the content (e.g. analysis chunks) map back to pages with page_for_offset;
+    anything from text_end on is tables and image descriptions, not page text.
+    """
+    text, page_offsets = extraction.get('text'), extraction.get('page_offsets')
+    if not text or not page_offsets:
+        return None
+    text_start = extraction['combined_content'].find(text)
+    if text_start < 0:
+        return None
+    return [text_start + offset for offset in page_offsets], text_start + len(text)
+
+# ========== Single-buffer PDF pipeline ==========
+# An upload is held once: Werkzeug spools it to an anonymous temp file, which
+# is memory-mapped read-only; every stage (hashing, PyMuPDF, pdfplumber,
+# SQLite) reads that same memoryview rather than its own bytes copy.
+
+def open_upload_buffer(file_storage):
+    """Read-only memoryview of an uploaded file, memory-mapped when Werkzeug spooled it to disk"""
+    stream = file_storage.stream
+    stream.seek(0)
+
+    # Small uploads (<500KB) stay in Werkzeug's in-memory spool; just read them
+    if getattr(stream, '_rolled', True) and hasattr(stream, 'fileno'):
+        try:
+            return memoryview(mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError, io.UnsupportedOperation):
+            stream.seek(0)  # Empty file or not a real file descriptor
+
+    return memoryview(stream.read()).toreadonly()
+
+# Queued uploads wait on disk for the extraction worker process, not in SQLite
+EXTRACTION_SPOOL_DIR = os.environ.get(
+    'EXTRACTION_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'executive-panel-uploads'))
+
+def spool_upload(job_id, pdf_buffer):
+    """Write an upload to the spool directory and return its path"""
+    os.makedirs(EXTRACTION_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(EXTRACTION_SPOOL_DIR, f"{job_id}.pdf")
+
+    # Write under a temporary name so the worker never sees a partial file
+    with open(path + '.part', 'wb') as f:
+        f.write(pdf_buffer)
+    os.replace(path + '.part', path)
+    return path
+
+def open_spooled_upload(path):
+    """Read-only memoryview of a spooled upload (memory-mapped)"""
+    with open(path, 'rb') as f:
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+def remove_spooled_upload(path):
+    """Delete a spooled upload once its job has finished"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def cleanup_spooled_uploads(hours=24):
+    """Delete spooled uploads left behind by jobs that never finished"""
+    cutoff = time.time() - hours * 3600
+    try:
+        entries = list(os.scandir(EXTRACTION_SPOOL_DIR))
+    except FileNotFoundError:
+        return
+
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+def as_pdf_buffer(pdf_source):
+    """Read-only memoryview over PDF bytes, a buffer, or a file object (read once)"""
+    if isinstance(pdf_source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return memoryview(pdf_source).toreadonly()
+
+    pdf_source.seek(0)
+    return memoryview(pdf_source.read()).toreadonly()
+
+class PDFBufferReader(io.RawIOBase):
+    """Seekable read-only file object over a memoryview, for libraries that want a stream
+
+    io.BytesIO(memoryview) would copy the whole PDF; this hands out only the
+    chunks that are actually read (pdfminer reads a few KB at a time).
+    """
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, target):
+        chunk = self._buffer[self._pos:self._pos + len(target)]
+        target[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._buffer)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+def get_peak_rss_mb():
+    """Process peak resident memory in MB (ru_maxrss is KB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+# ========== PDF parsing sandbox ==========
+# PyMuPDF and pdfplumber run in a child process, started from the forkserver
+# with CPU-time and address-space limits, so a pathological PDF (decompression bomb, broken
+# xref, endless content stream) or a crash inside MuPDF costs one child
+# process and a clean error, never the Gunicorn worker. A prevalidation pass
+# in the same sandbox rejects or downgrades bad files in milliseconds.
+
+PDF_SANDBOX_ENABLED = os.environ.get('PDF_SANDBOX', 'true').lower() in ('1', 'true', 'yes')
+PDF_SANDBOX_TIMEOUT = float(os.environ.get('PDF_SANDBOX_TIMEOUT', 120))  # Wall-clock seconds per stage
+PDF_SANDBOX_CPU_SECONDS = int(os.environ.get('PDF_SANDBOX_CPU_SECONDS', 90))
+PDF_SANDBOX_MEMORY_MB = int(os.environ.get('PDF_SANDBOX_MEMORY_MB', 1536))  # Headroom over the forked size
+
+PDF_PREVALIDATION_TIMEOUT = 10
+PDF_PREVALIDATION_CPU_SECONDS = 5
+
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', 1000))  # Rejected above this
+PDF_MAX_OBJECTS = int(os.environ.get('PDF_MAX_OBJECTS', 1000000))
+PDF_TEXT_ONLY_PAGES = int(os.environ.get('PDF_TEXT_ONLY_PAGES', 300))  # Tables/Vision skipped above this
+PDF_TEXT_ONLY_OBJECTS = int(os.environ.get('PDF_TEXT_ONLY_OBJECTS', 200000))
+
+class PDFSandboxError(Exception):
+    """PDF parsing crashed, timed out or hit a resource limit in the sandbox"""
+
+class PDFValidationError(ValueError):
+    """PDF was rejected by prevalidation (message is safe to show to the user)"""
+
+def _current_address_space_bytes():
+    """Virtual memory size of this process (Linux), or None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return None
+
+class _SandboxBuffer:
+    """Stands in for a PDF buffer argument: the child maps this shared memory segment instead"""
+
+    def __init__(self, shared):
+        self.name = shared.name
+        self.size = shared.size
+
+class _SandboxCallback:
+    """Stands in for a callback argument: the child relays calls to the parent over the pipe"""
+
+    def __init__(self, index):
+        self.index = index
+
+def _sandbox_entry(conn, func, args, kwargs, cpu_seconds, memory_mb):
+    """Child side of run_in_sandbox: apply limits, run func, send back the outcome"""
+    try:
+        # Nothing inherited from the forkserver should be replayed by this child
+        sys.stdout.flush()
+        # Lead a new process group, so a timeout kills anything this child starts too
+        os.setsid()
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 5))
+
+        # The child starts as a copy of the forkserver, so the address-space
+        # cap is its current size plus headroom
+        current = _current_address_space_bytes()
+        if current:
+            limit = current + memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+        segments = []  # Mapped until the child exits
+
+        def resolve(value):
+            if isinstance(value, _SandboxBuffer):
+                segment = shared_memory.SharedMemory(name=value.name)
+                segments.append(segment)
+                return segment.buf[:value.size].toreadonly()
+            if isinstance(value, _SandboxCallback):
+                return lambda *call_args, **call_kwargs: conn.send(('call', value.index, call_args, call_kwargs))
+            return value
+
+        args = [resolve(value) for value in args]
+        kwargs = {key: resolve(value) for key, value in kwargs.items()}
+        conn.send(('ok', func(*args, **kwargs)))
+    except MemoryError:
+        conn.send(('error', 'exceeded the memory limit'))
+    except BaseException as e:
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+        sys.stdout.flush()
+        os._exit(0)  # Skip atexit handlers and shared memory finalizers
+
+def _kill_sandbox(process):
+    """Kill a sandbox child and every process in its group"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass  # Group already gone, or the child never got to setsid
+    if process.is_alive():
+        process.kill()
+
+def run_in_sandbox(func, args=(), kwargs=None, timeout=None, cpu_seconds=None, memory_mb=None):
+    """Run func(*args, **kwargs) in a resource-limited child process and return its result
+
+    The child is started from the forkserver (see get_pdf_process_context),
+    never forked from this possibly multithreaded process, so func must be a
+    module-level function and its arguments picklable, with two exceptions:
+    PDF buffers (bytes, memoryview, mmap) are passed through shared memory,
+    and callbacks (e.g. progress reporters) are relayed, running here in this
+    process as the child calls them. Callback return values are not sent back.
+
+    Raises:
+        PDFSandboxError: if the child crashes, times out, exceeds a limit or raises
     """
-    Intelligently detect and truncate text at the start of appendices section
+    kwargs = kwargs or {}
+    if not PDF_SANDBOX_ENABLED:
+        return func(*args, **kwargs)
+
+    timeout = timeout or PDF_SANDBOX_TIMEOUT
+    cpu_seconds = cpu_seconds or PDF_SANDBOX_CPU_SECONDS
+    memory_mb = memory_mb or PDF_SANDBOX_MEMORY_MB
+
+    callbacks = []
+    shared_buffers = []
+
+    def stand_in(value):
+        if isinstance(value, (bytes, bytearray, memoryview, mmap.mmap)):
+            shared_buffers.append(SharedPDF(value))
+            return _SandboxBuffer(shared_buffers[-1])
+        if callable(value) and not isinstance(value, type):
+            callbacks.append(value)
+            return _SandboxCallback(len(callbacks) - 1)
+        return value
+
+    ctx = get_pdf_process_context()
+    receiver, sender = ctx.Pipe(duplex=False)
+    process = None
+
+    try:
+        child_args = tuple(stand_in(value) for value in args)
+        child_kwargs = {key: stand_in(value) for key, value in kwargs.items()}
+
+        process = ctx.Process(
+            target=_sandbox_entry,
+            args=(sender, func, child_args, child_kwargs, cpu_seconds, memory_mb),
+            name=f"pdf-sandbox-{func.__name__}",
+            daemon=True
+        )
+        process.start()
+        sender.close()
+
+        deadline = time.monotonic() + timeout
+        while True:
+            if not receiver.poll(max(0, deadline - time.monotonic())):
+                _kill_sandbox(process)
+                raise PDFSandboxError(f"{func.__name__} timed out after {timeout:.0f}s")
+            try:
+                message = receiver.recv()
+            except EOFError:
+                process.join(5)
+                if process.exitcode == -signal.SIGXCPU:
+                    raise PDFSandboxError(f"{func.__name__} exceeded the {cpu_seconds}s CPU limit")
+                raise PDFSandboxError(f"{func.__name__} crashed (exit code {process.exitcode})")
+
+            if message[0] != 'call':
+                status, value = message
+                break
+
+            _, index, call_args, call_kwargs = message
+            try:
+                callbacks[index](*call_args, **call_kwargs)
+            except Exception as e:
+                print(f"⚠️ Sandbox callback for {func.__name__} failed: {e}")
+    finally:
+        sender.close()
+        receiver.close()
+        if process is not None:
+            process.join(5)
+            _kill_sandbox(process)  # Sweep up anything the child left running
+            process.join()
+        for shared in shared_buffers:
+            shared.__exit__(None, None, None)
+
+    if status != 'ok':
+        raise PDFSandboxError(f"{func.__name__} failed: {value}")
+    return value
+
+def sandboxed(func, **limits):
+    """Wrap func so each call runs through run_in_sandbox (for run_timed_stage and executors)"""
+    def call(*args, **kwargs):
+        return run_in_sandbox(func, args, kwargs, **limits)
+    call.__name__ = func.__name__
+    return call
+
+def inspect_pdf(pdf_bytes):
+    """Open a PDF and report the facts prevalidation needs (runs inside the sandbox)"""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return {
+            'page_count': doc.page_count,
+            'object_count': doc.xref_length(),
+            'needs_pass': bool(doc.needs_pass),
+            'repaired': bool(doc.is_repaired)
+        }
+    finally:
+        doc.close()
 
-    Looks for appendix section headers (not just mentions in TOC):
-    - "Appendix A", "Appendix 1", "APPENDIX", "Appendices"
-    - Must appear as a section header (after page breaks, with formatting)
-    - Avoids false positives from TOC or inline mentions
+def prevalidate_pdf(pdf_bytes):
+    """Fast-fail checks before any real parsing
 
     Returns:
-        tuple: (truncated_text, was_truncated, removed_chars)
+        dict: page_count, object_count, needs_pass, repaired and text_only,
+              which is set for files that are parsed for text only (tables
+              and Vision skipped) because they are huge or have a broken xref
+
+    Raises:
+        PDFValidationError: for files that are not PDFs, can't be opened,
+                            are password-protected or exceed hard limits
     """
-    import re
+    if b'%PDF-' not in bytes(pdf_bytes[:1024]):
+        raise PDFValidationError('File is not a valid PDF')
 
-    # Patterns that indicate start of appendix section
-    # Look for appendix keywords that appear as section headers
-    patterns = [
-        # "Appendix A" or "Appendix 1" etc. at start of line after page break
-        r'\n---\s+Page\s+\d+\s+---\s*\n+\s*Appendix\s+[A-Z0-9]',
-        r'\n---\s+Page\s+\d+\s+---\s*\n+\s*APPENDIX\s+[A-Z0-9]',
+    try:
+        info = run_in_sandbox(
+            inspect_pdf, (pdf_bytes,),
+            timeout=PDF_PREVALIDATION_TIMEOUT, cpu_seconds=PDF_PREVALIDATION_CPU_SECONDS
+        )
+    except PDFSandboxError as e:
+        print(f"❌ PDF prevalidation failed: {e}")
+        raise PDFValidationError('PDF could not be opened - it may be damaged')
+
+    if info['needs_pass']:
+        raise PDFValidationError('PDF is password-protected - please upload an unlocked copy')
+    if info['page_count'] == 0:
+        raise PDFValidationError('PDF has no pages')
+    if info['page_count'] > PDF_MAX_PAGES:
+        raise PDFValidationError(f"PDF has {info['page_count']} pages - the limit is {PDF_MAX_PAGES}")
+    if info['object_count'] > PDF_MAX_OBJECTS:
+        raise PDFValidationError('PDF is too complex to process')
+
+    info['text_only'] = (
+        info['page_count'] > PDF_TEXT_ONLY_PAGES
+        or info['object_count'] > PDF_TEXT_ONLY_OBJECTS
+        or info['repaired']
+    )
+    if info['text_only']:
+        print(f"⚠️ Downgrading to text-only extraction: {info['page_count']} pages, "
+              f"{info['object_count']} objects, repaired xref={info['repaired']}")
+    return info
+
+# Page-parallel PyMuPDF work (text extraction, scanned page renders): large
+# documents are split into page ranges and handed to one long-lived process
+# pool per process. Its workers are started from a forkserver, never forked
+# from a threaded web or job worker, and open the PDF from a shared memory
+# segment the caller fills once per document. Small documents are parsed in
+# the PDF sandbox instead.
+PDF_EXTRACTION_WORKERS = int(os.environ.get('PDF_EXTRACTION_WORKERS', os.cpu_count() or 1))
+PARALLEL_EXTRACTION_MIN_PAGES = int(os.environ.get('PARALLEL_EXTRACTION_MIN_PAGES', 16))
+
+_page_pool = None
+_page_pool_lock = threading.Lock()
+_worker_document = None  # Pool worker side: (segment name, shared memory, open document)
+
+def get_pdf_process_context():
+    """Start method for PDF worker processes: a forkserver that has the PDF libraries preloaded"""
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+
+    ctx = multiprocessing.get_context('forkserver')
+    # Keep log order: the server starts on first use, so flush what this process printed so far
+    sys.stdout.flush()
+
+    # The forkserver does not get this process's sys.path (CPython 3.11), so
+    # without this it can only import the app when started from its directory;
+    # otherwise every child would import the whole app again
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    python_path = [path for path in os.environ.get('PYTHONPATH', '').split(os.pathsep) if path]
+    if app_dir not in python_path:
+        os.environ['PYTHONPATH'] = os.pathsep.join([app_dir] + python_path)
+
+    # No effect once the server is running; it starts on first use in each worker.
+    # The libraries come before this module, whose lazy proxies then bind to
+    # them on import, so children neither import nor log them again
+    ctx.set_forkserver_preload(['__main__'] + [module._name for module in PDF_LIBRARIES] + [__name__])
+    return ctx
+
+def _reset_page_pool_after_fork():
+    """The pool's processes and threads belong to the parent: a forked child builds its own"""
+    global _page_pool, _page_pool_lock
+    _page_pool = None
+    _page_pool_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_page_pool_after_fork)
+
+def _init_page_pool_worker(memory_mb):
+    """Pool initializer: cap the worker's address space like the PDF sandbox does"""
+    sys.stdout.flush()
+    current = _current_address_space_bytes()
+    if current:
+        limit = current + memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def get_page_pool():
+    """This process's page pool, created on first use"""
+    global _page_pool
+    from concurrent.futures import ProcessPoolExecutor
+
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACTION_WORKERS,
+                mp_context=get_pdf_process_context(),
+                initializer=_init_page_pool_worker,
+                initargs=(PDF_SANDBOX_MEMORY_MB,)
+            )
+            print(f"⚡ Started page pool with {PDF_EXTRACTION_WORKERS} processes in process {os.getpid()}")
+        return _page_pool
+
+def discard_page_pool(pool):
+    """Kill a pool whose worker crashed or hung; the next caller starts a fresh one"""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is pool:
+            _page_pool = None
+
+    # ProcessPoolExecutor has no public way to stop a running task
+    for process in list((pool._processes or {}).values()):
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+class SharedPDF:
+    """PDF bytes copied once into a named shared memory segment for the page pool or sandbox
+
+    Use as a context manager; the segment is unlinked on exit (workers that
+    still have it open keep their mapping until they move on).
+    """
 
-        # "Appendix" or "APPENDIX" followed by colon or newline (section header style)
-        r'\n---\s+Page\s+\d+\s+---\s*\n+\s*Appendix\s*[:\n]',
-        r'\n---\s+Page\s+\d+\s+---\s*\n+\s*APPENDIX\s*[:\n]',
+    def __init__(self, pdf_bytes):
+        self.size = len(pdf_bytes)
+        self._segment = shared_memory.SharedMemory(create=True, size=max(1, self.size))
+        self._segment.buf[:self.size] = pdf_bytes
+        self.name = self._segment.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._segment.close()
+        self._segment.unlink()
+
+def _open_shared_pdf(name, size):
+    """Pool worker side: the document in shared memory segment `name`, opened once per document"""
+    global _worker_document
+
+    if _worker_document is None or _worker_document[0] != name:
+        if _worker_document is not None:
+            _, segment, doc = _worker_document
+            _worker_document = None
+            doc.close()
+            del doc
+            try:
+                segment.close()
+            except BufferError:
+                pass  # Still referenced; unmapped when collected
 
-        # "Appendices" as section header
-        r'\n---\s+Page\s+\d+\s+---\s*\n+\s*Appendices\s*[:\n]',
-        r'\n---\s+Page\s+\d+\s+---\s*\n+\s*APPENDICES\s*[:\n]',
+        segment = shared_memory.SharedMemory(name=name)
+        doc = fitz.open(stream=segment.buf[:size], filetype="pdf")
+        _worker_document = (name, segment, doc)
 
-        # Alternative: Multiple newlines + "Appendix" at line start
-        r'\n\n\n+\s*Appendix\s+[A-Z0-9]',
-        r'\n\n\n+\s*APPENDIX\s+[A-Z0-9]',
-        r'\n\n\n+\s*Appendices\s*[:\n]',
-    ]
+    return _worker_document[2]
 
-    earliest_match = None
-    earliest_pos = len(text_content)
+def run_in_page_pool(pdf_bytes, task, task_args, timeout=None, on_result=None):
+    """Run task(segment name, size, *args) in the page pool for each args in task_args
 
-    for pattern in patterns:
-        match = re.search(pattern, text_content, re.IGNORECASE)
-        if match and match.start() < earliest_pos:
-            earliest_pos = match.start()
-            earliest_match = match
+    Results are collected in submission order; on_result(results so far),
+    if given, is called after each one and returning True stops early,
+    cancelling tasks that haven't started.
 
-    if earliest_match:
-        truncated = text_content[:earliest_pos].strip()
-        removed = len(text_content) - len(truncated)
-        print(f"📋 Appendix detected at position {earliest_pos}")
-        print(f"   Truncating {removed:,} characters ({removed/len(text_content)*100:.1f}% of document)")
-        return truncated, True, removed
+    Raises:
+        PDFSandboxError: if a worker crashes or the batch exceeds timeout
+                         (the pool is replaced)
+    """
+    from concurrent.futures import TimeoutError as FuturesTimeoutError
+    from concurrent.futures.process import BrokenProcessPool
 
-    return text_content, False, 0
+    pool = get_page_pool()
+    deadline = time.monotonic() + (timeout or PDF_SANDBOX_TIMEOUT)
+    results = []
 
-def extract_text_and_images_with_pymupdf(pdf_bytes):
-    """Extract text and images using PyMuPDF (fast and comprehensive)"""
+    with SharedPDF(pdf_bytes) as shared:
+        futures = [pool.submit(task, shared.name, shared.size, *args) for args in task_args]
+        try:
+            for future in futures:
+                results.append(future.result(timeout=max(0, deadline - time.monotonic())))
+                if on_result and on_result(results):
+                    break
+        except FuturesTimeoutError:
+            discard_page_pool(pool)
+            raise PDFSandboxError(f"{task.__name__} timed out after {timeout or PDF_SANDBOX_TIMEOUT:.0f}s")
+        except BrokenProcessPool:
+            discard_page_pool(pool)
+            raise PDFSandboxError(f"{task.__name__} crashed a page pool worker")
+        finally:
+            for future in futures:
+                future.cancel()
+
+    return results
+
+def get_image_stream_length(doc, xref):
+    """Compressed size of an image stream, read from its /Length without decoding it"""
     try:
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        text_content = ""
-        images = []
+        value_type, value = doc.xref_get_key(xref, "Length")
+        if value_type == 'int':
+            return int(value)
+    except Exception:
+        pass
+    return 0
+
+# Layout pre-filter for table detection: pages with no ruling lines and no
+# column-aligned numeric text are prose, so the table extractor skips them
+TABLE_PAGE_PREFILTER = os.environ.get('TABLE_PAGE_PREFILTER', 'true').lower() in ('1', 'true', 'yes')
+TABLE_MIN_RULING_LINES = 4  # Horizontal/vertical segments or rectangles
+TABLE_MIN_ALIGNED_COLUMNS = 3  # Distinct left edges shared by 3+ short text blocks
+TABLE_MIN_NUMERIC_DENSITY = 0.2  # Share of tokens that are numbers, amounts or percentages
+TABLE_SHORT_BLOCK_CHARS = 40
+
+NUMERIC_TOKEN_RE = re.compile(r'^[(\-$€£]?\d[\d,.]*%?[)MBKmbk]?$')
+
+def count_ruling_lines(page):
+    """Count horizontal/vertical line segments and rectangles drawn on a page"""
+    get_drawings = getattr(page, 'get_cdrawings', page.get_drawings)  # C-level variant is much faster
+    rulings = 0
+    for path in get_drawings():
+        for item in path['items']:
+            if item[0] == 're':
+                rulings += 1
+            elif item[0] == 'l':
+                (x1, y1), (x2, y2) = item[1], item[2]
+                if abs(x1 - x2) < 1 or abs(y1 - y2) < 1:
+                    rulings += 1
+    return rulings
+
+def is_table_candidate_page(page, textpage, page_text):
+    """Cheap layout check: could this page contain a table?
+
+    Ruling lines alone qualify a page (line-based table detection needs
+    them). Otherwise short text blocks must line up in several columns and a
+    good share of the tokens must be numeric.
+    """
+    if count_ruling_lines(page) >= TABLE_MIN_RULING_LINES:
+        return True
+
+    tokens = page_text.split()
+    numeric = sum(1 for token in tokens if NUMERIC_TOKEN_RE.match(token))
+    if numeric < TABLE_MIN_NUMERIC_DENSITY * max(1, len(tokens)):
+        return False
+
+    column_counts = {}
+    for block in page.get_text('blocks', textpage=textpage):
+        if block[6] == 0 and len(block[4].strip()) <= TABLE_SHORT_BLOCK_CHARS:
+            column = round(block[0] / 5)  # Bucket left edges to 5pt
+            column_counts[column] = column_counts.get(column, 0) + 1
+    aligned_columns = sum(1 for count in column_counts.values() if count >= 3)
+    return aligned_columns >= TABLE_MIN_ALIGNED_COLUMNS
+
+def compute_page_hash(page, page_text):
+    """Content hash of one page, stable across re-exports of an unchanged page
+
+    Hashes the page's drawing instructions plus its text (not its page
+    number), so a page that moved because others were inserted before it
+    still matches its earlier version.
+    """
+    digest = hashlib.sha256()
+    try:
+        digest.update(page.read_contents())
+    except Exception:
+        pass  # Damaged content streams still get a text-based hash
+    digest.update(page_text.encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
 
-        print(f"📄 Processing {len(doc)} pages with PyMuPDF...")
+def _extract_page_range(doc, start, end, on_pages=None):
+    """Extract text and embedded image metadata for pages [start, end) of an open document
 
-        for page_num, page in enumerate(doc):
-            # Extract text with better formatting
-            page_text = page.get_text("text")
-            text_content += f"\n--- Page {page_num + 1} ---\n{page_text}"
+    Appendix detection runs page by page: once a page opens the appendix
+    section, its text is cut at the boundary and the remaining pages in the
+    range are never parsed. on_pages, if given, is called with the number of
+    pages parsed so far roughly every 10% of the range.
 
-            # Extract images from this page
-            image_list = page.get_images()
-            for img_index, img in enumerate(image_list):
-                try:
-                    xref = img[0]
-                    base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    image_ext = base_image["ext"]
-
-                    images.append({
-                        'page': page_num + 1,
-                        'index': img_index,
-                        'bytes': image_bytes,
-                        'ext': image_ext,
-                        'size': len(image_bytes)
-                    })
-                except Exception as e:
-                    print(f"⚠️ Could not extract image {img_index} from page {page_num + 1}: {e}")
+    Returns:
+        list: one (page_text, page_images, is_appendix_start, is_table_candidate,
+              page_hash) tuple per page, in page order; only the last tuple can
+              have is_appendix_start set
+    """
+    pages = []
+    image_sizes = {}  # xref -> compressed size (headers/logos repeat the same xref)
+    report_every = max(1, (end - start) // 10)
+
+    for page_num in range(start, end):
+        page = doc[page_num]
+
+        # Extract text with better formatting, prefixed with its page marker
+        # (one text page is shared with the table pre-filter's block lookup)
+        textpage = page.get_textpage()
+        raw_text = page.get_text('text', textpage=textpage)
+        page_text = f"\n--- Page {page_num + 1} ---\n{raw_text}"
+        is_table_candidate = not TABLE_PAGE_PREFILTER or is_table_candidate_page(page, textpage, raw_text)
+        page_hash = compute_page_hash(page, raw_text)
+
+        # Stop at the appendix boundary so appendix pages are never parsed
+        appendix_pos = find_appendix_start(page_text)
+        if appendix_pos is not None:
+            page_text = page_text[:appendix_pos]
+
+        # Record image metadata only (xref, dimensions, compressed size).
+        # Bytes are pulled later, and only for the few images that get
+        # shortlisted for Vision (see load_image_bytes)
+        page_images = []
+        for img_index, img in enumerate(page.get_images(full=True)):
+            xref = img[0]
+            if xref not in image_sizes:
+                image_sizes[xref] = get_image_stream_length(doc, xref)
+
+            page_images.append({
+                'xref': xref,
+                'page': page_num + 1,
+                'index': img_index,
+                'size': image_sizes[xref],
+                'width': img[2],
+                'height': img[3]
+            })
+
+        pages.append((page_text, page_images, appendix_pos is not None, is_table_candidate, page_hash))
+
+        if appendix_pos is not None:
+            break
+
+        if on_pages and len(pages) % report_every == 0:
+            on_pages(len(pages))
+
+    return pages
+
+def _extract_page_range_worker(name, size, start, end):
+    """Page pool task: extract one page range of the PDF in shared memory segment `name`"""
+    return _extract_page_range(_open_shared_pdf(name, size), start, end)
+
+def extract_page_range_from_buffer(pdf_bytes, start, end, on_pages=None):
+    """Open a PDF buffer and extract pages [start, end) (runs inside the PDF sandbox)"""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return _extract_page_range(doc, start, end, on_pages=on_pages)
+    finally:
+        doc.close()
+
+def split_page_range(page_count, chunks):
+    """Split [0, page_count) into at most `chunks` contiguous (start, end) ranges"""
+    if page_count <= 0:
+        return []
+    chunk_size = -(-page_count // max(1, chunks))  # Ceiling division
+    return [(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+
+def extract_pages_parallel(pdf_bytes, page_count, workers=None, on_pages=None):
+    """Extract all pages across the page pool, returning results in page order
+
+    Stops at the first range that hits the appendix boundary and cancels
+    ranges that haven't started yet. on_pages, if given, is called with the
+    number of pages parsed so far as each range is collected.
+    """
+    workers = min(workers or PDF_EXTRACTION_WORKERS, page_count)
+    # Twice as many ranges as workers so a slow range doesn't leave cores idle
+    ranges = split_page_range(page_count, workers * 2)
+
+    print(f"⚡ Parallel extraction: {page_count} pages across {workers} processes ({len(ranges)} ranges)")
+
+    def on_range(range_results):
+        if on_pages:
+            on_pages(sum(len(pages) for pages in range_results))
+        return bool(range_results[-1]) and range_results[-1][-1][2]  # Appendix reached
 
-        # Truncate at appendix before returning
-        text_content, was_truncated, removed_chars = truncate_at_appendix(text_content)
+    range_results = run_in_page_pool(pdf_bytes, _extract_page_range_worker, ranges, on_result=on_range)
+    return [page for pages in range_results for page in pages]
 
-        print(f"✅ PyMuPDF: Extracted {len(text_content)} chars of text and {len(images)} images")
-        return text_content.strip(), images
+def extract_pages(pdf_bytes, page_count, on_pages=None):
+    """Per-page results for a whole document, parsed outside this process
+
+    Documents of PARALLEL_EXTRACTION_MIN_PAGES or more go to the page pool;
+    shorter ones, or any document if the pool can't be used, are parsed in
+    the PDF sandbox.
+    """
+    if PDF_EXTRACTION_WORKERS > 1 and page_count >= PARALLEL_EXTRACTION_MIN_PAGES:
+        try:
+            return extract_pages_parallel(pdf_bytes, page_count, on_pages=on_pages)
+        except PDFSandboxError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Parallel extraction failed, falling back to single process: {e}")
+
+    return run_in_sandbox(extract_page_range_from_buffer, (pdf_bytes, 0, page_count), {'on_pages': on_pages})
+
+IMAGE_HASH_SIZE = 16  # 16x16 average hash = 256-bit perceptual fingerprint
+IMAGE_DUPLICATE_HASH_DISTANCE = 10  # Max differing bits (of 256) to count as the same picture
+
+def compute_average_hash(pil_img):
+    """Perceptual average hash of a PIL image, as an int"""
+    hash_pixels = np.asarray(pil_img.convert('L').resize((IMAGE_HASH_SIZE, IMAGE_HASH_SIZE)), dtype=np.float32)
+    bits = (hash_pixels > hash_pixels.mean()).flatten()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+def is_same_picture(a, b):
+    """True if two hashed images are near-identical and have the same shape"""
+    if a.get('average_hash') is None or b.get('average_hash') is None:
+        return False
+    aspect_a = a['width'] / max(1, a['height'])
+    aspect_b = b['width'] / max(1, b['height'])
+    if abs(aspect_a - aspect_b) > 0.05 * max(aspect_a, aspect_b):
+        return False
+    return bin(a['average_hash'] ^ b['average_hash']).count('1') <= IMAGE_DUPLICATE_HASH_DISTANCE
+
+def deduplicate_images(images):
+    """Merge images that are the same picture embedded under different xrefs
+
+    The largest copy is kept and 'pages' lists every page that shows it.
+    """
+    unique_images = []
+
+    for img in images:
+        try:
+            pil_img = Image.open(BytesIO(img['bytes']))
+            pil_img.draft('L', (64, 64))  # Fast JPEG downscale-on-decode
+            img = {**img, 'average_hash': compute_average_hash(pil_img)}
+        except Exception:
+            img = {**img, 'average_hash': None}
+
+        match = next((u for u in unique_images if is_same_picture(u, img)), None)
+        if match is None:
+            unique_images.append(img)
+            continue
+
+        pages = sorted(set(match['pages']) | set(img['pages']))
+        if img['size'] > match['size']:
+            match.update({k: v for k, v in img.items() if k != 'pages'})
+        match['pages'] = pages
+        match['page'] = pages[0]
+
+    if len(unique_images) < len(images):
+        print(f"🔁 Merged {len(images) - len(unique_images)} duplicate images by perceptual hash")
+    return unique_images
+
+def extract_text_and_images_with_pymupdf(pdf_bytes, progress=None, page_count=None):
+    """Extract text and images using PyMuPDF (fast and comprehensive)
+
+    Pages are parsed in the page pool or the PDF sandbox (see
+    extract_pages), never in this process. page_count comes from
+    prevalidation if the caller has it. progress, if given, receives
+    "Parsed X of N pages" detail events.
 
+    Returns:
+        tuple: (text, image metadata list, body_page_count, page_offsets,
+               table_pages, page_hashes, scanned_pages) where body_page_count
+               is the last page before the appendix (or the full page count if
+               none was found), page_offsets[i] is the character offset in
+               text where page i+1 starts, table_pages lists the body pages
+               that passed the table layout pre-filter, page_hashes[i] is the
+               content hash of page i+1 and scanned_pages lists the body pages
+               with almost no text layer (see is_scanned_page)
+    """
+    try:
+        if page_count is None:
+            page_count = run_in_sandbox(inspect_pdf, (pdf_bytes,), timeout=PDF_PREVALIDATION_TIMEOUT,
+                                        cpu_seconds=PDF_PREVALIDATION_CPU_SECONDS)['page_count']
+        print(f"📄 Processing {page_count} pages with PyMuPDF...")
+
+        def report_pages(pages_parsed):
+            if progress:
+                progress('text_images', detail=f"Parsed {pages_parsed} of {page_count} pages")
+
+        page_results = extract_pages(pdf_bytes, page_count, on_pages=report_pages)
+
+        # Reassemble in page order (join, not repeated +=, to stay linear on long reports)
+        text_parts = []
+        page_offsets = []
+        text_length = 0
+        images_by_xref = {}
+        table_pages = []
+        page_hashes = []
+        scanned_pages = []
+        body_page_count = page_count
+        for page_num, (page_text, page_images, is_appendix_start, is_table_candidate, page_hash) in enumerate(page_results):
+            text_parts.append(page_text)
+            page_hashes.append(page_hash)
+            # The appendix page's text is cut at the boundary, so it can look scanned
+            if not is_appendix_start and is_scanned_page(page_text, page_images):
+                scanned_pages.append(page_num + 1)
+            if is_table_candidate:
+                table_pages.append(page_num + 1)
+            page_offsets.append(text_length)
+            text_length += len(page_text)
+
+            # One entry per unique xref, recording every page that shows it
+            for img in page_images:
+                unique = images_by_xref.get(img['xref'])
+                if unique is None:
+                    images_by_xref[img['xref']] = {**img, 'pages': [img['page']]}
+                elif img['page'] not in unique['pages']:
+                    unique['pages'].append(img['page'])
+
+            if is_appendix_start:
+                body_page_count = page_num + 1
+                print(f"📋 Appendix detected on page {body_page_count} - "
+                      f"skipped {page_count - body_page_count} appendix pages")
+                break
+        text_content = "".join(text_parts)
+        images = list(images_by_xref.values())
+
+        # Keep the offset index aligned with the stripped text
+        leading = len(text_content) - len(text_content.lstrip())
+        text_content = text_content.strip()
+        page_offsets = [max(0, offset - leading) for offset in page_offsets]
+
+        print(f"✅ PyMuPDF: Extracted {len(text_content)} chars of text and {len(images)} unique images (metadata only)")
+        if scanned_pages:
+            print(f"🖨️ {len(scanned_pages)} scanned pages with no usable text layer: {scanned_pages}")
+        return text_content, images, body_page_count, page_offsets, table_pages, page_hashes, scanned_pages
+
+    except PDFSandboxError:
+        raise
     except Exception as e:
         print(f"❌ PyMuPDF extraction error: {e}")
         import traceback
         traceback.print_exc()
+        return None, [], None, [], None, [], []
+
+# ========== Fast first question (two-phase extraction) ==========
+# Phase one extracts only the first pages plus the executive summary, so the
+# wizard can analyze key details and launch the panel within seconds. Phase
+# two (full text, tables, Vision) keeps running in the background job and its
+# key details are merged into the session's topic pool between turns.
+
+FAST_FIRST_QUESTION = os.environ.get('FAST_FIRST_QUESTION', 'true').lower() in ('1', 'true', 'yes')
+FAST_PREVIEW_PAGES = int(os.environ.get('FAST_PREVIEW_PAGES', 5))
+FAST_SUMMARY_PAGES = 2  # Pages taken from an executive summary found past the preview
+
+EXECUTIVE_SUMMARY_RE = re.compile(r'^\s*executive\s+summary\b', re.IGNORECASE | re.MULTILINE)
+
+def extract_preview_text(pdf_bytes, max_pages=None):
+    """Extract text from the first pages and the executive summary only (no tables or images)
+
+    Returns:
+        tuple: (text, page numbers included), or (None, []) on error
+    """
+    max_pages = max_pages or FAST_PREVIEW_PAGES
+
+    try:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            page_count = len(doc)
+            preview_pages = list(range(min(max_pages, page_count)))
+            page_texts = {}
+
+            for page_num in preview_pages:
+                page_texts[page_num] = doc[page_num].get_text('text')
+
+            # Reports often open with a cover, contents and team pages; if the
+            # executive summary starts later, add its first pages too
+            if not any(EXECUTIVE_SUMMARY_RE.search(text) for text in page_texts.values()):
+                for page_num in range(len(preview_pages), page_count):
+                    text = doc[page_num].get_text('text')
+                    if find_appendix_start(text) is not None:
+                        break
+                    if EXECUTIVE_SUMMARY_RE.search(text):
+                        for summary_page in range(page_num, min(page_num + FAST_SUMMARY_PAGES, page_count)):
+                            page_texts[summary_page] = doc[summary_page].get_text('text')
+                        break
+        finally:
+            doc.close()
+
+        text_parts = []
+        for page_num in sorted(page_texts):
+            page_text = f"\n--- Page {page_num + 1} ---\n{page_texts[page_num]}"
+            appendix_pos = find_appendix_start(page_text)
+            if appendix_pos is not None:
+                text_parts.append(page_text[:appendix_pos])
+                break
+            text_parts.append(page_text)
+
+        text_content = "".join(text_parts).strip()
+        pages_included = [page_num + 1 for page_num in sorted(page_texts)][:len(text_parts)]
+        print(f"⚡ Preview: {len(text_content)} chars from pages {pages_included}")
+        return text_content, pages_included
+
+    except Exception as e:
+        print(f"❌ Preview extraction error: {e}")
         return None, []
 
-def extract_tables_with_pdfplumber(pdf_bytes):
-    """Extract tables using pdfplumber (best table detection)"""
+def select_table_pages(total_pages, last_page=None, pages=None):
+    """0-based page indexes to scan: the given 1-based pages, else all up to last_page"""
+    limit = min(last_page, total_pages) if last_page else total_pages
+    if pages is None:
+        return list(range(limit))
+    return [page - 1 for page in sorted(set(pages)) if 1 <= page <= limit]
+
+def extract_tables_with_pdfplumber(pdf_bytes, last_page=None, progress=None, pages=None):
+    """Extract tables using pdfplumber (best table detection)
+
+    Only pages up to last_page are scanned (appendix pages are skipped), and
+    only the given 1-based pages if pages is set (see the layout pre-filter).
+    progress, if given, receives "Scanned X of N pages" detail events.
+    """
     try:
         tables_data = []
 
-        with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
-            print(f"📊 Scanning {len(pdf.pages)} pages for tables with pdfplumber...")
+        with pdfplumber.open(PDFBufferReader(pdf_bytes)) as pdf:
+            page_indexes = select_table_pages(len(pdf.pages), last_page, pages)
+            print(f"📊 Scanning {len(page_indexes)} of {len(pdf.pages)} pages for tables with pdfplumber...")
+            report_every = max(1, len(page_indexes) // 10)
 
-            for page_num, page in enumerate(pdf.pages):
-                tables = page.extract_tables()
+            for scanned, page_num in enumerate(page_indexes, 1):
+                tables = pdf.pages[page_num].extract_tables()
 
                 if tables:
                     for table_index, table in enumerate(tables):
@@ -352,7 +1328,13 @@ def extract_tables_with_pdfplumber(pdf_bytes):
                                 'cols': len(table[0]) if table else 0
                             })
 
+                if progress and scanned % report_every == 0:
+                    progress('tables', detail=f"Scanned {scanned} of {len(page_indexes)} pages - "
+                                              f"{len(tables_data)} tables found")
+
         print(f"✅ pdfplumber: Found {len(tables_data)} tables")
+        if progress:
+            progress('tables', detail=f"Found {len(tables_data)} tables")
         return tables_data
 
     except Exception as e:
@@ -361,66 +1343,409 @@ def extract_tables_with_pdfplumber(pdf_bytes):
         traceback.print_exc()
         return []
 
-def analyze_images_with_vision(images, max_images=5):
-    """Analyze important embedded images using OpenAI Vision API"""
-    if not openai_available or not openai_client:
-        print("⚠️ OpenAI not available - skipping image analysis")
-        return []
+def extract_tables_with_pymupdf(pdf_bytes, last_page=None, progress=None, pages=None):
+    """Extract tables using PyMuPDF's native find_tables (no second PDF parser)
 
-    if not images:
+    Same arguments and output shape as extract_tables_with_pdfplumber.
+    """
+    try:
+        tables_data = []
+
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            page_indexes = select_table_pages(len(doc), last_page, pages)
+            print(f"📊 Scanning {len(page_indexes)} of {len(doc)} pages for tables with PyMuPDF...")
+            report_every = max(1, len(page_indexes) // 10)
+
+            for scanned, page_num in enumerate(page_indexes, 1):
+                for table_index, table in enumerate(doc[page_num].find_tables().tables):
+                    data = table.extract()
+                    if data and len(data) > 0:
+                        tables_data.append({
+                            'page': page_num + 1,
+                            'index': table_index,
+                            'data': data,
+                            'rows': len(data),
+                            'cols': len(data[0]) if data else 0
+                        })
+
+                if progress and scanned % report_every == 0:
+                    progress('tables', detail=f"Scanned {scanned} of {len(page_indexes)} pages - "
+                                              f"{len(tables_data)} tables found")
+        finally:
+            doc.close()
+
+        print(f"✅ PyMuPDF: Found {len(tables_data)} tables")
+        if progress:
+            progress('tables', detail=f"Found {len(tables_data)} tables")
+        return tables_data
+
+    except Exception as e:
+        print(f"❌ PyMuPDF table extraction error: {e}")
+        import traceback
+        traceback.print_exc()
         return []
 
+# Table detection backends, selected with TABLE_EXTRACTION_BACKEND. pdfplumber
+# has the best recall; PyMuPDF reuses the fast MuPDF parser (see
+# 'python benchmark.py tables' to compare them on a corpus)
+TABLE_EXTRACTORS = {
+    'pdfplumber': extract_tables_with_pdfplumber,
+    'pymupdf': extract_tables_with_pymupdf
+}
+TABLE_EXTRACTION_BACKEND = os.environ.get('TABLE_EXTRACTION_BACKEND', 'pdfplumber')
+
+def extract_tables(pdf_bytes, last_page=None, progress=None, backend=None, pages=None):
+    """Extract tables with the configured backend ({page, index, data, rows, cols} per table)
+
+    pages limits detection to those 1-based pages (None scans every page up to last_page).
+    """
+    extractor = TABLE_EXTRACTORS.get(backend or TABLE_EXTRACTION_BACKEND)
+    if extractor is None:
+        print(f"⚠️ Unknown table backend '{backend or TABLE_EXTRACTION_BACKEND}', using pdfplumber")
+        extractor = extract_tables_with_pdfplumber
+    return extractor(pdf_bytes, last_page, progress, pages)
+
+# Per-page table results are cached by page content hash, so a revised upload
+# of the same plan only re-scans the pages that actually changed
+PAGE_CACHE_ENABLED = os.environ.get('PAGE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+def extract_tables_incrementally(pdf_bytes, last_page=None, progress=None, pages=None, page_hashes=None):
+    """Extract tables, reusing per-page results from earlier versions of the document
+
+    Pages whose content hash (see compute_page_hash) is in the page cache
+    are not scanned again; only new or changed pages go through the table
+    backend in the PDF sandbox. Cached tables are renumbered to the page
+    they sit on in this version.
+
+    Raises:
+        PDFSandboxError: if scanning the changed pages crashes or exceeds its limits
+    """
+    if not PAGE_CACHE_ENABLED or not page_hashes:
+        return sandboxed(extract_tables)(pdf_bytes, last_page, progress, pages=pages)
+
+    limit = min(last_page or len(page_hashes), len(page_hashes))
+    scan_pages = [page for page in sorted(set(pages if pages is not None else range(1, limit + 1)))
+                  if 1 <= page <= limit]
+    cache_version = f"{EXTRACTOR_VERSION}-{TABLE_EXTRACTION_BACKEND}"
+
     try:
-        # Sort images by size and take the largest ones (likely most important)
-        sorted_images = sorted(images, key=lambda x: x['size'], reverse=True)
-        images_to_analyze = sorted_images[:max_images]
+        cached = db.get_page_cache_many([page_hashes[page - 1] for page in scan_pages], cache_version)
+    except Exception as e:
+        print(f"⚠️ Page cache unavailable, scanning every page: {e}")
+        cached = {}
 
-        print(f"🖼️ Analyzing {len(images_to_analyze)} embedded images with Vision API...")
+    changed_pages = [page for page in scan_pages if page_hashes[page - 1] not in cached]
+    print(f"♻️ Page cache: reused {len(scan_pages) - len(changed_pages)} of {len(scan_pages)} pages, "
+          f"scanning {len(changed_pages)} new or changed pages")
+    if progress and len(changed_pages) < len(scan_pages):
+        progress('tables', detail=f"Reused {len(scan_pages) - len(changed_pages)} unchanged pages")
 
-        image_descriptions = []
+    fresh_by_page = {page: [] for page in changed_pages}
+    if changed_pages:
+        for table in sandboxed(extract_tables)(pdf_bytes, last_page, progress, pages=changed_pages):
+            fresh_by_page.setdefault(table['page'], []).append(table)
 
-        for img in images_to_analyze:
-            try:
-                # Convert image bytes to base64
-                img_b64 = base64.b64encode(img['bytes']).decode('utf-8')
-
-                # Determine image format
-                mime_type = f"image/{img['ext']}" if img['ext'] in ['png', 'jpeg', 'jpg', 'gif', 'webp'] else "image/png"
-
-                # Analyze with Vision API
-                response = openai_client.chat.completions.create(
-                    model="gpt-4o",  # Using GPT-4o for vision
-                    messages=[{
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Analyze this image from a business report. Describe what it shows (chart, graph, diagram, etc.), extract any visible data or trends, and explain its business significance. Be concise but thorough."
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{mime_type};base64,{img_b64}",
-                                    "detail": "high"
-                                }
-                            }
-                        ]
-                    }],
-                    max_tokens=500
-                )
+    tables_data = []
+    for page in scan_pages:
+        page_tables = fresh_by_page[page] if page in fresh_by_page else cached[page_hashes[page - 1]]
+        tables_data.extend({**table, 'page': page} for table in page_tables)
 
-                description = response.choices[0].message.content
-                image_descriptions.append({
-                    'page': img['page'],
-                    'description': description
-                })
+    try:
+        db.save_page_cache({page_hashes[page - 1]: fresh_by_page[page] for page in changed_pages}, cache_version)
+    except Exception as e:
+        print(f"⚠️ Could not save page cache: {e}")
+
+    return tables_data
+
+# Vision calls are pure network wait, so issue them concurrently (bounded)
+VISION_MAX_IN_FLIGHT = int(os.environ.get('VISION_MAX_IN_FLIGHT', 5))
+VISION_CALL_TIMEOUT = float(os.environ.get('VISION_CALL_TIMEOUT', 45))
+
+# 'per_image': one request per image | 'batched': up to VISION_BATCH_SIZE images per request
+VISION_MODE = os.environ.get('VISION_MODE', 'per_image')
+VISION_BATCH_SIZE = int(os.environ.get('VISION_BATCH_SIZE', 5))
+
+IMAGE_ANALYSIS_PROMPT = "Analyze this image from a business report. Describe what it shows (chart, graph, diagram, etc.), extract any visible data or trends, and explain its business significance. Be concise but thorough."
+
+# GPT-4o vision resolution limits: 'low' sees a 512px image; 'high' fits the
+# image in 2048x2048 then scales the short side to 768px before tiling.
+# Anything larger is uploaded only to be downscaled by the provider.
+VISION_LOW_DETAIL_MAX_SIDE = 512
+VISION_HIGH_DETAIL_MAX_SIDE = 2048
+VISION_HIGH_DETAIL_SHORT_SIDE = 768
+
+def flatten_to_rgb(pil_img):
+    """Convert to RGB, compositing any transparency onto white
+
+    A plain convert('RGB') drops alpha, which turns the transparent
+    background of a PNG chart black and can hide dark lines and labels.
+    """
+    if pil_img.mode == 'P' and 'transparency' in pil_img.info:
+        pil_img = pil_img.convert('RGBA')
+    if pil_img.mode in ('RGBA', 'LA', 'PA'):
+        pil_img = pil_img.convert('RGBA')
+        background = Image.new('RGB', pil_img.size, (255, 255, 255))
+        background.paste(pil_img, mask=pil_img.getchannel('A'))
+        return background
+    return pil_img.convert('RGB')
+
+def preprocess_image_for_vision(img):
+    """Downscale and recompress an embedded image to what the Vision API will actually use
+
+    Small images go as 'low' detail; larger ones are resized to the 'high'
+    detail working resolution. Images with few colours (charts, diagrams)
+    are saved as palette PNG so lines and labels stay crisp; photographic
+    images are saved as JPEG.
+
+    Returns:
+        tuple: (mime_type, image_bytes, detail)
+    """
+    original_mime = f"image/{img['ext']}" if img['ext'] in ['png', 'jpeg', 'jpg', 'gif', 'webp'] else "image/png"
+
+    try:
+        pil_img = flatten_to_rgb(Image.open(BytesIO(img['bytes'])))
+    except Exception:
+        # Undecodable locally - send the original bytes untouched
+        return original_mime, img['bytes'], "high"
+
+    width, height = pil_img.size
+    resized = False
+
+    if max(width, height) <= VISION_LOW_DETAIL_MAX_SIDE:
+        detail = "low"
+    else:
+        detail = "high"
+        scale = min(
+            1.0,
+            VISION_HIGH_DETAIL_MAX_SIDE / max(width, height),
+            VISION_HIGH_DETAIL_SHORT_SIDE / min(width, height)
+        )
+        if scale < 1.0:
+            pil_img = pil_img.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+            resized = True
+
+    output = BytesIO()
+    if pil_img.getcolors(maxcolors=256) is not None:
+        pil_img.convert('P', palette=Image.ADAPTIVE, colors=256).save(output, format='PNG', optimize=True)
+        mime_type = "image/png"
+    else:
+        pil_img.save(output, format='JPEG', quality=85, optimize=True)
+        mime_type = "image/jpeg"
+
+    # Recompressing an already-compact original at full size can make it bigger
+    if not resized and len(output.getvalue()) >= len(img['bytes']) and img['ext'] in ['png', 'jpeg', 'jpg', 'gif', 'webp']:
+        return original_mime, img['bytes'], detail
+
+    return mime_type, output.getvalue(), detail
+
+def encode_image_for_vision(img):
+    """Build the image_url content part for an embedded image"""
+    mime_type, image_bytes, detail = preprocess_image_for_vision(img)
+
+    print(f"   🗜️ Page {img['page']} image: {len(img['bytes']) / 1024:.0f} KB → "
+          f"{len(image_bytes) / 1024:.0f} KB ({mime_type}, detail={detail})")
+
+    # Convert image bytes to base64
+    img_b64 = base64.b64encode(image_bytes).decode('utf-8')
+
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": f"data:{mime_type};base64,{img_b64}",
+            "detail": detail
+        }
+    }
+
+def get_vision_prompt_name(prompt, batched=False):
+    """Name Vision calls are recorded under in prompt usage (text parts only; images are billed apart)"""
+    name = 'scanned_page' if prompt == SCANNED_PAGE_PROMPT else 'image_description'
+    return f"{name}_batch" if batched else name
+
+def analyze_single_image_with_vision(img, timeout=None, usage_log=None, prompt=None):
+    """Describe one embedded image with the Vision API (prompt defaults to IMAGE_ANALYSIS_PROMPT)"""
+    messages = [{
+        "role": "user",
+        "content": [
+            {"type": "text", "text": prompt or IMAGE_ANALYSIS_PROMPT},
+            encode_image_for_vision(img)
+        ]
+    }]
+    response = openai_client.chat.completions.create(
+        model="gpt-4o",  # Using GPT-4o for vision
+        messages=messages,
+        max_tokens=500,
+        timeout=timeout or VISION_CALL_TIMEOUT
+    )
+    record_prompt_usage(get_vision_prompt_name(prompt), messages, response)
 
-                print(f"✅ Analyzed embedded image from page {img['page']}")
+    if usage_log is not None and response.usage:
+        usage_log.append(response.usage)
 
+    return response.choices[0].message.content
+
+def analyze_image_batch_with_vision(batch, timeout=None, usage_log=None, prompt=None):
+    """Describe several embedded images in a single Vision API request
+
+    Images are numbered in the message and the model returns a JSON array
+    with one description per image number.
+
+    Returns:
+        list: one description per image in batch order (None if the model skipped it)
+    """
+    content = [{
+        "type": "text",
+        "text": f"""You will see {len(batch)} images from a business report, each labelled "Image N (page P)".
+
+For EACH image: {prompt or IMAGE_ANALYSIS_PROMPT}
+
+Return ONLY a JSON object: {{"images": [{{"image": 1, "page": <page>, "description": "..."}}, ...]}} with exactly one entry per image, in order."""
+    }]
+
+    for image_number, img in enumerate(batch, 1):
+        content.append({"type": "text", "text": f"Image {image_number} (page {img['page']}):"})
+        content.append(encode_image_for_vision(img))
+
+    messages = [{"role": "user", "content": content}]
+    response = openai_client.chat.completions.create(
+        model="gpt-4o",
+        messages=messages,
+        response_format={"type": "json_object"},
+        max_tokens=500 * len(batch),
+        timeout=timeout or VISION_CALL_TIMEOUT
+    )
+    record_prompt_usage(get_vision_prompt_name(prompt, batched=True), messages, response)
+
+    if usage_log is not None and response.usage:
+        usage_log.append(response.usage)
+
+    result = json.loads(response.choices[0].message.content)
+    by_number = {}
+    for item in result.get('images', []):
+        try:
+            by_number[int(item['image'])] = item['description']
+        except (KeyError, TypeError, ValueError):
+            continue
+
+    descriptions = []
+    for image_number, img in enumerate(batch, 1):
+        if not by_number.get(image_number):
+            print(f"⚠️ Batched vision response missing image {image_number} (page {img['page']})")
+        descriptions.append(by_number.get(image_number))
+
+    return descriptions
+
+# Bump whenever IMAGE_ANALYSIS_PROMPT, the Vision model or the image
+# preprocessing changes so cached descriptions from the old setup are not reused
+VISION_PROMPT_VERSION = 'gpt-4o-v2'
+
+def get_image_content_hash(img):
+    """SHA-256 of an embedded image's raw bytes (key for the Vision description cache)"""
+    return hashlib.sha256(img['bytes']).hexdigest()
+
+def analyze_images_with_vision(images, max_images=5, max_in_flight=None, call_timeout=None,
+                               mode=None, usage_log=None, progress=None, prompt=None, use_cache=True):
+    """Analyze important embedded images using OpenAI Vision API
+
+    Descriptions are looked up in the cross-document Vision cache first (by
+    image content hash), so only unseen images cost an API call.
+
+    mode='per_image' sends one request per image; mode='batched' packs up to
+    VISION_BATCH_SIZE images into each request. Requests run concurrently
+    (at most max_in_flight at once, each bounded by call_timeout seconds).
+    Results keep the ranking order; requests that fail or time out are
+    skipped so partial results are still returned. Pass a list as usage_log
+    to collect token usage per request; pass progress to receive "Analyzed
+    image N of M" detail events. prompt replaces IMAGE_ANALYSIS_PROMPT (it
+    gets its own Vision cache entries). use_cache=False neither reads nor
+    writes the Vision cache, so every image costs a call (for benchmarks).
+    """
+    if not images:
+        return []
+
+    prompt_version = VISION_PROMPT_VERSION
+    if prompt:
+        prompt_version = f"{VISION_PROMPT_VERSION}-{hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]}"
+
+    try:
+        # Rank by local chart score when available, then by size (larger likely more important)
+        sorted_images = sorted(images, key=lambda x: (x.get('chart_score', 0), x['size']), reverse=True)
+        images_to_analyze = sorted_images[:max_images]
+
+        # Reuse descriptions of images already seen in any earlier document
+        image_hashes = [get_image_content_hash(img) for img in images_to_analyze]
+        descriptions = [None] * len(images_to_analyze)
+        cached = {}
+        if use_cache:
+            try:
+                cached = db.get_vision_cache_many(image_hashes, prompt_version)
             except Exception as e:
-                print(f"⚠️ Could not analyze image from page {img['page']}: {e}")
+                print(f"⚠️ Vision cache lookup failed: {e}")
+        for position, image_hash in enumerate(image_hashes):
+            descriptions[position] = cached.get(image_hash)
+
+        pending = [position for position, description in enumerate(descriptions) if description is None]
+        images_done = len(images_to_analyze) - len(pending)
+        if cached:
+            print(f"⚡ Vision cache: {images_done}/{len(images_to_analyze)} images already described")
+            if progress:
+                progress('vision', detail=f"{images_done} of {len(images_to_analyze)} images already analyzed")
+
+        if pending and (not openai_available or not openai_client):
+            print("⚠️ OpenAI not available - skipping image analysis")
+            pending = []
+
+        if pending:
+            mode = mode or VISION_MODE
+            if mode == 'batched':
+                batches = [pending[i:i + VISION_BATCH_SIZE] for i in range(0, len(pending), VISION_BATCH_SIZE)]
+
+                def analyze_func(batch, timeout, usage):
+                    return analyze_image_batch_with_vision([images_to_analyze[p] for p in batch], timeout, usage,
+                                                           prompt)
+            else:
+                batches = [[position] for position in pending]
+
+                def analyze_func(batch, timeout, usage):
+                    return [analyze_single_image_with_vision(images_to_analyze[batch[0]], timeout, usage, prompt)]
+
+            max_in_flight = max(1, min(max_in_flight or VISION_MAX_IN_FLIGHT, len(batches)))
+            call_timeout = call_timeout or VISION_CALL_TIMEOUT
+
+            print(f"🖼️ Analyzing {len(pending)} embedded images with Vision API "
+                  f"({mode}, {len(batches)} requests, {max_in_flight} in flight)...")
+
+            fresh = {}
+            with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+                futures = [pool.submit(analyze_func, batch, call_timeout, usage_log) for batch in batches]
+
+                # Collect in submission order so output order is deterministic
+                for batch, future in zip(batches, futures):
+                    pages = ', '.join(str(images_to_analyze[p]['page']) for p in batch)
+                    try:
+                        for position, description in zip(batch, future.result()):
+                            if description:
+                                descriptions[position] = description
+                                fresh[image_hashes[position]] = description
+                        print(f"✅ Analyzed embedded image(s) from page {pages}")
+                    except Exception as e:
+                        print(f"⚠️ Could not analyze image(s) from page {pages}: {e}")
+
+                    images_done += len(batch)
+                    if progress:
+                        progress('vision', detail=f"Analyzed image {images_done} of {len(images_to_analyze)}")
+
+            if use_cache:
+                try:
+                    db.save_vision_cache(fresh, prompt_version)
+                except Exception as e:
+                    print(f"⚠️ Could not save vision cache: {e}")
 
-        return image_descriptions
+        return [
+            {'page': img['page'], 'description': description}
+            for img, description in zip(images_to_analyze, descriptions)
+            if description
+        ]
 
     except Exception as e:
         print(f"❌ Vision API error: {e}")
@@ -428,6 +1753,252 @@ def analyze_images_with_vision(images, max_images=5):
         traceback.print_exc()
         return []
 
+# ========== Local chart-vs-decoration scoring (before any Vision call) ==========
+
+IMAGE_MIN_DIMENSION = 80  # Icons, bullets and tiny logos
+IMAGE_MAX_ASPECT_RATIO = 5.0  # Banners, rules and header strips
+IMAGE_MIN_CHART_SCORE = float(os.environ.get('IMAGE_MIN_CHART_SCORE', 0.35))
+
+def compute_image_features(img):
+    """Compute cheap visual features for an embedded image with Pillow + NumPy
+
+    Returns:
+        dict: width, height, aspect_ratio, colour_count, edge_density and
+              background_fraction, or None if the image can't be decoded
+    """
+    try:
+        pil_img = Image.open(BytesIO(img['bytes']))
+        width, height = pil_img.size
+        pil_img.draft('RGB', (256, 256))  # Fast JPEG downscale-on-decode
+        pil_img = flatten_to_rgb(pil_img)
+        pil_img.thumbnail((128, 128))
+    except Exception:
+        return None
+
+    pixels = np.asarray(pil_img, dtype=np.uint8)
+
+    # Distinct colours after quantizing to 5 bits/channel (photos have thousands, charts tens)
+    quantized = (pixels >> 3).astype(np.uint32)
+    packed = (quantized[..., 0] << 10) | (quantized[..., 1] << 5) | quantized[..., 2]
+    colour_count = len(np.unique(packed))
+
+    # Edge density from horizontal/vertical gradients of the greyscale image
+    grey = pixels.astype(np.float32).mean(axis=2)
+    grad_x = np.abs(np.diff(grey, axis=1))[:-1, :]
+    grad_y = np.abs(np.diff(grey, axis=0))[:, :-1]
+    edge_density = float(((grad_x + grad_y) > 40).mean()) if grad_x.size else 0.0
+
+    # Near-white background (charts and diagrams usually sit on a plain page)
+    background_fraction = float((pixels.min(axis=2) > 235).mean())
+
+    return {
+        'width': width,
+        'height': height,
+        'aspect_ratio': max(width, height) / max(1, min(width, height)),
+        'colour_count': colour_count,
+        'edge_density': edge_density,
+        'background_fraction': background_fraction
+    }
+
+def score_chart_likelihood(features):
+    """Score 0-1 for how likely an image is an information-dense chart/diagram"""
+    edge_score = min(features['edge_density'] / 0.08, 1.0)
+    background_score = min(features['background_fraction'] / 0.4, 1.0)
+    colour_score = 1.0 if features['colour_count'] <= 512 else 512 / features['colour_count']
+    return round(0.4 * edge_score + 0.3 * background_score + 0.3 * colour_score, 3)
+
+def is_decorative_image(features, chart_score):
+    """Decorative = icons, banners, flat fills, low-detail backgrounds or low chart score"""
+    return (
+        min(features['width'], features['height']) < IMAGE_MIN_DIMENSION
+        or features['aspect_ratio'] > IMAGE_MAX_ASPECT_RATIO
+        or features['colour_count'] < 3
+        or features['edge_density'] < 0.01
+        or chart_score < IMAGE_MIN_CHART_SCORE
+    )
+
+def select_chart_images(images):
+    """Score embedded images locally and drop decorative ones
+
+    Each kept image gets a 'chart_score' used to rank it for Vision analysis.
+    Images that can't be decoded locally are kept with a score of 0 so they
+    rank last rather than being silently lost. Near-duplicates are already
+    merged during extraction (see deduplicate_images).
+    """
+    if not images:
+        return []
+
+    selected = []
+    dropped_decorative = 0
+
+    for img in images:
+        features = compute_image_features(img)
+
+        if features is None:
+            selected.append({**img, 'chart_score': 0.0})
+            continue
+
+        chart_score = score_chart_likelihood(features)
+        if is_decorative_image(features, chart_score):
+            dropped_decorative += 1
+            continue
+
+        selected.append({**img, 'chart_score': chart_score})
+
+    selected.sort(key=lambda x: (x['chart_score'], x['size']), reverse=True)
+
+    print(f"🧮 Image scoring: kept {len(selected)}/{len(images)} (dropped {dropped_decorative} decorative)")
+    return selected
+
+# Images whose bytes are loaded for local scoring; everything else stays metadata only
+IMAGE_SHORTLIST_SIZE = int(os.environ.get('IMAGE_SHORTLIST_SIZE', 20))
+
+def shortlist_images(images, limit=None):
+    """Pick Vision candidates from metadata alone (no bytes loaded)
+
+    Drops icons and banners by dimensions, then keeps the `limit` largest by
+    compressed size.
+    """
+    limit = limit or IMAGE_SHORTLIST_SIZE
+    candidates = [
+        img for img in images
+        if min(img['width'], img['height']) >= IMAGE_MIN_DIMENSION
+        and max(img['width'], img['height']) / max(1, min(img['width'], img['height'])) <= IMAGE_MAX_ASPECT_RATIO
+    ]
+    return sorted(candidates, key=lambda x: x['size'], reverse=True)[:limit]
+
+def load_image_bytes(pdf_bytes, images):
+    """Pull image bytes from the document for just the given images"""
+    loaded = []
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        for img in images:
+            try:
+                base_image = doc.extract_image(img['xref'])
+                loaded.append({**img, 'bytes': base_image["image"], 'ext': base_image["ext"]})
+            except Exception as e:
+                print(f"⚠️ Could not extract image {img['index']} from page {img['page']}: {e}")
+    finally:
+        doc.close()
+    return loaded
+
+def prepare_images_for_vision(pdf_bytes, images):
+    """Shortlist from metadata, then load bytes, dedupe and chart-score only the shortlist"""
+    candidates = shortlist_images(images)
+    loaded = load_image_bytes(pdf_bytes, candidates)
+    print(f"📥 Loaded bytes for {len(loaded)}/{len(images)} images "
+          f"({sum(len(img['bytes']) for img in loaded) / 1024 / 1024:.1f} MB)")
+    return select_chart_images(deduplicate_images(loaded))
+
+# ========== Scanned page routing (render low-text pages for Vision) ==========
+# Scanned or image-only pages yield almost no text. They are detected per
+# page from text density during extraction, rendered in-process with PyMuPDF
+# at the resolution Vision actually uses, and transcribed by Vision. Pages
+# with a good text layer are never rendered or sent.
+
+SCANNED_PAGE_MIN_CHARS = int(os.environ.get('SCANNED_PAGE_MIN_CHARS', 100))  # Less text than this = scanned
+SCANNED_PAGE_MAX_VISION = int(os.environ.get('SCANNED_PAGE_MAX_VISION', 10))  # Pages transcribed per document
+SCANNED_PAGE_MAX_DPI = 150
+PARALLEL_RENDER_MIN_PAGES = 4
+
+SCANNED_PAGE_PROMPT = "This is a scanned page from a business report. Transcribe its key text, figures and table contents, and describe any charts with their data and trends. Be concise but thorough."
+
+def is_scanned_page(page_text, page_images):
+    """True if a page has almost no text layer but does show an image (blank pages are not scanned)"""
+    text = PAGE_MARKER_RE.sub('', page_text, count=1)
+    return len(text.strip()) < SCANNED_PAGE_MIN_CHARS and bool(page_images)
+
+def render_page_for_vision(doc, page_num):
+    """Render one page (0-based) to JPEG at the Vision 'high' detail working resolution
+
+    The zoom puts the page's short side at VISION_HIGH_DETAIL_SHORT_SIDE
+    pixels (about 90 DPI on A4/Letter), capped at SCANNED_PAGE_MAX_DPI;
+    anything sharper would be downscaled by the provider anyway.
+
+    Returns:
+        dict: shaped like an embedded image (page, pages, size, width,
+              height, bytes, ext) so it goes through the normal Vision stage
+    """
+    page = doc[page_num]
+    zoom = min(VISION_HIGH_DETAIL_SHORT_SIDE / max(1.0, min(page.rect.width, page.rect.height)),
+               SCANNED_PAGE_MAX_DPI / 72)
+    pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    image_bytes = pixmap.tobytes('jpeg', jpg_quality=85)
+
+    return {
+        'xref': None,
+        'page': page_num + 1,
+        'pages': [page_num + 1],
+        'index': 0,
+        'size': len(image_bytes),
+        'width': pixmap.width,
+        'height': pixmap.height,
+        'bytes': image_bytes,
+        'ext': 'jpeg'
+    }
+
+def _render_page_worker(name, size, page_num):
+    """Page pool task: render one page of the PDF in shared memory segment `name`"""
+    return render_page_for_vision(_open_shared_pdf(name, size), page_num)
+
+def render_pages_from_buffer(pdf_bytes, pages):
+    """Open a PDF buffer and render the given 1-based pages (runs inside the PDF sandbox)"""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return [render_page_for_vision(doc, page - 1) for page in pages]
+    finally:
+        doc.close()
+
+def render_pages_for_vision(pdf_bytes, pages, workers=None):
+    """Render the given 1-based pages across the page pool when there are several, else in the PDF sandbox"""
+    if not pages:
+        return []
+
+    workers = min(workers or PDF_EXTRACTION_WORKERS, len(pages))
+    if workers > 1 and len(pages) >= PARALLEL_RENDER_MIN_PAGES:
+        renders = run_in_page_pool(pdf_bytes, _render_page_worker, [(page - 1,) for page in pages])
+    else:
+        workers = 1
+        renders = run_in_sandbox(render_pages_from_buffer, (pdf_bytes, pages))
+
+    print(f"🖨️ Rendered {len(renders)} scanned pages across {workers} processes "
+          f"({sum(render['size'] for render in renders) / 1024:.0f} KB)")
+    return renders
+
+def transcribe_scanned_pages(pdf_bytes, scanned_pages, progress=None):
+    """Render scanned pages outside this process and transcribe them with Vision
+
+    Only the first SCANNED_PAGE_MAX_VISION pages are rendered and sent.
+
+    Returns:
+        list: [{'page': int, 'description': str}] in page order
+    """
+    pages = scanned_pages[:SCANNED_PAGE_MAX_VISION]
+    if progress:
+        progress('vision', detail=f"Transcribing {len(pages)} scanned pages")
+
+    try:
+        renders = render_pages_for_vision(pdf_bytes, pages)
+    except PDFSandboxError as e:
+        print(f"⚠️ Skipping scanned pages: {e}")
+        return []
+
+    transcriptions = analyze_images_with_vision(renders, max_images=len(renders), prompt=SCANNED_PAGE_PROMPT)
+    return sorted(transcriptions, key=lambda transcription: transcription['page'])
+
+def format_scanned_pages_for_analysis(page_transcriptions):
+    """Format Vision transcriptions of scanned pages for AI analysis (empty if there are none)"""
+    if not page_transcriptions:
+        return ""
+
+    formatted = f"\n\n=== SCANNED PAGES TRANSCRIBED ({len(page_transcriptions)} pages) ===\n"
+
+    for transcription in page_transcriptions:
+        formatted += f"\n--- Scanned Page {transcription['page']} ---\n"
+        formatted += f"{transcription['description']}\n"
+
+    return formatted
+
 def format_tables_for_analysis(tables_data):
     """Format extracted tables into readable text for AI analysis"""
     if not tables_data:
@@ -462,44 +2033,185 @@ def format_images_for_analysis(image_descriptions):
 
     return formatted
 
-def comprehensive_pdf_extraction(pdf_file, analyze_images_flag=True):
+def run_timed_stage(stage_timings, stage_name, func, *args, **kwargs):
+    """Run one extraction stage and record its wall time (seconds) in stage_timings"""
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        stage_timings[stage_name] = round(time.perf_counter() - start, 2)
+
+# Bump whenever extraction output changes so stale cache entries are ignored
+EXTRACTOR_VERSION = 'v2.10'
+
+def get_extraction_cache_key(pdf_bytes, analyze_images_flag=True):
+    """Content-addressed cache key: SHA-256 of the PDF bytes plus extractor version"""
+    pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
+    version = EXTRACTOR_VERSION if analyze_images_flag else f"{EXTRACTOR_VERSION}-noimg"
+    if TABLE_EXTRACTION_BACKEND != 'pdfplumber':
+        version = f"{version}-{TABLE_EXTRACTION_BACKEND}"  # Different backends find different tables
+    return pdf_hash, version
+
+def comprehensive_pdf_extraction(pdf_file, analyze_images_flag=True, progress=None, validation=None):
     """
     Comprehensive PDF extraction combining PyMuPDF, pdfplumber, and Vision API
 
+    Results are cached by PDF content hash, so repeat uploads of the same
+    file (by any user) are returned straight from the database. pdf_file
+    may be a file object or any bytes-like buffer; it is read at most once
+    and every stage shares one read-only view of it.
+
+    All parsing runs in the PDF sandbox or the page pool. validation is the result of
+    prevalidate_pdf if the caller already ran it; files it marks text_only
+    skip table detection and Vision.
+
+    Raises:
+        PDFValidationError: if the file is rejected or text extraction fails in the sandbox
+
+    progress, if given, is called as progress(stage, percent) as each
+    stage starts, and as progress(stage, detail=...) for finer events from
+    inside a stage (pages parsed, tables found, images analyzed). Used by
+    background jobs for status polling and the /progress_stream feed.
+
     Returns:
         dict: {
             'text': str,
             'tables': list,
             'images': list,
             'image_descriptions': list,
-            'combined_content': str  # Formatted for AI analysis
+            'page_transcriptions': list,  # Vision transcriptions of scanned pages
+            'combined_content': str,  # Formatted for AI analysis
+            'page_offsets': list,  # page_offsets[i] = offset in 'text' where page i+1 starts
+            'page_hashes': list,  # page_hashes[i] = content hash of page i+1
+            'failed_stages': list  # Stages that failed or were skipped (result not cached)
         }
     """
     print("\n" + "="*60)
     print("🚀 Starting Comprehensive PDF Extraction")
     print("="*60)
 
-    # Read PDF bytes once
-    pdf_file.seek(0)
-    pdf_bytes = pdf_file.read()
-
-    # Step 1: Extract text and images with PyMuPDF
-    pdf_file.seek(0)
-    text_content, images = extract_text_and_images_with_pymupdf(pdf_bytes)
-
-    # Step 2: Extract tables with pdfplumber
-    tables_data = extract_tables_with_pdfplumber(pdf_bytes)
+    report_progress = progress or (lambda stage, percent=None, detail=None: None)
+
+    # One read-only buffer shared by every stage (no per-stage copies)
+    pdf_bytes = as_pdf_buffer(pdf_file)
+
+    # Check content-addressed cache before doing any work
+    pdf_hash, extractor_version = get_extraction_cache_key(pdf_bytes, analyze_images_flag)
+    cached = db.get_extraction_cache(pdf_hash, extractor_version)
+    if cached:
+        print(f"✅ Using cached extraction ({len(cached['combined_content'])} chars)")
+        report_progress('complete', 100)
+        return cached
+
+    # Reject or downgrade pathological files before any real parsing
+    validation = validation or prevalidate_pdf(pdf_bytes)
+    extract_tables_flag = not validation['text_only']
+    if validation['text_only']:
+        analyze_images_flag = False
+
+    report_progress('text_images', 5)
+
+    # Run stages concurrently instead of back-to-back:
+    #   - PyMuPDF text/images runs first on this thread; it is an order of
+    #     magnitude faster than pdfplumber and finds the appendix boundary
+    #   - Table detection (pdfplumber or PyMuPDF) then starts in the background, limited
+    #     to the pages before the appendix
+    #   - Vision starts as soon as images exist, overlapping with table detection
+    #   - Scanned pages are rendered and transcribed alongside both
+    # Total time is bounded by the slowest chain rather than the sum of all stages
+    stage_timings = {}
+    failed_stages = []  # Stages that failed or were skipped; such results are not cached
+    extraction_start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=3) as stages:
+        # Step 1: Extract text and images with PyMuPDF (stops at the appendix)
+        try:
+            text_content, images, body_page_count, page_offsets, table_pages, page_hashes, scanned_pages = run_timed_stage(
+                stage_timings, 'text_images', extract_text_and_images_with_pymupdf, pdf_bytes,
+                progress=report_progress, page_count=validation['page_count']
+            )
+        except PDFSandboxError as e:
+            print(f"❌ Text extraction aborted: {e}")
+            raise PDFValidationError('PDF could not be processed - parsing crashed or exceeded its time or memory limit')
+
+        report_progress('tables', 35)
+
+        # Step 2: Extract tables (background, body pages only; unchanged pages
+        # of an earlier version come from the page cache)
+        tables_future = None
+        if extract_tables_flag:
+            tables_future = stages.submit(
+                run_timed_stage, stage_timings, 'tables', extract_tables_incrementally, pdf_bytes,
+                body_page_count, progress=report_progress, pages=table_pages, page_hashes=page_hashes
+            )
 
-    # Step 3: Analyze embedded images with Vision API (optional, can be disabled for cost savings)
-    # Reduced from 10 to 5 images for better performance (saves ~40 seconds)
-    image_descriptions = []
-    if analyze_images_flag and images:
-        image_descriptions = analyze_images_with_vision(images, max_images=5)
+        # Step 3: Transcribe scanned pages (no text layer) with Vision, from
+        # in-process page renders; pages with good text are never rendered
+        scanned_future = None
+        vision_candidates = images
+        if analyze_images_flag and scanned_pages:
+            scanned_future = stages.submit(
+                run_timed_stage, stage_timings, 'scanned_pages', transcribe_scanned_pages, pdf_bytes, scanned_pages,
+                progress=report_progress
+            )
+            # The page scan itself is covered by the transcription
+            scanned = set(scanned_pages)
+            vision_candidates = [img for img in images if not set(img['pages']) <= scanned]
+
+        # Step 4: Analyze embedded images with Vision API (optional, can be disabled for cost savings)
+        # Reduced from 10 to 5 images for better performance (saves ~40 seconds)
+        vision_future = None
+        if analyze_images_flag and vision_candidates:
+            # Load bytes only for a shortlist, then drop logos, photos and
+            # backgrounds locally so Vision only sees likely charts
+            try:
+                chart_images = run_timed_stage(
+                    stage_timings, 'image_scoring', sandboxed(prepare_images_for_vision), pdf_bytes, vision_candidates
+                )
+            except PDFSandboxError as e:
+                print(f"⚠️ Skipping image analysis: {e}")
+                failed_stages.append('image_scoring')
+                chart_images = []
+            if chart_images:
+                vision_future = stages.submit(
+                    run_timed_stage, stage_timings, 'vision', analyze_images_with_vision, chart_images, max_images=5,
+                    progress=report_progress
+                )
 
-    # Step 4: Combine everything into formatted content for AI analysis
+        try:
+            tables_data = tables_future.result() if tables_future else []
+        except PDFSandboxError as e:
+            print(f"⚠️ Skipping tables: {e}")
+            failed_stages.append('tables')
+            tables_data = []
+        report_progress('vision' if vision_future or scanned_future else 'combining', 75)
+        image_descriptions = vision_future.result() if vision_future else []
+        page_transcriptions = scanned_future.result() if scanned_future else []
+        report_progress('combining', 95)
+
+    # Vision skips failed or timed-out requests (and everything in demo mode),
+    # so fewer results than requests means the result is incomplete
+    if vision_future and len(image_descriptions) < min(5, len(chart_images)):
+        failed_stages.append('vision')
+    if scanned_future and len(page_transcriptions) < min(len(scanned_pages), SCANNED_PAGE_MAX_VISION):
+        failed_stages.append('scanned_pages')
+
+    stage_timings['total'] = round(time.perf_counter() - extraction_start, 2)
+
+    # Report what the table layout pre-filter saved (estimated from the
+    # measured per-page cost of the pages that were scanned)
+    if tables_future and table_pages is not None and body_page_count:
+        skipped_pages = body_page_count - len(table_pages)
+        seconds_per_page = stage_timings.get('tables', 0) / max(1, len(table_pages))
+        stage_timings['tables_saved_est'] = round(skipped_pages * seconds_per_page, 2)
+        print(f"⏩ Table pre-filter: skipped {skipped_pages}/{body_page_count} prose pages "
+              f"({skipped_pages / body_page_count:.0%}), saving ~{stage_timings['tables_saved_est']}s")
+
+    # Step 5: Combine everything into formatted content for AI analysis
     combined_content = f"""
 === DOCUMENT TEXT CONTENT ===
 {text_content}
+{format_scanned_pages_for_analysis(page_transcriptions)}
 
 {format_tables_for_analysis(tables_data)}
 
@@ -511,15 +2223,42 @@ def comprehensive_pdf_extraction(pdf_file, analyze_images_flag=True):
     print(f"   📝 Text: {len(text_content)} characters")
     print(f"   📊 Tables: {len(tables_data)} found")
     print(f"   🖼️ Images: {len(images)} extracted, {len(image_descriptions)} analyzed")
+    print(f"   🖨️ Scanned pages: {len(scanned_pages)} found, {len(page_transcriptions)} transcribed")
     print(f"   📦 Combined content: {len(combined_content)} characters")
+    print(f"   ⏱️ Stage timings: {', '.join(f'{name}={secs}s' for name, secs in stage_timings.items())}")
+    if failed_stages:
+        print(f"   ⚠️ Incomplete: {', '.join(failed_stages)} failed or skipped (not cached)")
     print("="*60 + "\n")
 
+    # Cache the full result (images are metadata only, never raw bytes).
+    # Empty or incomplete extractions are not cached, so the next upload
+    # of the same file retries them instead of inheriting the gaps
+    if text_content and not failed_stages:
+        try:
+            db.save_extraction_cache(pdf_hash, extractor_version, {
+                'text': text_content,
+                'tables': tables_data,
+                'images': images,
+                'image_descriptions': image_descriptions,
+                'page_transcriptions': page_transcriptions,
+                'combined_content': combined_content,
+                'page_offsets': page_offsets,
+                'page_hashes': page_hashes
+            })
+        except Exception as e:
+            print(f"⚠️ Could not save extraction cache: {e}")
+
     return {
         'text': text_content,
         'tables': tables_data,
         'images': images,
         'image_descriptions': image_descriptions,
-        'combined_content': combined_content
+        'page_transcriptions': page_transcriptions,
+        'combined_content': combined_content,
+        'page_offsets': page_offsets,
+        'page_hashes': page_hashes,
+        'stage_timings': stage_timings,
+        'failed_stages': failed_stages
     }
 
 # ========== Legacy PDF Processing (kept for backward compatibility) ==========
@@ -540,46 +2279,138 @@ def extract_text_from_pdf(pdf_file):
         print(f"Error processing PDF: {e}")
         return None
 
-def analyze_document_with_ai(document_text, vision_analysis, company_name, industry, report_type):
+# ========== Prompt token budgets ==========
+# Prompts are budgeted in tokens (token_budget.py), not characters, and every
+# call's token usage is recorded per prompt name (see /health)
+
+QUESTION_PROMPT_TOKENS = int(os.environ.get('QUESTION_PROMPT_TOKENS', 2500))  # Whole prompt, research and history fill the rest
+RESEARCH_EXCERPT_TOKENS = 150
+ANSWER_EXCERPT_TOKENS = 100
+FOLLOWUP_RESPONSE_TOKENS = 1500
+FEEDBACK_CONVERSATION_TOKENS = int(os.environ.get('FEEDBACK_CONVERSATION_TOKENS', 12000))
+FEEDBACK_MIN_ANSWER_TOKENS = 100
+MAP_PROMPT_TOKENS = int(os.environ.get('MAP_PROMPT_TOKENS', 64000))  # Largest chunk plus the fixed prompt
+REDUCE_PROMPT_TOKENS = int(os.environ.get('REDUCE_PROMPT_TOKENS', 8000))
+
+def record_prompt_usage(prompt_name, messages, response=None, budget=None, truncated=False):
+    """Count a prompt's tokens locally and record them, with the API's own counts if the response has them"""
+    prompt_tokens = tb.count_message_tokens(messages)
+    usage = getattr(response, 'usage', None)
+    api_prompt_tokens = getattr(usage, 'prompt_tokens', None) or 0
+    api_completion_tokens = getattr(usage, 'completion_tokens', None) or 0
+
+    budget_note = f" of {budget:,} budgeted" if budget else ""
+    truncated_note = ", cut to fit" if truncated else ""
+    api_note = f" (API: {api_prompt_tokens:,} in, {api_completion_tokens:,} out)" if usage else ""
+    print(f"🧮 Prompt '{prompt_name}': {prompt_tokens:,} tokens{budget_note}{truncated_note}{api_note}")
+
+    try:
+        db.record_prompt_usage(prompt_name, prompt_tokens, budget, truncated,
+                               api_prompt_tokens, api_completion_tokens)
+    except Exception as e:
+        print(f"⚠️ Could not record prompt usage: {e}")
+    return prompt_tokens
+
+# ========== Map-reduce document analysis ==========
+# Long reports are split into section-aligned chunks (page markers and the
+# tables/images/scanned-page blocks of the combined content) that are analyzed
+# concurrently; a cheap reduce call then merges, deduplicates and ranks the
+# candidates into the final 12-15 key details. Latency follows the longest
+# chunk instead of the document size, and no part of the body is dropped.
+
+ANALYSIS_CHUNK_TOKENS = int(os.environ.get('ANALYSIS_CHUNK_TOKENS', 6000))  # Document tokens per map call
+ANALYSIS_MAX_CHUNKS = int(os.environ.get('ANALYSIS_MAX_CHUNKS', 12))  # Chunks grow instead of exceeding this
+ANALYSIS_MAX_CHUNK_TOKENS = 60000  # ...up to this size, well inside the map model's context
+ANALYSIS_MAX_IN_FLIGHT = int(os.environ.get('ANALYSIS_MAX_IN_FLIGHT', 4))
+ANALYSIS_MAP_MODEL = os.environ.get('ANALYSIS_MAP_MODEL', 'gpt-4o')
+ANALYSIS_REDUCE_MODEL = os.environ.get('ANALYSIS_REDUCE_MODEL', 'gpt-4o-mini')
+ANALYSIS_DETAILS_PER_CHUNK = 8
+ANALYSIS_DUPLICATE_SIMILARITY = 0.85  # difflib ratio above which two details are the same point
+MAX_KEY_DETAILS = 15
+
+DETAIL_NUMBER_RE = re.compile(r'\d+(?:[.,]\d+)*')
+SECTION_BOUNDARY_RE = re.compile(r'^(?:--- Page \d+ ---|=== .+ ===)[ \t]*$', re.MULTILINE)
+
+KEY_DETAILS_SYSTEM_PROMPT = "You are an expert strategy consultant who identifies specific recommendations and analyses in business plans that executives would challenge. Extract concrete, specific items that can be questioned. You must return only valid JSON."
+
+def split_into_sections(text):
+    """Split text at page markers and '=== ... ===' block headers, keeping each header with its section"""
+    starts = [0] + [match.start() for match in SECTION_BOUNDARY_RE.finditer(text) if match.start() > 0]
+    sections = [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)])]
+    return [section for section in sections if section.strip()]
+
+def split_oversized_section(section, max_tokens):
+    """Split a section of more than max_tokens at paragraph breaks, then line breaks, then hard"""
+    pieces = []
+    while tb.count_tokens(section) > max_tokens:
+        prefix = tb.truncate_to_tokens(section, max_tokens)
+        cut = prefix.rfind('\n\n')
+        if cut < len(prefix) // 2:
+            cut = prefix.rfind('\n')
+        if cut < len(prefix) // 2:
+            cut = len(prefix)
+        if cut <= 0:
+            break
+        pieces.append(section[:cut])
+        section = section[cut:]
+    pieces.append(section)
+    return pieces
+
+def chunk_document(text, max_tokens=None):
+    """Pack consecutive sections into chunks of at most max_tokens
+
+    A section is only split if it is larger than a chunk on its own. The
+    chunk size grows for very long documents so there are at most about
+    ANALYSIS_MAX_CHUNKS chunks, up to ANALYSIS_MAX_CHUNK_TOKENS each.
     """
-    Use OpenAI to extract strategic recommendations and analyses from document
-    Enhanced to identify specific proposals and analyses that can be challenged
+    sections = [(section, tb.count_tokens(section)) for section in split_into_sections(text)]
+    total_tokens = sum(tokens for _, tokens in sections)
+    max_tokens = min(max(max_tokens or ANALYSIS_CHUNK_TOKENS, -(-total_tokens // ANALYSIS_MAX_CHUNKS)),
+                     ANALYSIS_MAX_CHUNK_TOKENS)
+
+    chunks = []
+    current = ''
+    current_tokens = 0
+    for section, section_tokens in sections:
+        if section_tokens > max_tokens:
+            pieces = [(piece, tb.count_tokens(piece)) for piece in split_oversized_section(section, max_tokens)]
+        else:
+            pieces = [(section, section_tokens)]
+
+        for piece, piece_tokens in pieces:
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append(current)
+                current = ''
+                current_tokens = 0
+            current += piece
+            current_tokens += piece_tokens
+
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+def build_key_details_prompt(content, company_name, industry, report_type, item_count="12-15", part=None):
+    """Key detail extraction prompt for the whole document or one part of it
+
+    part is (n, total, pages), where pages is the (first, last) page range
+    the part covers, or None if unknown.
     """
-    if not openai_available or not openai_client:
-        return generate_template_key_details(company_name, industry, report_type)
+    scope = "This document includes"
+    if part:
+        part_number, part_count, pages = part
+        covers = ""
+        if pages:
+            covers = f", page {pages[0]}" if pages[0] == pages[1] else f", pages {pages[0]}-{pages[1]}"
+        scope = (f"Below is part {part_number} of {part_count} of the document{covers} (other parts are "
+                 f"analyzed separately). It may include")
 
-    try:
-        # Intelligently truncate to stay under token limits (~20K tokens ≈ 80K chars)
-        # Priority: beginning, end, and middle sections for comprehensive coverage
-        MAX_TEXT_CHARS = 60000  # ~15K tokens
-        MAX_VISION_CHARS = 20000  # ~5K tokens
-
-        truncated_text = document_text
-        if len(document_text) > MAX_TEXT_CHARS:
-            # Take first 40%, last 40%, and sample from middle 20%
-            first_part = document_text[:int(MAX_TEXT_CHARS * 0.4)]
-            last_part = document_text[-int(MAX_TEXT_CHARS * 0.4):]
-            middle_start = len(document_text) // 2 - int(MAX_TEXT_CHARS * 0.1)
-            middle_part = document_text[middle_start:middle_start + int(MAX_TEXT_CHARS * 0.2)]
-            truncated_text = f"{first_part}\n\n... [middle section] ...\n\n{middle_part}\n\n... [continuing] ...\n\n{last_part}"
-            print(f"⚠️ Large document truncated: {len(document_text)} → {len(truncated_text)} chars for analysis")
-
-        truncated_vision = vision_analysis
-        if vision_analysis and len(vision_analysis) > MAX_VISION_CHARS:
-            truncated_vision = vision_analysis[:MAX_VISION_CHARS] + "... [truncated]"
-            print(f"⚠️ Vision analysis truncated: {len(vision_analysis)} → {len(truncated_vision)} chars")
-
-        combined_content = f"TEXT CONTENT:\n{truncated_text}\n\n"
-        if truncated_vision:
-            combined_content += f"VISUAL ANALYSIS:\n{truncated_vision}"
-
-        prompt = f"""Analyze this {report_type} document for {company_name} in the {industry} industry.
-
-This document includes extracted text content, structured tables, and analyzed images/charts.
+    return f"""Analyze this {report_type} document for {company_name} in the {industry} industry.
+
+{scope} extracted text content, structured tables, and analyzed images/charts.
 
 Your goal is to identify SPECIFIC STRATEGIC RECOMMENDATIONS and KEY ANALYSES that executives can challenge or clarify.
 
-Extract 12-15 items that fall into these categories:
+Extract {item_count} items that fall into these categories:
 
 1. STRATEGIC RECOMMENDATIONS (specific actions/initiatives proposed):
    - Market entry or expansion plans
@@ -613,38 +2444,222 @@ For each item:
 Return ONLY a JSON object: {{"key_details": ["detail1", "detail2", ...]}}
 
 Document:
-{combined_content}"""
+{content}"""
+
+def extract_key_details_from_chunk(content, company_name, industry, report_type, item_count="12-15", part=None):
+    """One map call: candidate key details for the whole document or one chunk of it"""
+    def build_messages(content):
+        return [
+            {"role": "system", "content": KEY_DETAILS_SYSTEM_PROMPT},
+            {"role": "user", "content": build_key_details_prompt(content, company_name, industry, report_type,
+                                                                 item_count, part)}
+        ]
+
+    # Chunks are sized to fit; this only guards the budget if one doesn't
+    content_budget = MAP_PROMPT_TOKENS - tb.count_message_tokens(build_messages(''))
+    fitted = tb.truncate_to_tokens(content, content_budget, '\n[...]')
+    messages = build_messages(fitted)
+    response = openai_client.chat.completions.create(
+        model=ANALYSIS_MAP_MODEL,
+        messages=messages,
+        response_format={"type": "json_object"},
+        temperature=0.7,
+        max_tokens=2000
+    )
+    record_prompt_usage('key_details_map' if part else 'key_details', messages, response,
+                        MAP_PROMPT_TOKENS, fitted != content)
+
+    result = json.loads(response.choices[0].message.content)
+    return [detail for detail in result.get('key_details', []) if isinstance(detail, str) and detail.strip()]
+
+def deduplicate_key_details(candidate_lists, existing=()):
+    """Interleave per-chunk candidates round-robin and drop near-duplicates
+
+    Round-robin order keeps every part of the document represented if the
+    list has to be cut without a reduce call. Details citing different
+    numbers are never merged, however similar their wording. Candidates that
+    duplicate one of the existing details are dropped too; the existing
+    details themselves are not returned.
+    """
+    interleaved = []
+    for position in range(max((len(candidates) for candidates in candidate_lists), default=0)):
+        interleaved.extend(candidates[position] for candidates in candidate_lists if position < len(candidates))
+
+    def normalize(detail):
+        normalized = ' '.join(detail.lower().split())
+        return normalized, set(DETAIL_NUMBER_RE.findall(normalized))
+
+    unique = [normalize(detail) + (detail,) for detail in existing]
+    for detail in interleaved:
+        normalized, numbers = normalize(detail)
+        is_duplicate = False
+        for kept_normalized, kept_numbers, _ in unique:
+            if numbers != kept_numbers:
+                continue
+            matcher = difflib.SequenceMatcher(None, normalized, kept_normalized)
+            if matcher.quick_ratio() >= ANALYSIS_DUPLICATE_SIMILARITY and matcher.ratio() >= ANALYSIS_DUPLICATE_SIMILARITY:
+                is_duplicate = True
+                break
+        if not is_duplicate:
+            unique.append((normalized, numbers, detail))
+
+    return [detail for _, _, detail in unique[len(existing):]]
+
+def reduce_key_details(candidates, company_name, industry, report_type):
+    """Merge and rank deduplicated candidates into the final 12-15 key details (one cheap call)"""
+    if len(candidates) <= MAX_KEY_DETAILS:
+        return candidates
+
+    def build_prompt(numbered):
+        return f"""Below are candidate key details extracted from different parts of a {report_type} for {company_name} in the {industry} industry.
+
+Merge items that make the same point, then select the 12-15 that are most specific, most consequential and most challengeable by executives. Keep a mix of recommendations, analyses and assumptions, and keep each item's "Recommendation:", "Analysis:" or "Assumption:" format and its specific numbers. Order them from most to least important.
+
+Return ONLY a JSON object: {{"key_details": ["detail1", "detail2", ...]}}
+
+Candidates:
+{numbered}"""
+
+    # Candidates arrive round-robin across chunks, so filling the budget in
+    # order keeps every part of the document represented if some must go
+    fixed_tokens = tb.count_message_tokens([
+        {"role": "system", "content": KEY_DETAILS_SYSTEM_PROMPT},
+        {"role": "user", "content": build_prompt('')}
+    ])
+    parts = [
+        {'key': i, 'text': f"{i}. {detail}\n", 'priority': i, 'truncate': False}
+        for i, detail in enumerate(candidates, 1)
+    ]
+    fitted, _, cut = tb.fit_parts(parts, REDUCE_PROMPT_TOKENS - fixed_tokens)
+    numbered = ''.join(fitted[i] for i in range(1, len(candidates) + 1)).rstrip('\n')
+    if cut:
+        print(f"🧮 Reduce prompt budget: dropped {len(cut)} of {len(candidates)} candidates")
 
+    try:
+        messages = [
+            {"role": "system", "content": KEY_DETAILS_SYSTEM_PROMPT},
+            {"role": "user", "content": build_prompt(numbered)}
+        ]
         response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an expert strategy consultant who identifies specific recommendations and analyses in business plans that executives would challenge. Extract concrete, specific items that can be questioned. You must return only valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
+            model=ANALYSIS_REDUCE_MODEL,
+            messages=messages,
             response_format={"type": "json_object"},
-            temperature=0.7,
+            temperature=0.2,
             max_tokens=2000
         )
+        record_prompt_usage('key_details_reduce', messages, response, REDUCE_PROMPT_TOKENS, bool(cut))
+        merged = json.loads(response.choices[0].message.content).get('key_details', [])
+        merged = [detail for detail in merged if isinstance(detail, str) and detail.strip()]
+        if merged:
+            return merged[:MAX_KEY_DETAILS]
+        print("⚠️ Reduce step returned no key details - keeping the first candidates")
+    except Exception as e:
+        print(f"⚠️ Reduce step failed, keeping the first candidates: {e}")
 
-        result = json.loads(response.choices[0].message.content)
-        key_details = result.get('key_details', [])
+    return candidates[:MAX_KEY_DETAILS]
+
+def get_chunk_pages(content, chunks, page_index):
+    """(first, last) page range each chunk of content covers, or None where unknown
+
+    Chunks are consecutive spans of content, so each is found from where the
+    previous one started; chunks past the page text (tables, images) get None.
+    """
+    if not page_index:
+        return [None] * len(chunks)
+
+    page_offsets, text_end = page_index
+    chunk_pages = []
+    position = 0
+    for chunk in chunks:
+        start = content.find(chunk, position)
+        if start < 0 or start >= text_end:
+            chunk_pages.append(None)
+            continue
+        end = min(start + len(chunk), text_end)
+        chunk_pages.append((page_for_offset(page_offsets, start), page_for_offset(page_offsets, end - 1)))
+        position = start
+    return chunk_pages
+
+def analyze_document_with_ai(document_text, vision_analysis, company_name, industry, report_type, progress=None,
+                             page_index=None):
+    """
+    Use OpenAI to extract strategic recommendations and analyses from document
+    Enhanced to identify specific proposals and analyses that can be challenged
+
+    Documents that fit in one chunk take a single call; longer ones are
+    analyzed chunk by chunk in parallel and reduced (see chunk_document).
+
+    progress, if given, is called as progress(stage, percent, detail) when
+    analysis starts, as each chunk finishes and once key details are extracted.
+    page_index (see get_page_index) lets each chunk's prompt name the pages it covers.
+    """
+    report_progress = progress or (lambda stage, percent=None, detail=None: None)
+
+    if not openai_available or not openai_client:
+        key_details = generate_template_key_details(company_name, industry, report_type)
+        report_progress('key_details', 100, f"Extracted {len(key_details)} key details")
+        return key_details
+
+    try:
+        content = document_text
+        if vision_analysis:
+            content += f"\n\n=== VISUAL ANALYSIS ===\n{vision_analysis}"
+        chunks = chunk_document(content)
+
+        if len(chunks) <= 1:
+            report_progress('analysis', 10, f"Extracting key details from {len(content)} characters")
+            key_details = extract_key_details_from_chunk(content, company_name, industry, report_type)
+        else:
+            max_in_flight = max(1, min(ANALYSIS_MAX_IN_FLIGHT, len(chunks)))
+            print(f"🧩 Analyzing {len(content)} chars in {len(chunks)} section-aligned chunks "
+                  f"(largest {max(len(chunk) for chunk in chunks)} chars, {max_in_flight} in flight)...")
+            report_progress('analysis', 10, f"Analyzing {len(chunks)} sections of {len(content)} characters")
+
+            chunk_pages = get_chunk_pages(content, chunks, page_index)
+            candidate_lists = []
+            with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+                futures = [
+                    pool.submit(extract_key_details_from_chunk, chunk, company_name, industry, report_type,
+                                f"up to {ANALYSIS_DETAILS_PER_CHUNK}", (part, len(chunks), pages))
+                    for part, (chunk, pages) in enumerate(zip(chunks, chunk_pages), 1)
+                ]
+
+                # Collected in chunk order; a failed chunk only loses its own candidates
+                for part, future in enumerate(futures, 1):
+                    try:
+                        candidate_lists.append(future.result()[:ANALYSIS_DETAILS_PER_CHUNK])
+                    except Exception as e:
+                        print(f"⚠️ Could not analyze chunk {part} of {len(chunks)}: {e}")
+                    report_progress('analysis', 10 + int(70 * part / len(chunks)),
+                                    f"Analyzed section {part} of {len(chunks)}")
+
+            if not candidate_lists:
+                raise RuntimeError("every chunk failed to analyze")
+
+            candidates = deduplicate_key_details(candidate_lists)
+            print(f"🧩 Map step: {sum(len(c) for c in candidate_lists)} candidates, {len(candidates)} after deduplication")
+            report_progress('analysis', 85, f"Merging {len(candidates)} candidate key details")
+            key_details = reduce_key_details(candidates, company_name, industry, report_type)
 
         print(f"\n{'='*80}")
         print(f"📊 DOCUMENT ANALYSIS RESULTS ({len(key_details)} items extracted)")
         print(f"{'='*80}")
-        for i, detail in enumerate(key_details[:15], 1):
+        for i, detail in enumerate(key_details[:MAX_KEY_DETAILS], 1):
             # Truncate very long details for readability
             display_detail = detail if len(detail) <= 150 else detail[:147] + "..."
             print(f"{i:2}. {display_detail}")
         print(f"{'='*80}\n")
 
-        return key_details[:15]
+        report_progress('key_details', 100, f"Extracted {len(key_details[:MAX_KEY_DETAILS])} key details")
+        return key_details[:MAX_KEY_DETAILS]
 
     except Exception as e:
         print(f"AI analysis error: {e}")
         import traceback
         traceback.print_exc()
-        return generate_template_key_details(company_name, industry, report_type)
+        key_details = generate_template_key_details(company_name, industry, report_type)
+        report_progress('key_details', 100, f"Extracted {len(key_details)} key details")
+        return key_details
 
 def generate_template_key_details(company_name, industry, report_type):
     """Generate template key details when AI is unavailable - formatted as recommendations and analyses"""
@@ -663,13 +2678,128 @@ def generate_template_key_details(company_name, industry, report_type):
         f"Recommendation: Launch customer acquisition campaign targeting early adopters - phased rollout plan"
     ]
 
+# ========== Incremental re-analysis for revised uploads ==========
+# A revised upload of the same plan usually changes a handful of pages. If
+# less than ANALYSIS_MATERIAL_CHANGE of its text differs from an earlier
+# version analyzed for the same company, industry and report type, that
+# version's key details are reused instead of running GPT-4o again.
+
+INCREMENTAL_ANALYSIS = os.environ.get('INCREMENTAL_ANALYSIS', 'true').lower() in ('1', 'true', 'yes')
+ANALYSIS_MATERIAL_CHANGE = float(os.environ.get('ANALYSIS_MATERIAL_CHANGE', 0.03))  # Fraction of characters
+ANALYSIS_MIN_PAGE_OVERLAP = 0.5  # Share of pages an earlier version must have in common
+
+PAGE_MARKER_RE = re.compile(r'^\s*--- Page \d+ ---\n')
+
+def split_pages(text, page_offsets):
+    """Split extracted text into one string per page using its page offset index"""
+    bounds = list(page_offsets) + [len(text)]
+    return [text[bounds[i]:bounds[i + 1]] for i in range(len(page_offsets))]
+
+def get_analysis_context_key(company_name, industry, report_type):
+    """Hash of the analysis inputs other than the document itself"""
+    context = '|'.join((value or '').strip().lower() for value in (company_name, industry, report_type))
+    return hashlib.sha256(context.encode('utf-8')).hexdigest()
+
+def measure_document_change(old_hashes, old_texts, old_lengths, new_hashes, new_texts):
+    """Fraction of characters that differ between two versions of a document (0.0 - 1.0)
+
+    Pages with matching content hashes count as unchanged wherever they
+    moved to. The remaining new pages are diffed in order against the
+    remaining old pages; pages left over on either side count as fully
+    added or removed, as do changed old pages whose text was not cached
+    (old_texts entry None).
+    """
+    old_hash_set, new_hash_set = set(old_hashes), set(new_hashes)
+    unmatched_old = [(text, length) for page_hash, text, length in zip(old_hashes, old_texts, old_lengths)
+                     if page_hash not in new_hash_set]
+    unmatched_new = [text for page_hash, text in zip(new_hashes, new_texts) if page_hash not in old_hash_set]
+
+    changed_chars = 0
+    for (old_text, old_length), new_text in zip(unmatched_old, unmatched_new):
+        if old_text is None:
+            changed_chars += max(old_length, len(new_text))
+            continue
+        similarity = difflib.SequenceMatcher(None, old_text, new_text).ratio()
+        changed_chars += (1 - similarity) * max(len(old_text), len(new_text))
+
+    paired = min(len(unmatched_old), len(unmatched_new))
+    changed_chars += sum(length for _, length in unmatched_old[paired:])
+    changed_chars += sum(len(text) for text in unmatched_new[paired:])
+
+    total_chars = max(sum(old_lengths), sum(len(text) for text in new_texts), 1)
+    return min(1.0, changed_chars / total_chars)
+
+def find_previous_analysis(context_key, page_hashes):
+    """Most similar earlier analysis for the same context, or None if none shares enough pages"""
+    new_hashes = set(page_hashes)
+    best, best_overlap = None, 0.0
+
+    for analysis in db.get_recent_analyses(context_key):
+        overlap = len(new_hashes & set(analysis['page_hashes'])) / max(1, len(new_hashes))
+        if overlap > best_overlap:
+            best, best_overlap = analysis, overlap
+
+    return best if best_overlap >= ANALYSIS_MIN_PAGE_OVERLAP else None
+
+def analyze_document_incrementally(extraction, company_name, industry, report_type, progress=None):
+    """Key details for an extraction, reusing an earlier version's analysis if the changes are immaterial
+
+    extraction is a comprehensive_pdf_extraction result (or its progressive
+    cache copy). Preview extractions carry no page hashes and always go
+    straight to analyze_document_with_ai.
+    """
+    report_progress = progress or (lambda stage, percent=None, detail=None: None)
+    page_hashes = extraction.get('page_hashes')
+    page_offsets = extraction.get('page_offsets')
+    text = extraction.get('text')
+
+    if (not INCREMENTAL_ANALYSIS or not page_hashes or text is None
+            or not page_offsets or len(page_offsets) != len(page_hashes)):
+        return analyze_document_with_ai(
+            extraction['combined_content'], None, company_name, industry, report_type, progress=progress,
+            page_index=get_page_index(extraction)
+        )
+
+    context_key = get_analysis_context_key(company_name, industry, report_type)
+    page_texts = [PAGE_MARKER_RE.sub('', page_text, count=1) for page_text in split_pages(text, page_offsets)]
+
+    try:
+        previous = find_previous_analysis(context_key, page_hashes)
+        if previous:
+            changed = measure_document_change(previous['page_hashes'], previous['page_texts'],
+                                              previous['page_lengths'], page_hashes, page_texts)
+            if changed < ANALYSIS_MATERIAL_CHANGE:
+                key_details = previous['key_details']
+                print(f"♻️ Reusing {len(key_details)} key details from an earlier version "
+                      f"({changed:.1%} of text changed)")
+                report_progress('key_details', 100,
+                                f"Reused {len(key_details)} key details ({changed:.1%} of document changed)")
+                return key_details
+            print(f"🔄 Earlier version found but {changed:.1%} of text changed - re-analyzing")
+    except Exception as e:
+        print(f"⚠️ Could not check analysis cache: {e}")
+
+    key_details = analyze_document_with_ai(
+        extraction['combined_content'], None, company_name, industry, report_type, progress=progress,
+        page_index=get_page_index(extraction)
+    )
+
+    # Template fallbacks (no AI, or the call failed) are never reused
+    if key_details != generate_template_key_details(company_name, industry, report_type):
+        try:
+            db.save_analysis_cache(context_key, page_hashes, page_texts, key_details)
+        except Exception as e:
+            print(f"⚠️ Could not save analysis cache: {e}")
+
+    return key_details
+
 # ========== NEW: Web Research ==========
 def research_company_online(company_name):
     """
     Research company information from the web
     Returns: Dictionary with company data from various sources
     """
-    if not openai_available:
+    if not openai_available or not openai_client:
         return None
 
     try:
@@ -685,15 +2815,17 @@ def research_company_online(company_name):
 
 Provide factual, verifiable information. If you don't have current information, indicate what's uncertain."""
 
+        messages = [
+            {"role": "system", "content": "You are a business research analyst providing factual company information."},
+            {"role": "user", "content": search_prompt}
+        ]
         response = openai_client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a business research analyst providing factual company information."},
-                {"role": "user", "content": search_prompt}
-            ],
+            messages=messages,
             temperature=0.5,
             max_tokens=600
         )
+        record_prompt_usage('company_research', messages, response)
 
         research_summary = response.choices[0].message.content
 
@@ -786,20 +2918,27 @@ def generate_ai_questions_with_topic_diversity(report_content, executive, compan
 
         focus = role_focus.get(executive, 'business strategy')
 
+        # Research and conversation history are fitted into what is left of
+        # QUESTION_PROMPT_TOKENS, most recent exchange first
+        context_parts = []
+
         # Add research context if available
-        research_context = ""
         if company_research:
-            research_context = f"\nRecent company research: {company_research.get('summary', '')[:300]}"
+            research_summary = tb.truncate_to_tokens(company_research.get('summary', ''), RESEARCH_EXCERPT_TOKENS, '...')
+            context_parts.append({'key': 'research', 'text': f"\nRecent company research: {research_summary}",
+                                  'priority': 10})
 
         # Format conversation history for context with explicit repetition detection
-        conversation_context = ""
+        conversation_notes = ""
         avoid_keywords = set()  # Track specific numbers/terms to avoid
 
-        if conversation_history and len(conversation_history) > 0:
-            conversation_context = "\n\nPREVIOUS CONVERSATION:\n"
-            for i, qa in enumerate(conversation_history[-5:], 1):  # Last 5 Q&As
-                conversation_context += f"\nQ{i} ({qa['executive']}): {qa['question']}\n"
-                conversation_context += f"A{i}: {qa['response'][:200]}{'...' if len(qa['response']) > 200 else ''}\n"
+        recent_history = conversation_history[-5:] if conversation_history else []  # Last 5 Q&As
+        if recent_history:
+            context_parts.append({'key': 'history_header', 'text': "\n\nPREVIOUS CONVERSATION:\n", 'required': True})
+            for i, qa in enumerate(recent_history, 1):
+                answer = tb.truncate_to_tokens(qa['response'], ANSWER_EXCERPT_TOKENS, '...')
+                context_parts.append({'key': f'qa{i}', 'text': f"\nQ{i} ({qa['executive']}): {qa['question']}\nA{i}: {answer}\n",
+                                      'priority': len(recent_history) - i, 'truncate': False})
 
                 # Extract specific numbers and key terms from previous questions
                 import re
@@ -836,21 +2975,25 @@ def generate_ai_questions_with_topic_diversity(report_content, executive, compan
                     covered_topics.add('risk management')
 
             if covered_topics:
-                conversation_context += f"\n⚠️ Topics already discussed: {', '.join(covered_topics)}\n"
-                conversation_context += "DO NOT ask about these topics again. Find a completely different aspect.\n"
+                conversation_notes += f"\n⚠️ Topics already discussed: {', '.join(covered_topics)}\n"
+                conversation_notes += "DO NOT ask about these topics again. Find a completely different aspect.\n"
 
             if avoid_keywords:
                 # Show specific numbers/phrases to avoid
                 sample_keywords = list(avoid_keywords)[:8]  # Show first 8 examples
-                conversation_context += f"\n⚠️ Avoid repeating these specific numbers/terms: {', '.join(sample_keywords)}\n"
-                conversation_context += "Find a DIFFERENT strategic recommendation or analysis that hasn't been discussed.\n"
+                conversation_notes += f"\n⚠️ Avoid repeating these specific numbers/terms: {', '.join(sample_keywords)}\n"
+                conversation_notes += "Find a DIFFERENT strategic recommendation or analysis that hasn't been discussed.\n"
+            context_parts.append({'key': 'notes', 'text': conversation_notes, 'required': True})
+
+        system_prompt = f"You are a tough, experienced {executive} evaluating a business plan. Your job is to identify weak spots, challenge assumptions, and push presenters to think deeper. Reference specific details from their proposal and ask pointed questions that expose gaps in their thinking. Use precise strategic management terminology: 'strategy' for overall direction, 'strategic initiatives' or 'actions' for specific programs."
 
-        prompt = f"""You are the {executive} of a company evaluating this {report_type} from {company_name} in the {industry} industry.
+        def build_prompt(context):
+            return f"""You are the {executive} of a company evaluating this {report_type} from {company_name} in the {industry} industry.
 
 The presenter has made this specific recommendation or analysis:
 {selected_topic}
 
-Your role focuses on: {focus}{research_context}{conversation_context}
+Your role focuses on: {focus}{context}
 
 Generate ONE tough, probing question that CHALLENGES or CLARIFIES this specific recommendation/analysis. Your question should:
 
@@ -886,15 +3029,24 @@ Examples of good challenging questions:
 
 Return ONLY the question text, no preamble or explanation."""
 
+        fixed_tokens = tb.count_message_tokens([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": build_prompt('')}
+        ])
+        fitted, _, cut = tb.fit_parts(context_parts, QUESTION_PROMPT_TOKENS - fixed_tokens)
+        context = ''.join(fitted[part['key']] for part in context_parts)
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": build_prompt(context)}
+        ]
         response = openai_client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": f"You are a tough, experienced {executive} evaluating a business plan. Your job is to identify weak spots, challenge assumptions, and push presenters to think deeper. Reference specific details from their proposal and ask pointed questions that expose gaps in their thinking. Use precise strategic management terminology: 'strategy' for overall direction, 'strategic initiatives' or 'actions' for specific programs."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             temperature=0.9,
             max_tokens=200
         )
+        record_prompt_usage('question', messages, response, QUESTION_PROMPT_TOKENS, bool(cut))
 
         question = response.choices[0].message.content.strip()
 
@@ -923,9 +3075,10 @@ def should_ask_followup(response_text, original_question, executive, question_nu
         return False, None
 
     try:
+        response_excerpt = tb.truncate_to_tokens(response_text, FOLLOWUP_RESPONSE_TOKENS, '...')
         prompt = f"""You are the {executive} who just asked: "{original_question}"
 
-The presenter responded: "{response_text}"
+The presenter responded: "{response_excerpt}"
 
 Analyze if this response adequately addresses the question. Consider if you (the {executive}) would have a natural follow-up question to clarify or dig deeper.
 
@@ -945,16 +3098,18 @@ OR if no follow-up is needed:
 
 Only request a follow-up if the response is vague, incomplete, or raises new concerns."""
 
+        messages = [
+            {"role": "system", "content": "You are an executive deciding if clarification is needed. You must return only valid JSON."},
+            {"role": "user", "content": prompt}
+        ]
         response = openai_client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an executive deciding if clarification is needed. You must return only valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             response_format={"type": "json_object"},
             temperature=0.7,
             max_tokens=200
         )
+        record_prompt_usage('followup_check', messages, response, truncated=response_excerpt != response_text)
 
         result = json.loads(response.choices[0].message.content)
 
@@ -1019,13 +3174,18 @@ def generate_session_feedback(session_data, questions, responses):
         return None
 
     try:
-        # Build the full conversation transcript for analysis
+        # Build the full conversation transcript for analysis; each answer gets
+        # an equal share of FEEDBACK_CONVERSATION_TOKENS
+        answer_tokens = max(FEEDBACK_MIN_ANSWER_TOKENS, FEEDBACK_CONVERSATION_TOKENS // max(1, len(responses)))
         conversation_text = ""
+        answers_cut = 0
         for i, (q, r) in enumerate(zip(questions, responses), 1):
             followup_marker = " [Follow-up]" if q.get('is_followup') else ""
             conversation_text += f"\nQ{i} ({q['executive_name']}, {q['executive']}){followup_marker}: {q['question_text']}\n"
             response_marker = " [Audio Response]" if r['response_type'] == 'audio' else ""
-            conversation_text += f"A{i}{response_marker}: {r['response_text']}\n"
+            answer = tb.truncate_to_tokens(r['response_text'], answer_tokens, '...')
+            answers_cut += answer != r['response_text']
+            conversation_text += f"A{i}{response_marker}: {answer}\n"
 
         # Scale feedback count based on conversation length
         num_questions = len(questions)
@@ -1068,16 +3228,18 @@ Requirements:
 
 Return ONLY valid JSON, no other text."""
 
+        messages = [
+            {"role": "system", "content": "You are an expert executive communication coach providing specific, actionable feedback on student performance during a simulated executive panel. You must return only valid JSON."},
+            {"role": "user", "content": prompt}
+        ]
         response = openai_client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an expert executive communication coach providing specific, actionable feedback on student performance during a simulated executive panel. You must return only valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             response_format={"type": "json_object"},
             temperature=0.7,
             max_tokens=1000
         )
+        record_prompt_usage('session_feedback', messages, response, truncated=answers_cut > 0)
 
         result = json.loads(response.choices[0].message.content)
 
@@ -1165,6 +3327,275 @@ def transcribe_audio_whisper(audio_file_path):
         print(f"❌ Transcription error: {e}")
         return f"[Transcription failed: {str(e)}]"
 
+# ========== Progress Events (Server-Sent Events) ==========
+# Extraction and analysis stages append events to a per-session channel in
+# SQLite (the Flask session cache ID), so any Gunicorn worker can serve them.
+# /progress_stream replays a channel as text/event-stream. Each request only
+# sends the events that are already pending and ends; the browser's
+# EventSource reconnects with Last-Event-ID after SSE_RETRY_MS, so the
+# retry interval does the waiting, not a request thread. The Procfile gives
+# 2 workers x 4 threads: a stream that held its thread would let a handful
+# of concurrent uploads starve interactive panel requests.
+
+SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS', 1000))
+SSE_TERMINAL_STAGES = {'preview_ready', 'complete', 'error', 'key_details'}
+
+def make_progress_reporter(channel, job_id=None):
+    """Build a progress(stage, percent=None, detail=None) callback for a session channel
+
+    Every call appends a stream event; calls with a percent also update the
+    extraction job row (if any) so /extraction_status stays current.
+    """
+    def report_progress(stage, percent=None, detail=None):
+        try:
+            if job_id and percent is not None:
+                db.update_extraction_job(job_id, stage=stage, progress=percent)
+            db.add_progress_event(channel, stage, percent, detail)
+        except Exception as e:
+            print(f"⚠️ Could not record progress event: {e}")
+
+    return report_progress
+
+def format_sse_event(event):
+    """Format one progress_events row as a Server-Sent Events frame"""
+    data = json.dumps({
+        'stage': event['stage'],
+        'progress': event['progress'],
+        'detail': event['detail']
+    })
+    return f"id: {event['id']}\nevent: progress\ndata: {data}\n\n"
+
+# ========== Background Extraction Jobs ==========
+# /upload_pdf only spools the PDF to disk, queues a job in SQLite and returns a
+# job ID. A separate extraction worker process (extraction_worker.py, started
+# by the Gunicorn master) claims queued jobs and runs the extraction, so web
+# workers never run PDF parsing or Vision calls themselves. The dev server
+# runs the same worker loop in threads instead.
+# Clients poll /extraction_status/<job_id> for stage and percent progress, or
+# follow /progress_stream for finer-grained events.
+
+EXTRACTION_JOB_WORKERS = int(os.environ.get('EXTRACTION_JOB_WORKERS', 1))
+EXTRACTION_JOB_POLL_SECONDS = 1
+
+_extraction_workers_lock = threading.Lock()
+_extraction_workers_started = False
+
+def _reset_extraction_workers_after_fork():
+    """Worker threads don't survive fork: let a forked worker start its own"""
+    global _extraction_workers_lock, _extraction_workers_started
+    _extraction_workers_lock = threading.Lock()
+    _extraction_workers_started = False
+
+os.register_at_fork(after_in_child=_reset_extraction_workers_after_fork)
+
+def ensure_extraction_workers():
+    """Start this process's extraction worker threads on first use"""
+    global _extraction_workers_started
+
+    with _extraction_workers_lock:
+        if _extraction_workers_started:
+            return
+
+        for worker_index in range(EXTRACTION_JOB_WORKERS):
+            threading.Thread(
+                target=extraction_worker_loop,
+                name=f"extraction-worker-{os.getpid()}-{worker_index}",
+                daemon=True
+            ).start()
+
+        _extraction_workers_started = True
+        print(f"🧵 Started {EXTRACTION_JOB_WORKERS} extraction worker thread(s) in process {os.getpid()}")
+
+def extraction_worker_loop():
+    """Claim and run queued extraction jobs until the process exits"""
+    worker_id = threading.current_thread().name
+
+    while True:
+        try:
+            job = db.claim_next_extraction_job(worker_id)
+        except Exception as e:
+            print(f"⚠️ Could not claim extraction job: {e}")
+            job = None
+
+        if job is None:
+            # Poll for jobs queued by the web workers
+            time.sleep(EXTRACTION_JOB_POLL_SECONDS)
+            continue
+
+        run_extraction_job(job)
+
+def run_extraction_worker():
+    """Entry point of the standalone extraction worker process
+
+    Runs EXTRACTION_JOB_WORKERS worker loops and blocks until the process is
+    terminated. Must run on the same host as the web workers: they share the
+    SQLite database and the upload spool directory.
+    """
+    print(f"🏭 Extraction worker process {os.getpid()} polling for jobs")
+    ensure_extraction_workers()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        while True:
+            time.sleep(3600)
+    except (KeyboardInterrupt, SystemExit):
+        print(f"🏭 Extraction worker process {os.getpid()} stopping")
+
+def run_extraction_job(job):
+    """Run one extraction job and store its result in the session's progressive cache"""
+    job_id = job['job_id']
+    print(f"⚙️ Running extraction job {job_id[:8]}...")
+
+    report_progress = make_progress_reporter(job['flask_session_id'], job_id)
+    preview_saved = False
+    rss_before_mb = get_peak_rss_mb()
+
+    try:
+        pdf_buffer = open_spooled_upload(job['pdf_path'])
+
+        # Validated on upload; only jobs queued before that was stored repeat it
+        validation = job['validation'] or prevalidate_pdf(pdf_buffer)
+
+        # A repeat upload is answered straight from the extraction cache,
+        # without a preview phase
+        pdf_hash, extractor_version = get_extraction_cache_key(pdf_buffer, bool(job['analyze_images']))
+        extraction_result = db.get_extraction_cache(pdf_hash, extractor_version)
+        if extraction_result:
+            print(f"✅ Using cached extraction ({len(extraction_result['combined_content'])} chars)")
+        else:
+            # Phase one: first pages + executive summary, so the wizard can move on
+            if FAST_FIRST_QUESTION:
+                preview_saved = run_preview_extraction(job, pdf_buffer, report_progress)
+
+            # Phase two: full extraction (text, tables, Vision)
+            extraction_result = comprehensive_pdf_extraction(
+                pdf_buffer,
+                analyze_images_flag=bool(job['analyze_images']),
+                progress=report_progress,
+                validation=validation
+            )
+
+        if not extraction_result or not extraction_result['combined_content']:
+            raise ValueError('Could not extract content from PDF')
+
+        report_text = extraction_result['combined_content']
+
+        # Cache extraction results (exclude raw image bytes - only metadata).
+        # After a preview, update in place so its AI analysis is kept
+        save_extraction = db.update_progressive_cache_extraction if preview_saved else db.save_progressive_cache_extraction
+        save_extraction(job['flask_session_id'], {
+            'combined_content': report_text,
+            'tables': extraction_result['tables'],
+            'image_count': len(extraction_result['images']),  # Just count, not bytes
+            'image_descriptions': extraction_result['image_descriptions'],
+            # Per-page text and hashes for incremental re-analysis of revised uploads
+            'text': extraction_result['text'],
+            'page_offsets': extraction_result.get('page_offsets', []),
+            'page_hashes': extraction_result.get('page_hashes', [])
+        })
+
+        db.update_extraction_job(
+            job_id,
+            status='complete',
+            stage='complete',
+            progress=100,
+            pdf_path=None,
+            result={
+                'char_count': len(report_text),
+                'table_count': len(extraction_result['tables']),
+                'image_count': len(extraction_result['images']),
+                'stage_timings': extraction_result.get('stage_timings', {}),
+                'failed_stages': extraction_result.get('failed_stages', []),
+                'pdf_mb': round(len(pdf_buffer) / (1024 * 1024), 1),
+                'peak_rss_mb': get_peak_rss_mb()
+            }
+        )
+        print(f"📈 Extraction job {job_id[:8]} memory: {len(pdf_buffer) / (1024 * 1024):.1f} MB PDF, "
+              f"process peak RSS {rss_before_mb} → {get_peak_rss_mb()} MB")
+        db.add_progress_event(job['flask_session_id'], 'complete', 100,
+                              f"Extracted {len(report_text)} characters")
+        print(f"✅ Extraction job {job_id[:8]} complete: {len(report_text)} characters")
+
+    except Exception as e:
+        print(f"❌ Extraction job {job_id[:8]} failed: {e}")
+        import traceback
+        traceback.print_exc()
+        db.update_extraction_job(job_id, status='error', error=str(e), pdf_path=None)
+        db.add_progress_event(job['flask_session_id'], 'error', None, str(e))
+
+    finally:
+        remove_spooled_upload(job['pdf_path'])
+
+def run_preview_extraction(job, pdf_buffer, report_progress):
+    """Phase one of a job: cache a provisional preview extraction for the session
+
+    Returns True if a preview was cached.
+    """
+    try:
+        preview_text, preview_pages = run_in_sandbox(extract_preview_text, (pdf_buffer,))
+    except PDFSandboxError as e:
+        print(f"⚠️ Skipping preview: {e}")
+        return False
+    if not preview_text:
+        return False
+
+    combined_content = f"""
+=== DOCUMENT TEXT CONTENT (PREVIEW: pages {', '.join(str(page) for page in preview_pages)}) ===
+{preview_text}
+"""
+    db.save_progressive_cache_extraction(job['flask_session_id'], {
+        'combined_content': combined_content,
+        'tables': [],
+        'image_count': 0,
+        'image_descriptions': [],
+        'provisional': True
+    })
+    db.update_extraction_job(job['job_id'], result={
+        'provisional': True,
+        'char_count': len(combined_content),
+        'table_count': 0,
+        'image_count': 0
+    })
+    report_progress('preview_ready', 5, f"First {len(preview_pages)} pages ready")
+    return True
+
+def refine_provisional_session(sid, session_data):
+    """Merge full-document key details into a session launched on a preview
+
+    Called between turns. Once phase two of the extraction has landed, the
+    session switches to the full report content immediately and the key
+    detail analysis runs on a background thread; new details are appended to
+    the topic pool so already-used topic indices stay valid.
+    """
+    if not session_data.get('content_provisional'):
+        return
+
+    extraction = get_cached_data().get('extraction')
+    if not extraction or extraction.get('provisional'):
+        return  # Full extraction still running
+
+    if not db.claim_session_refinement(sid):
+        return  # Another request is already refining this session
+
+    full_content = extraction['combined_content']
+    db.update_session(sid, report_content=full_content)
+    session_data['report_content'] = full_content
+    session_data['content_provisional'] = 0
+
+    def refine():
+        try:
+            key_details = analyze_document_incrementally(
+                extraction, session_data['company_name'],
+                session_data['industry'], session_data['report_type']
+            )
+            added = db.merge_session_key_details(
+                sid, lambda existing: deduplicate_key_details([key_details], existing))
+            print(f"🧩 Merged {added} key details from the full report into session {sid}")
+        except Exception as e:
+            print(f"⚠️ Could not refine key details for session {sid}: {e}")
+
+    threading.Thread(target=refine, name=f"refine-{sid[:8]}", daemon=True).start()
+
 # ========== ROUTES ==========
 @app.route('/')
 def index():
@@ -1180,8 +3611,8 @@ def index():
 @app.route('/upload_pdf', methods=['POST'])
 def upload_pdf():
     """
-    Step 1: Handle PDF upload and start extraction immediately
-    Stores results in Flask session (persists across Gunicorn workers)
+    Step 1: Handle PDF upload and queue extraction as a background job
+    Returns a job ID immediately; poll /extraction_status/<job_id> for progress
     """
     try:
         if 'report' not in request.files:
@@ -1194,57 +3625,98 @@ def upload_pdf():
         if not file.filename.lower().endswith('.pdf'):
             return jsonify({'status': 'error', 'error': 'Please upload a PDF file'})
 
-        print(f"📄 Starting PDF extraction...")
-
-        # Generate unique temp filename for PDF
         import uuid
-        temp_id = str(uuid.uuid4())[:8]
+        job_id = str(uuid.uuid4())
 
-        # Save PDF temporarily
-        filename = secure_filename(file.filename)
-        temp_pdf_path = os.path.join(UPLOAD_FOLDER, f"temp_{temp_id}_{filename}")
-        file.save(temp_pdf_path)
+        # Extraction (~60 seconds for large reports) runs in the extraction
+        # worker process; results land in the progressive cache for this session
+        flask_sid = get_flask_session_id()
+        db.clear_progress_events(flask_sid)
+        pdf_buffer = open_upload_buffer(file)
 
+        # Fast-fail: reject unreadable, locked or oversized PDFs before queuing
         try:
-            # Extract comprehensive content from PDF (text, tables, embedded images)
-            # This is the slowest part (~60 seconds for large reports)
-            file.seek(0)  # Reset file pointer
-            extraction_result = comprehensive_pdf_extraction(file, analyze_images_flag=True)
+            validation = prevalidate_pdf(pdf_buffer)
+        except PDFValidationError as e:
+            return jsonify({'status': 'error', 'error': str(e)})
+
+        # Straight from Werkzeug's spool to ours, without a bytes copy in between
+        pdf_path = spool_upload(job_id, pdf_buffer)
+        db.create_extraction_job(job_id, flask_sid, pdf_path, validation=validation, analyze_images=True)
+        db.cleanup_old_extraction_jobs()
+        db.cleanup_old_progress_events()
+        cleanup_spooled_uploads()
+
+        return jsonify({
+            'status': 'success',
+            'job_id': job_id,
+            'extraction_complete': False
+        })
 
-            if not extraction_result or not extraction_result['combined_content']:
-                return jsonify({'status': 'error', 'error': 'Could not extract content from PDF'})
+    except Exception as e:
+        print(f"Upload error: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'status': 'error', 'error': f'Error processing file: {str(e)}'})
 
-            report_text = extraction_result['combined_content']
 
-            print(f"✅ Extraction complete: {len(report_text)} characters")
-            print(f"   📊 Tables: {len(extraction_result['tables'])}, 🖼️ Images: {len(extraction_result['images'])}")
+@app.route('/extraction_status/<job_id>', methods=['GET'])
+def extraction_status(job_id):
+    """Report stage and percent progress for a background extraction job"""
+    try:
+        job = db.get_extraction_job(job_id)
 
-            # Cache extraction results (exclude raw image bytes - only metadata)
-            cache_extraction({
-                'combined_content': report_text,
-                'tables': extraction_result['tables'],
-                'image_count': len(extraction_result['images']),  # Just count, not bytes
-                'image_descriptions': extraction_result['image_descriptions']
-            })
+        if not job or job['flask_session_id'] != get_flask_session_id():
+            return jsonify({'status': 'error', 'error': 'Extraction job not found. Please re-upload PDF.'}), 404
 
-            return jsonify({
-                'status': 'success',
-                'extraction_complete': True,
-                'char_count': len(report_text),
-                'table_count': len(extraction_result['tables']),
-                'image_count': len(extraction_result['images'])
-            })
+        # A running job with a provisional result has its preview cached, which
+        # is enough for the wizard to continue (fast first question mode)
+        preview_ready = job['status'] == 'running' and bool(job['result'] and job['result'].get('provisional'))
 
-        finally:
-            # Clean up temp PDF file
-            if os.path.exists(temp_pdf_path):
-                os.remove(temp_pdf_path)
+        response = {
+            'status': 'success',
+            'job_id': job_id,
+            'state': job['status'],
+            'stage': job['stage'],
+            'progress': job['progress'],
+            'extraction_complete': job['status'] == 'complete' or preview_ready
+        }
+
+        if (job['status'] == 'complete' or preview_ready) and job['result']:
+            response.update(job['result'])
+        elif job['status'] == 'error':
+            response['error'] = job['error']
+
+        return jsonify(response)
 
     except Exception as e:
-        print(f"Upload error: {e}")
+        print(f"Extraction status error: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({'status': 'error', 'error': f'Error processing file: {str(e)}'})
+        return jsonify({'status': 'error', 'error': f'Error checking extraction: {str(e)}'})
+
+
+@app.route('/progress_stream', methods=['GET'])
+def progress_stream():
+    """
+    Send this session's pending extraction and analysis progress as Server-Sent Events
+    Resumes after the Last-Event-ID header (or ?after=<id>) on reconnect
+    """
+    channel = get_flask_session_id()
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('after') or 0)
+    except ValueError:
+        last_event_id = 0
+
+    # Pending events only; the client reconnects after the retry interval
+    # (and closes or moves on after a terminal event)
+    events = db.get_progress_events(channel, last_event_id)
+    body = f"retry: {SSE_RETRY_MS}\n\n" + ''.join(format_sse_event(event) for event in events)
+
+    return Response(body, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Disable proxy buffering so events arrive as they happen
+    })
 
 
 @app.route('/analyze_content', methods=['POST'])
@@ -1265,22 +3737,25 @@ def analyze_content():
             return jsonify({'status': 'error', 'error': 'Extraction data not found. Please re-upload PDF.'})
 
         extraction = cached_data['extraction']
-        report_text = extraction['combined_content']
 
         print(f"🔍 Analyzing document for {company_name}...")
 
-        # Analyze document to extract key strategic details
-        key_details = analyze_document_with_ai(
-            report_text, None, company_name, industry, report_type
+        # Analyze document to extract key strategic details (reused from an
+        # earlier version of the same report if it barely changed)
+        key_details = analyze_document_incrementally(
+            extraction, company_name, industry, report_type,
+            progress=make_progress_reporter(get_flask_session_id())
         )
 
         # Cache AI analysis in Flask session
-        cache_ai_analysis(key_details)
+        provisional = extraction.get('provisional', False)
+        cache_ai_analysis(key_details, provisional=provisional)
 
         return jsonify({
             'status': 'success',
             'analysis_complete': True,
-            'key_details_count': len(key_details)
+            'key_details_count': len(key_details),
+            'provisional': provisional
         })
 
     except Exception as e:
@@ -1354,14 +3829,18 @@ def launch_panel():
         # If AI analysis is missing, run it now (handles race condition)
         if 'ai_analysis' not in cached_data:
             print(f"⚠️ AI analysis not in cache yet - running now...")
-            report_text = extraction['combined_content']
-            key_details = analyze_document_with_ai(
-                report_text, None, company_name, industry, report_type
+            key_details = analyze_document_incrementally(
+                extraction, company_name, industry, report_type
             )
-            cache_ai_analysis(key_details)
+            analysis_provisional = extraction.get('provisional', False)
+            cache_ai_analysis(key_details, provisional=analysis_provisional)
             print(f"✅ AI analysis completed on-demand: {len(key_details)} details")
         else:
             key_details = cached_data['ai_analysis']
+            analysis_provisional = cached_data.get('ai_analysis_provisional', False)
+
+        # Launched on the fast preview: full-report key details are merged in later
+        content_provisional = bool(extraction.get('provisional') or analysis_provisional)
 
         company_research = cached_data.get('web_research', None)
 
@@ -1396,7 +3875,8 @@ def launch_panel():
             allow_followups=allow_followups,
             enable_web_research=enable_web_research,
             enable_ai_feedback=enable_ai_feedback,
-            company_research=company_research
+            company_research=company_research,
+            content_provisional=content_provisional
         )
 
         # Add first question to database
@@ -1411,6 +3891,10 @@ def launch_panel():
         # Update session with first topic used
         db.update_session(sid, used_topics=[first_topic], current_question_count=1)
 
+        # If the full extraction already landed, start merging its key details now
+        if content_provisional:
+            refine_provisional_session(sid, db.get_session(sid))
+
         # Keep progressive cache so "Same Company, New Panel" can reuse the
         # extraction/analysis without re-uploading. Cache is overwritten on
         # any new upload (INSERT OR REPLACE) and auto-expires after 1 hour.
@@ -1477,109 +3961,101 @@ def upload_report():
         print(f"📄 Processing PDF for {company_name}...")
         print(f"   Settings: followups={allow_followups}, research={enable_web_research}, feedback={enable_ai_feedback}")
 
-        # Save PDF temporarily for Vision API
-        filename = secure_filename(file.filename)
-        temp_pdf_path = os.path.join(UPLOAD_FOLDER, f"temp_{datetime.now().timestamp()}_{filename}")
-        file.save(temp_pdf_path)
+        # Read the upload in place (full-page Vision below is disabled, so no temp PDF is needed)
+        pdf_buffer = open_upload_buffer(file)
 
-        try:
-            # Extract comprehensive content from PDF (text, tables, embedded images)
-            file.seek(0)  # Reset file pointer
-            extraction_result = comprehensive_pdf_extraction(file, analyze_images_flag=True)
-
-            if not extraction_result or not extraction_result['combined_content']:
-                return jsonify({'status': 'error', 'error': 'Could not extract content from PDF'})
-
-            # Get the enriched combined content (includes text, tables, and embedded image analysis)
-            report_text = extraction_result['combined_content']
-
-            print(f"✅ Comprehensive extraction complete: {len(report_text)} characters")
-            print(f"   📊 Tables: {len(extraction_result['tables'])}, 🖼️ Images: {len(extraction_result['images'])} (analyzed: {len(extraction_result['image_descriptions'])})")
-
-            # OPTIONAL: Full-page Vision analysis (DISABLED - redundant with embedded image analysis)
-            # Embedded image analysis already captures visual content from charts/graphs
-            # Enabling this adds 40-60 seconds for minimal additional value
-            vision_analysis = None
-            # vision_analysis, page_count = analyze_pdf_with_vision(
-            #     temp_pdf_path, company_name, industry, report_type
-            # )
-
-            # Use comprehensive extraction (text + tables + embedded images)
-            full_content = report_text  # Already includes text + tables + embedded images
-
-            # NEW: Optional web research
-            company_research = None
-            if enable_web_research:
-                company_research = research_company_online(company_name)
-
-            # Analyze document to extract key details
-            key_details = analyze_document_with_ai(
-                report_text, vision_analysis, company_name, industry, report_type
-            )
+        # Extract comprehensive content from PDF (text, tables, embedded images)
+        extraction_result = comprehensive_pdf_extraction(pdf_buffer, analyze_images_flag=True)
 
-            # Generate first question
-            first_executive = selected_executives[0]
-            first_question, first_topic = generate_ai_questions_with_topic_diversity(
-                full_content, first_executive, company_name, industry, report_type,
-                key_details, [], 1, company_research,
-                conversation_history=[]  # First question, no history yet
-            )
+        if not extraction_result or not extraction_result['combined_content']:
+            return jsonify({'status': 'error', 'error': 'Could not extract content from PDF'})
 
-            # Generate TTS for first question
-            exec_name = get_executive_name(first_executive)
-            first_tts_url = generate_tts_audio(first_question, exec_name)
+        # Get the enriched combined content (includes text, tables, and embedded image analysis)
+        report_text = extraction_result['combined_content']
 
-            # Create session in database
-            sid = get_session_id()
-            db.create_session(
-                session_id=sid,
-                company_name=company_name,
-                industry=industry,
-                report_type=report_type,
-                selected_executives=selected_executives,
-                report_content=full_content,
-                key_details=key_details,
-                question_limit=question_limit,
-                allow_followups=allow_followups,
-                enable_web_research=enable_web_research,
-                enable_ai_feedback=enable_ai_feedback,
-                company_research=company_research
-            )
+        print(f"✅ Comprehensive extraction complete: {len(report_text)} characters")
+        print(f"   📊 Tables: {len(extraction_result['tables'])}, 🖼️ Images: {len(extraction_result['images'])} (analyzed: {len(extraction_result['image_descriptions'])})")
 
-            # Add first question to database
-            db.add_question(
-                session_id=sid,
-                executive=first_executive,
-                executive_name=exec_name,
-                question_text=first_question,
-                is_followup=False
-            )
+        # OPTIONAL: Full-page Vision analysis (DISABLED - redundant with embedded image analysis)
+        # Embedded image analysis already captures visual content from charts/graphs
+        # Enabling this adds 40-60 seconds for minimal additional value
+        # (and needs the PDF written to a temp file path first)
+        vision_analysis = None
+        # vision_analysis, page_count = analyze_pdf_with_vision(
+        #     temp_pdf_path, company_name, industry, report_type
+        # )
 
-            # Update session with first topic used
-            db.update_session(sid, used_topics=[first_topic], current_question_count=1)
+        # Use comprehensive extraction (text + tables + embedded images)
+        full_content = report_text  # Already includes text + tables + embedded images
 
-            print(f"🎯 {first_executive} asking first question")
-            print(f"💾 Session {sid} created in database")
+        # NEW: Optional web research
+        company_research = None
+        if enable_web_research:
+            company_research = research_company_online(company_name)
 
-            return jsonify({
-                'status': 'success',
-                'first_question': {
-                    'executive': first_executive,
-                    'name': exec_name,
-                    'title': first_executive,
-                    'question': first_question,
-                    'timestamp': datetime.now(CST).isoformat(),
-                    'tts_url': first_tts_url,
-                    'image': get_executive_image(first_executive)  # NEW: Add headshot
-                },
-                'ai_mode': 'enabled' if openai_available else 'demo',
-                'research_enabled': enable_web_research and company_research is not None
-            })
+        # Analyze document to extract key details
+        key_details = analyze_document_with_ai(
+            report_text, vision_analysis, company_name, industry, report_type
+        )
 
-        finally:
-            # Clean up temp PDF file
-            if os.path.exists(temp_pdf_path):
-                os.remove(temp_pdf_path)
+        # Generate first question
+        first_executive = selected_executives[0]
+        first_question, first_topic = generate_ai_questions_with_topic_diversity(
+            full_content, first_executive, company_name, industry, report_type,
+            key_details, [], 1, company_research,
+            conversation_history=[]  # First question, no history yet
+        )
+
+        # Generate TTS for first question
+        exec_name = get_executive_name(first_executive)
+        first_tts_url = generate_tts_audio(first_question, exec_name)
+
+        # Create session in database
+        sid = get_session_id()
+        db.create_session(
+            session_id=sid,
+            company_name=company_name,
+            industry=industry,
+            report_type=report_type,
+            selected_executives=selected_executives,
+            report_content=full_content,
+            key_details=key_details,
+            question_limit=question_limit,
+            allow_followups=allow_followups,
+            enable_web_research=enable_web_research,
+            enable_ai_feedback=enable_ai_feedback,
+            company_research=company_research
+        )
+
+        # Add first question to database
+        db.add_question(
+            session_id=sid,
+            executive=first_executive,
+            executive_name=exec_name,
+            question_text=first_question,
+            is_followup=False
+        )
+
+        # Update session with first topic used
+        db.update_session(sid, used_topics=[first_topic], current_question_count=1)
+
+        print(f"🎯 {first_executive} asking first question")
+        print(f"💾 Session {sid} created in database")
+
+        return jsonify({
+            'status': 'success',
+            'first_question': {
+                'executive': first_executive,
+                'name': exec_name,
+                'title': first_executive,
+                'question': first_question,
+                'timestamp': datetime.now(CST).isoformat(),
+                'tts_url': first_tts_url,
+                'image': get_executive_image(first_executive)  # NEW: Add headshot
+            },
+            'ai_mode': 'enabled' if openai_available else 'demo',
+            'research_enabled': enable_web_research and company_research is not None
+        })
 
     except Exception as e:
         print(f"Upload error: {e}")
@@ -1697,6 +4173,9 @@ def respond_to_executive():
                 'session_ending': True
             })
 
+        # Pick up the full report if the session launched on a fast preview
+        refine_provisional_session(sid, session_data)
+
         # Generate next question
         selected_executives = session_data['selected_executives']
         next_exec = get_next_executive(selected_executives, next_count)
@@ -1876,6 +4355,9 @@ def respond_to_executive_audio():
                     'session_ending': True
                 })
 
+            # Pick up the full report if the session launched on a fast preview
+            refine_provisional_session(sid, session_data)
+
             # Generate next question
             selected_executives = session_data['selected_executives']
             next_exec = get_next_executive(selected_executives, next_count)
@@ -2261,9 +4743,19 @@ def health():
     return jsonify({
         'status': 'healthy',
         'ai_available': openai_available,
-        'database': stats
+        'database': stats,
+        'extraction_cache': db.get_extraction_cache_stats(),
+        'vision_cache': db.get_vision_cache_stats(),
+        'page_cache': db.get_page_cache_stats(),
+        'prompt_usage': db.get_prompt_usage_stats()
     })
 
+# Startup messages printed while importing (in the PDF forkserver too) must
+# not sit in the stdout buffer, or every process forked from it replays them
+sys.stdout.flush()
+
 if __name__ == '__main__':
+    # No Gunicorn master to start the extraction worker process: work the queue in-process
+    ensure_extraction_workers()
     port = int(os.environ.get('PORT', 8080))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for the PDF extraction and analysis pipeline
+Run against a real PDF with API keys configured, e.g.:
+
+    python benchmark.py vision path/to/report.pdf --runs 3
+    python benchmark.py memory path/to/report.pdf another.pdf
+    python benchmark.py tables corpus/*.pdf
+    python benchmark.py startup --runs 5
+"""
+
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from dotenv import load_dotenv
+
+# Load environment variables before app_v2 builds its OpenAI client
+load_dotenv()
+
+import app_v2
+
+
+def summarize_usage(usage_log):
+    """Total prompt/completion tokens across a list of OpenAI usage objects"""
+    prompt_tokens = sum(u.prompt_tokens for u in usage_log)
+    completion_tokens = sum(u.completion_tokens for u in usage_log)
+    return prompt_tokens, completion_tokens
+
+
+def benchmark_vision(args):
+    """Compare per-image vs batched Vision requests for latency and token cost"""
+    if not app_v2.openai_available:
+        print("❌ Error: no OpenAI/Portkey credentials configured")
+        return
+
+    with open(args.pdf, 'rb') as f:
+        pdf_bytes = f.read()
+
+    _, images, *_ = app_v2.extract_text_and_images_with_pymupdf(pdf_bytes)
+    images = app_v2.prepare_images_for_vision(pdf_bytes, images)
+    if not images:
+        print("❌ Error: no embedded images found in PDF")
+        return
+
+    results = {}
+    for mode in ('per_image', 'batched'):
+        latencies = []
+        usage_log = []
+        described = 0
+
+        for run in range(args.runs):
+            start = time.perf_counter()
+            descriptions = app_v2.analyze_images_with_vision(
+                images, max_images=args.max_images, mode=mode, usage_log=usage_log,
+                use_cache=False  # Every run must actually call Vision
+            )
+            latencies.append(time.perf_counter() - start)
+            described += len(descriptions)
+
+        prompt_tokens, completion_tokens = summarize_usage(usage_log)
+        results[mode] = {
+            'mean_s': statistics.mean(latencies),
+            'min_s': min(latencies),
+            'requests': len(usage_log) / args.runs,
+            'prompt_tokens': prompt_tokens / args.runs,
+            'completion_tokens': completion_tokens / args.runs,
+            'described': described / args.runs
+        }
+
+    print("\n" + "="*72)
+    print(f"📊 Vision benchmark: {args.max_images} images, {args.runs} run(s)")
+    print("="*72)
+    print(f"{'mode':<10} {'mean s':>8} {'min s':>8} {'requests':>9} {'prompt tok':>11} {'compl tok':>10} {'described':>10}")
+    for mode, r in results.items():
+        print(f"{mode:<10} {r['mean_s']:>8.2f} {r['min_s']:>8.2f} {r['requests']:>9.1f} "
+              f"{r['prompt_tokens']:>11.0f} {r['completion_tokens']:>10.0f} {r['described']:>10.1f}")
+
+
+def measure_peak(func, *args, **kwargs):
+    """Run func and return (result, peak Python-heap MB allocated while it ran)"""
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak / (1024 * 1024)
+
+
+def benchmark_memory(args):
+    """Peak memory per upload for the single-buffer pipeline vs the old copy-per-stage path
+
+    Only Python-heap allocations are traced (that is where extra copies of the
+    PDF live); MuPDF's own allocations show up in the peak RSS column.
+    """
+    from werkzeug.datastructures import FileStorage
+
+    # Parse in this process so the traced heap includes the parser's copies
+    app_v2.PDF_SANDBOX_ENABLED = False
+
+    rows = []
+    for pdf_path in args.pdf:
+        with open(pdf_path, 'rb') as f:
+            pdf_bytes = f.read()
+        size_mb = len(pdf_bytes) / (1024 * 1024)
+
+        # Werkzeug spools uploads over 500KB to an anonymous temp file
+        spool = tempfile.SpooledTemporaryFile(max_size=500 * 1024, mode='rb+')
+        spool.write(pdf_bytes)
+        upload = FileStorage(spool, filename=pdf_path)
+
+        # Old path: read() the upload, BytesIO it again for pdfplumber
+        def copy_per_stage():
+            spool.seek(0)
+            data = spool.read()
+            app_v2.extract_text_and_images_with_pymupdf(data)
+            with app_v2.pdfplumber.open(io.BytesIO(memoryview(data))) as pdf:
+                return len(pdf.pages)
+
+        # New path: one mapped buffer shared by every stage
+        def single_buffer():
+            buffer = app_v2.open_upload_buffer(upload)
+            app_v2.extract_text_and_images_with_pymupdf(buffer)
+            with app_v2.pdfplumber.open(app_v2.PDFBufferReader(buffer)) as pdf:
+                return len(pdf.pages)
+
+        _, upload_read_mb = measure_peak(lambda: spool.seek(0) or spool.read())
+        _, upload_mapped_mb = measure_peak(app_v2.open_upload_buffer, upload)
+        _, copy_mb = measure_peak(copy_per_stage)
+        _, single_mb = measure_peak(single_buffer)
+
+        rows.append((pdf_path, size_mb, upload_read_mb, upload_mapped_mb, copy_mb, single_mb))
+        spool.close()
+
+    print("\n" + "="*96)
+    print("📊 Upload memory benchmark (peak Python-heap MB; 'x' = multiples of the PDF size)")
+    print("="*96)
+    print(f"{'pdf':<28} {'size MB':>8} {'read()':>9} {'mapped':>9} {'copy/stage':>16} {'single buffer':>16}")
+    for pdf_path, size_mb, read_mb, mapped_mb, copy_mb, single_mb in rows:
+        print(f"{pdf_path[-28:]:<28} {size_mb:>8.1f} {read_mb:>9.1f} {mapped_mb:>9.1f} "
+              f"{copy_mb:>9.1f} ({copy_mb / size_mb:>4.1f}x) {single_mb:>9.1f} ({single_mb / size_mb:>4.1f}x)")
+    print(f"\nProcess peak RSS: {app_v2.get_peak_rss_mb()} MB")
+
+
+def table_cells(table):
+    """Set of non-empty, whitespace-normalized cell strings in a table"""
+    return {' '.join(str(cell).split()) for row in table['data'] for cell in row if cell and str(cell).strip()}
+
+
+def table_recall(reference, candidate):
+    """Fraction of reference tables matched by a candidate table on the same page
+
+    A reference table counts as found when one candidate table on its page
+    shares at least half of its non-empty cell texts.
+    """
+    if not reference:
+        return None
+
+    found = 0
+    for ref in reference:
+        ref_cells = table_cells(ref)
+        for cand in (c for c in candidate if c['page'] == ref['page']):
+            if ref_cells and len(ref_cells & table_cells(cand)) >= len(ref_cells) / 2:
+                found += 1
+                break
+    return found / len(reference)
+
+
+def benchmark_tables(args):
+    """Compare table backends on a fixed corpus: pages/second and recall vs pdfplumber"""
+    totals = {backend: {'seconds': 0.0, 'tables': 0} for backend in app_v2.TABLE_EXTRACTORS}
+    total_pages = 0
+    recalls = {backend: [] for backend in app_v2.TABLE_EXTRACTORS}
+
+    print(f"{'pdf':<28} {'pages':>6} " + " ".join(f"{b + ' s':>14} {b + ' n':>14}" for b in totals))
+    for pdf_path in args.pdf:
+        with open(pdf_path, 'rb') as f:
+            pdf_bytes = f.read()
+        page_count = app_v2.inspect_pdf(pdf_bytes)['page_count']
+        total_pages += page_count
+
+        results = {}
+        row = []
+        for backend in totals:
+            start = time.perf_counter()
+            results[backend] = app_v2.extract_tables(pdf_bytes, backend=backend)
+            elapsed = time.perf_counter() - start
+            totals[backend]['seconds'] += elapsed
+            totals[backend]['tables'] += len(results[backend])
+            row.append(f"{elapsed:>14.2f} {len(results[backend]):>14}")
+
+        for backend in totals:
+            recall = table_recall(results['pdfplumber'], results[backend])
+            if recall is not None:
+                recalls[backend].append(recall)
+        print(f"{pdf_path[-28:]:<28} {page_count:>6} " + " ".join(row))
+
+    print("\n" + "="*72)
+    print(f"📊 Table backend benchmark: {len(args.pdf)} PDF(s), {total_pages} pages")
+    print("="*72)
+    print(f"{'backend':<12} {'pages/s':>9} {'tables':>8} {'recall vs pdfplumber':>22}")
+    for backend, t in totals.items():
+        recall = f"{statistics.mean(recalls[backend]):.0%}" if recalls[backend] else 'n/a'
+        print(f"{backend:<12} {total_pages / max(t['seconds'], 1e-9):>9.1f} {t['tables']:>8} {recall:>22}")
+
+
+# Runs in a fresh interpreter, as a gunicorn worker would on boot
+STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app_v2
+import_seconds = time.perf_counter() - start
+heavy = [name for name in ('fitz', 'pdfplumber', 'PyPDF2', 'openai', 'numpy', 'PIL.Image') if name in sys.modules]
+print(json.dumps({'import_seconds': import_seconds, 'rss_mb': app_v2.get_peak_rss_mb(), 'heavy_modules': heavy}))
+"""
+
+
+def measure_startup(lazy):
+    """Import app_v2 in a fresh process and return its import time, peak RSS and loaded heavy modules"""
+    env = {**os.environ, 'LAZY_IMPORTS': 'true' if lazy else 'false'}
+    result = subprocess.run(
+        [sys.executable, '-c', STARTUP_PROBE], env=env, capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def benchmark_startup(args):
+    """Compare worker startup with heavy libraries imported eagerly vs on first use"""
+    print(f"{'mode':<8} {'import s':>9} {'RSS MB':>8}  heavy modules loaded")
+    results = {}
+    for mode, lazy in (('eager', False), ('lazy', True)):
+        runs = [measure_startup(lazy) for _ in range(args.runs)]
+        results[mode] = {
+            'import_seconds': statistics.median(run['import_seconds'] for run in runs),
+            'rss_mb': statistics.median(run['rss_mb'] for run in runs)
+        }
+        print(f"{mode:<8} {results[mode]['import_seconds']:>9.2f} {results[mode]['rss_mb']:>8.1f}  "
+              f"{', '.join(runs[-1]['heavy_modules']) or '-'}")
+
+    eager, lazy = results['eager'], results['lazy']
+    print("\n" + "="*60)
+    print(f"📊 Worker startup: {eager['import_seconds']:.2f}s → {lazy['import_seconds']:.2f}s, "
+          f"{eager['rss_mb']:.0f} MB → {lazy['rss_mb']:.0f} MB RSS per worker (median of {args.runs})")
+    print("="*60)
+
+
+def main():
+    """Parse arguments and run the selected benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    vision_parser = subparsers.add_parser('vision', help='per-image vs batched Vision requests')
+    vision_parser.add_argument('pdf', help='PDF with embedded charts/images')
+    vision_parser.add_argument('--runs', type=int, default=3)
+    vision_parser.add_argument('--max-images', type=int, default=5)
+    vision_parser.set_defaults(func=benchmark_vision)
+
+    memory_parser = subparsers.add_parser('memory', help='peak memory per upload, single buffer vs copies')
+    memory_parser.add_argument('pdf', nargs='+', help='PDF file(s) to measure')
+    memory_parser.set_defaults(func=benchmark_memory)
+
+    tables_parser = subparsers.add_parser('tables', help='pdfplumber vs PyMuPDF table detection')
+    tables_parser.add_argument('pdf', nargs='+', help='PDF corpus to compare on')
+    tables_parser.set_defaults(func=benchmark_tables)
+
+    startup_parser = subparsers.add_parser('startup', help='worker import time and RSS, eager vs lazy imports')
+    startup_parser.add_argument('--runs', type=int, default=5)
+    startup_parser.set_defaults(func=benchmark_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
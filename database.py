@@ -5,25 +5,74 @@ Handles persistent storage of sessions, responses, and company research
 
 import sqlite3
 import json
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 from contextlib import contextmanager
 import os
 
 DB_PATH = 'executive_simulator.db'
 
+# One connection per thread, opened on first use. A forked child (a preloaded
+# Gunicorn worker or a PDF sandbox) starts with no connections and opens its
+# own instead of touching one it inherited. Up to DB_MAX_CACHED_CONNECTIONS
+# stay open for reuse (Gunicorn's request threads); connections of threads
+# that have exited are closed when the next one is opened, and threads beyond
+# the bound (short-lived pool threads) close theirs after each use.
+DB_MAX_CACHED_CONNECTIONS = int(os.environ.get('DB_MAX_CACHED_CONNECTIONS', 16))
+
+_local = threading.local()
+_connections = {}  # Thread -> its cached connection
+_connections_lock = threading.Lock()
+
+def _reset_after_fork():
+    global _local, _connections, _connections_lock
+    _local = threading.local()
+    _connections = {}
+    _connections_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_connection():
+    """This thread's SQLite connection, created lazily"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        # Not bound to this thread, so it can be closed once the thread has exited
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+        _local.conn = conn
+        _local.depth = 0
+
+        with _connections_lock:
+            for thread in [thread for thread in _connections if not thread.is_alive()]:
+                _connections.pop(thread).close()
+            _local.cached = len(_connections) < DB_MAX_CACHED_CONNECTIONS
+            if _local.cached:
+                _connections[threading.current_thread()] = conn
+
+    return conn
+
 @contextmanager
 def get_db():
-    """Context manager for database connections"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+    """Context manager for database connections
+
+    Commits on success and rolls back on error; nested uses on the same
+    thread share the outermost transaction.
+    """
+    conn = get_connection()
+    _local.depth += 1
     try:
         yield conn
-        conn.commit()
+        if _local.depth == 1:
+            conn.commit()
     except Exception as e:
-        conn.rollback()
+        if _local.depth == 1:
+            conn.rollback()
         raise e
     finally:
-        conn.close()
+        _local.depth -= 1
+        if _local.depth == 0 and not _local.cached:
+            conn.close()
+            _local.conn = None
 
 def init_database():
     """Initialize database tables"""
@@ -48,6 +97,7 @@ def init_database():
                 enable_ai_feedback BOOLEAN DEFAULT 0,
                 ai_feedback TEXT,  -- JSON with strengths/improvements arrays
                 company_research TEXT,  -- JSON object with research data
+                content_provisional BOOLEAN DEFAULT 0,  -- Key details come from the fast preview only
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
@@ -85,16 +135,140 @@ def init_database():
                 flask_session_id TEXT PRIMARY KEY,
                 extraction_data TEXT,  -- JSON with combined_content, tables, images, image_descriptions
                 ai_analysis_data TEXT,  -- JSON array of key details
+                analysis_provisional BOOLEAN DEFAULT 0,  -- Key details were extracted from the fast preview
                 web_research_data TEXT,  -- JSON with company research
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 expires_at TIMESTAMP  -- Auto-cleanup after 1 hour
             )
         ''')
 
+        # Extraction cache table (content-addressed, shared across sessions)
+        # Keyed by SHA-256 of the PDF bytes plus extractor version so that
+        # identical uploads (e.g. a whole class uploading the same case PDF)
+        # skip PyMuPDF/pdfplumber/Vision entirely
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                pdf_hash TEXT NOT NULL,
+                extractor_version TEXT NOT NULL,
+                extraction_data TEXT NOT NULL,  -- JSON with text, tables, image metadata, image_descriptions
+                size_bytes INTEGER NOT NULL,
+                hit_count INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_accessed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (pdf_hash, extractor_version)
+            )
+        ''')
+
+        # Vision description cache (keyed by embedded image content hash)
+        # Logos, standard slides and charts recur across different reports
+        # for the same case company, so descriptions are reused across documents
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS vision_cache (
+                image_hash TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                description TEXT NOT NULL,
+                hit_count INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_accessed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (image_hash, prompt_version)
+            )
+        ''')
+
+        # Per-page extraction cache (keyed by a hash of the page's content stream)
+        # Revised uploads of the same plan only re-process the pages that changed
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS page_cache (
+                page_hash TEXT NOT NULL,
+                extractor_version TEXT NOT NULL,
+                tables TEXT NOT NULL,  -- JSON list of tables found on the page (may be empty)
+                hit_count INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_accessed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (page_hash, extractor_version)
+            )
+        ''')
+
+        # Key detail analyses with the page hashes/texts they were made from,
+        # so a revised upload with immaterial changes reuses the analysis
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                context_key TEXT NOT NULL,  -- Hash of company name, industry and report type
+                page_hashes TEXT NOT NULL,  -- JSON array, one per page
+                page_texts TEXT NOT NULL,  -- JSON array, one per page (null past ANALYSIS_CACHE_TEXT_CHARS)
+                page_lengths TEXT,  -- JSON array of page text lengths
+                key_details TEXT NOT NULL,  -- JSON array
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Background extraction jobs (queue shared by all Gunicorn workers)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS extraction_jobs (
+                job_id TEXT PRIMARY KEY,
+                flask_session_id TEXT NOT NULL,
+                pdf_path TEXT,  -- Spooled upload, removed once the job finishes
+                validation TEXT,  -- JSON prevalidation result from the upload
+                analyze_images BOOLEAN DEFAULT 1,
+                status TEXT DEFAULT 'queued',  -- queued, running, complete, error
+                stage TEXT,
+                progress INTEGER DEFAULT 0,  -- Percent complete
+                error TEXT,
+                result TEXT,  -- JSON summary (char/table/image counts)
+                claim_token TEXT,
+                attempts INTEGER DEFAULT 0,  -- Times claimed; reclaims of orphaned jobs count too
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Progress events for the Server-Sent Events stream
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS progress_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,  -- Flask session cache ID
+                stage TEXT NOT NULL,
+                progress INTEGER,  -- Percent complete (NULL for detail-only events)
+                detail TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Cache hit/miss counters (shared across Gunicorn workers)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                cache_name TEXT PRIMARY KEY,
+                hits INTEGER DEFAULT 0,
+                misses INTEGER DEFAULT 0,
+                evictions INTEGER DEFAULT 0
+            )
+        ''')
+
+        # Per-prompt token usage (local count before sending, plus the API's own counts)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS prompt_usage (
+                prompt_name TEXT PRIMARY KEY,
+                calls INTEGER DEFAULT 0,
+                prompt_tokens INTEGER DEFAULT 0,  -- Counted locally before sending
+                max_prompt_tokens INTEGER DEFAULT 0,
+                budget_tokens INTEGER,  -- Budget the prompt was fitted to, if any
+                truncated_calls INTEGER DEFAULT 0,  -- Calls where a part was cut or dropped to fit
+                api_prompt_tokens INTEGER DEFAULT 0,
+                api_completion_tokens INTEGER DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
         # Create indices for faster queries
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_session ON questions(session_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_responses_session ON responses(session_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions(created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_extraction_cache_accessed ON extraction_cache(last_accessed_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_vision_cache_accessed ON vision_cache(last_accessed_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_extraction_jobs_status ON extraction_jobs(status, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_progress_events_channel ON progress_events(channel, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_page_cache_accessed ON page_cache(last_accessed_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_analysis_cache_context ON analysis_cache(context_key, created_at)')
 
         # Migration: add AI feedback columns if they don't exist
         try:
@@ -106,12 +280,46 @@ def init_database():
         except sqlite3.OperationalError:
             pass  # Column already exists
 
+        # Migration: add fast-first-question (preview) columns if they don't exist
+        try:
+            cursor.execute('ALTER TABLE sessions ADD COLUMN content_provisional BOOLEAN DEFAULT 0')
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        try:
+            cursor.execute('ALTER TABLE progressive_cache ADD COLUMN analysis_provisional BOOLEAN DEFAULT 0')
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+
+        # Migration: uploads are spooled to disk instead of stored as BLOBs
+        try:
+            cursor.execute('ALTER TABLE extraction_jobs ADD COLUMN pdf_path TEXT')
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+
+        # Migration: keep the upload's prevalidation result for the job
+        try:
+            cursor.execute('ALTER TABLE extraction_jobs ADD COLUMN validation TEXT')
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+
+        # Migration: count claims so a PDF that keeps killing the worker is given up on
+        try:
+            cursor.execute('ALTER TABLE extraction_jobs ADD COLUMN attempts INTEGER DEFAULT 0')
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+
+        # Migration: add page lengths to the analysis cache if they don't exist
+        try:
+            cursor.execute('ALTER TABLE analysis_cache ADD COLUMN page_lengths TEXT')
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+
         print("✅ Database initialized successfully")
 
 def create_session(session_id, company_name, industry, report_type,
                   selected_executives, report_content, key_details,
                   question_limit, allow_followups=False, enable_web_research=False,
-                  enable_ai_feedback=False, company_research=None):
+                  enable_ai_feedback=False, company_research=None, content_provisional=False):
     """Create a new session (or replace existing if session_id already exists)"""
     with get_db() as conn:
         cursor = conn.cursor()
@@ -120,8 +328,9 @@ def create_session(session_id, company_name, industry, report_type,
             INSERT OR REPLACE INTO sessions
             (session_id, company_name, industry, report_type, selected_executives,
              report_content, key_details, question_limit, allow_followups,
-             enable_web_research, enable_ai_feedback, company_research, used_topics)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+             enable_web_research, enable_ai_feedback, company_research, used_topics,
+             content_provisional)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             session_id,
             company_name,
@@ -135,7 +344,8 @@ def create_session(session_id, company_name, industry, report_type,
             enable_web_research,
             enable_ai_feedback,
             json.dumps(company_research) if company_research else None,
-            json.dumps([])  # Empty used_topics initially
+            json.dumps([]),  # Empty used_topics initially
+            content_provisional
         ))
 
 def get_session(session_id):
@@ -184,6 +394,38 @@ def update_session(session_id, **kwargs):
         query = f"UPDATE sessions SET {', '.join(set_clauses)} WHERE session_id = ?"
         cursor.execute(query, values)
 
+def claim_session_refinement(session_id):
+    """Atomically clear a session's provisional flag; True for the one caller that wins"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE sessions SET content_provisional = 0, updated_at = ?
+            WHERE session_id = ? AND content_provisional = 1
+        ''', (datetime.now().isoformat(), session_id))
+        return cursor.rowcount == 1
+
+def merge_session_key_details(session_id, select_new):
+    """Append key details the session doesn't have yet (existing topic indices stay valid)
+
+    select_new(existing key details) returns the details to append; it runs
+    inside the transaction so concurrent merges can't both add the same one.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT key_details FROM sessions WHERE session_id = ?', (session_id,))
+        row = cursor.fetchone()
+        if not row:
+            return 0
+
+        key_details = json.loads(row['key_details'])
+        added = list(select_new(key_details))
+        if added:
+            cursor.execute('''
+                UPDATE sessions SET key_details = ?, updated_at = ?
+                WHERE session_id = ?
+            ''', (json.dumps(key_details + added), datetime.now().isoformat(), session_id))
+        return len(added)
+
 def add_question(session_id, executive, executive_name, question_text, is_followup=False):
     """Add a question to the session"""
     with get_db() as conn:
@@ -330,8 +572,6 @@ def get_session_stats():
 
 def save_progressive_cache_extraction(flask_session_id, extraction_data):
     """Save extraction data to database for progressive analysis"""
-    from datetime import timedelta
-
     with get_db() as conn:
         cursor = conn.cursor()
 
@@ -346,16 +586,37 @@ def save_progressive_cache_extraction(flask_session_id, extraction_data):
 
         print(f"💾 Saved extraction to database cache for session {flask_session_id[:20]}...")
 
-def save_progressive_cache_analysis(flask_session_id, analysis_data):
+def update_progressive_cache_extraction(flask_session_id, extraction_data):
+    """Replace extraction data in place, keeping any AI analysis and web research
+
+    Used when the full extraction lands after a fast preview was cached.
+    Falls back to a fresh insert if the row has expired or never existed.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE progressive_cache
+            SET extraction_data = ?
+            WHERE flask_session_id = ?
+        ''', (json.dumps(extraction_data), flask_session_id))
+        updated = cursor.rowcount
+
+    if not updated:
+        save_progressive_cache_extraction(flask_session_id, extraction_data)
+    else:
+        print(f"💾 Updated extraction in database cache for session {flask_session_id[:20]}...")
+
+def save_progressive_cache_analysis(flask_session_id, analysis_data, provisional=False):
     """Save AI analysis data to database for progressive analysis"""
     with get_db() as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
             UPDATE progressive_cache
-            SET ai_analysis_data = ?
+            SET ai_analysis_data = ?, analysis_provisional = ?
             WHERE flask_session_id = ?
-        ''', (json.dumps(analysis_data), flask_session_id))
+        ''', (json.dumps(analysis_data), provisional, flask_session_id))
 
         print(f"💾 Saved AI analysis to database cache for session {flask_session_id[:20]}...")
 
@@ -378,7 +639,7 @@ def get_progressive_cache(flask_session_id):
         cursor = conn.cursor()
 
         cursor.execute('''
-            SELECT extraction_data, ai_analysis_data, web_research_data
+            SELECT extraction_data, ai_analysis_data, analysis_provisional, web_research_data
             FROM progressive_cache
             WHERE flask_session_id = ?
             AND (expires_at IS NULL OR expires_at > datetime('now'))
@@ -397,6 +658,7 @@ def get_progressive_cache(flask_session_id):
 
         if row['ai_analysis_data']:
             cache['ai_analysis'] = json.loads(row['ai_analysis_data'])
+            cache['ai_analysis_provisional'] = bool(row['analysis_provisional'])
 
         if row['web_research_data']:
             cache['web_research'] = json.loads(row['web_research_data'])
@@ -431,6 +693,613 @@ def cleanup_expired_progressive_cache():
             print(f"🗑️ Cleaned up {deleted} expired progressive cache entries")
         return deleted
 
+# ============================================================================
+# EXTRACTION CACHE FUNCTIONS (Content-addressed, shared across sessions)
+# ============================================================================
+
+# Total size budget for cached extractions; least-recently-used entries are
+# evicted once the table grows past this
+EXTRACTION_CACHE_MAX_BYTES = int(os.environ.get('EXTRACTION_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+
+def record_cache_event(cache_name, event, count=1):
+    """Increment a hit/miss/eviction counter for a named cache"""
+    if event not in ('hits', 'misses', 'evictions'):
+        raise ValueError(f"Unknown cache event: {event}")
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT OR IGNORE INTO cache_stats (cache_name) VALUES (?)', (cache_name,))
+        cursor.execute(f'''
+            UPDATE cache_stats SET {event} = {event} + ?
+            WHERE cache_name = ?
+        ''', (count, cache_name))
+
+def record_prompt_usage(prompt_name, prompt_tokens, budget_tokens=None, truncated=False,
+                        api_prompt_tokens=0, api_completion_tokens=0):
+    """Add one call's token counts to a prompt's running totals"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT OR IGNORE INTO prompt_usage (prompt_name) VALUES (?)', (prompt_name,))
+        cursor.execute('''
+            UPDATE prompt_usage
+            SET calls = calls + 1,
+                prompt_tokens = prompt_tokens + ?,
+                max_prompt_tokens = MAX(max_prompt_tokens, ?),
+                budget_tokens = COALESCE(?, budget_tokens),
+                truncated_calls = truncated_calls + ?,
+                api_prompt_tokens = api_prompt_tokens + ?,
+                api_completion_tokens = api_completion_tokens + ?,
+                updated_at = ?
+            WHERE prompt_name = ?
+        ''', (prompt_tokens, prompt_tokens, budget_tokens, 1 if truncated else 0,
+              api_prompt_tokens, api_completion_tokens, datetime.now().isoformat(), prompt_name))
+
+def get_prompt_usage_stats():
+    """Per-prompt token usage: calls, average/max prompt tokens, budget and truncation rate"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM prompt_usage ORDER BY prompt_tokens DESC')
+        rows = cursor.fetchall()
+
+    return {
+        row['prompt_name']: {
+            'calls': row['calls'],
+            'avg_prompt_tokens': round(row['prompt_tokens'] / row['calls']) if row['calls'] else 0,
+            'max_prompt_tokens': row['max_prompt_tokens'],
+            'budget_tokens': row['budget_tokens'],
+            'truncated_rate': round(row['truncated_calls'] / row['calls'], 3) if row['calls'] else 0.0,
+            'avg_api_prompt_tokens': round(row['api_prompt_tokens'] / row['calls']) if row['calls'] else 0,
+            'avg_completion_tokens': round(row['api_completion_tokens'] / row['calls']) if row['calls'] else 0
+        }
+        for row in rows
+    }
+
+def get_extraction_cache(pdf_hash, extractor_version):
+    """Look up a cached extraction by PDF hash; records a hit or miss"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT extraction_data FROM extraction_cache
+            WHERE pdf_hash = ? AND extractor_version = ?
+        ''', (pdf_hash, extractor_version))
+
+        row = cursor.fetchone()
+
+        if row:
+            cursor.execute('''
+                UPDATE extraction_cache
+                SET hit_count = hit_count + 1, last_accessed_at = ?
+                WHERE pdf_hash = ? AND extractor_version = ?
+            ''', (datetime.now().isoformat(), pdf_hash, extractor_version))
+
+    if not row:
+        record_cache_event('extraction', 'misses')
+        return None
+
+    record_cache_event('extraction', 'hits')
+    print(f"⚡ Extraction cache hit for PDF {pdf_hash[:12]}...")
+    return json.loads(row['extraction_data'])
+
+def save_extraction_cache(pdf_hash, extractor_version, extraction_data):
+    """Store an extraction result and evict old entries if over the size budget"""
+    payload = json.dumps(extraction_data)
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO extraction_cache
+            (pdf_hash, extractor_version, extraction_data, size_bytes, created_at, last_accessed_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
+        ''', (pdf_hash, extractor_version, payload, len(payload), datetime.now().isoformat()))
+
+    print(f"💾 Saved extraction to content cache for PDF {pdf_hash[:12]}... ({len(payload):,} bytes)")
+    evict_extraction_cache()
+
+def evict_extraction_cache(max_bytes=None):
+    """Evict least-recently-used extractions until the cache fits in max_bytes"""
+    if max_bytes is None:
+        max_bytes = EXTRACTION_CACHE_MAX_BYTES
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT COALESCE(SUM(size_bytes), 0) as total FROM extraction_cache')
+        total = cursor.fetchone()['total']
+
+        if total <= max_bytes:
+            return 0
+
+        cursor.execute('''
+            SELECT pdf_hash, extractor_version, size_bytes FROM extraction_cache
+            ORDER BY last_accessed_at ASC
+        ''')
+
+        evicted = 0
+        for row in cursor.fetchall():
+            if total <= max_bytes:
+                break
+            cursor.execute('''
+                DELETE FROM extraction_cache
+                WHERE pdf_hash = ? AND extractor_version = ?
+            ''', (row['pdf_hash'], row['extractor_version']))
+            total -= row['size_bytes']
+            evicted += 1
+
+    if evicted:
+        record_cache_event('extraction', 'evictions', evicted)
+        print(f"🗑️ Evicted {evicted} extraction cache entries (LRU)")
+    return evicted
+
+def get_cache_counters(cache_name):
+    """Get hit/miss/eviction counters and hit rate for a named cache"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT hits, misses, evictions FROM cache_stats
+            WHERE cache_name = ?
+        ''', (cache_name,))
+        counters = cursor.fetchone()
+
+    hits = counters['hits'] if counters else 0
+    misses = counters['misses'] if counters else 0
+
+    return {
+        'hits': hits,
+        'misses': misses,
+        'evictions': counters['evictions'] if counters else 0,
+        'hit_rate': round(hits / (hits + misses), 3) if (hits + misses) else 0.0
+    }
+
+def get_extraction_cache_stats():
+    """Get extraction cache size and hit/miss counters"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT COUNT(*) as entries, COALESCE(SUM(size_bytes), 0) as size_bytes
+            FROM extraction_cache
+        ''')
+        row = cursor.fetchone()
+
+    return {
+        'entries': row['entries'],
+        'size_bytes': row['size_bytes'],
+        'max_bytes': EXTRACTION_CACHE_MAX_BYTES,
+        **get_cache_counters('extraction')
+    }
+
+# ============================================================================
+# VISION DESCRIPTION CACHE FUNCTIONS (Shared across documents)
+# ============================================================================
+
+VISION_CACHE_MAX_ENTRIES = int(os.environ.get('VISION_CACHE_MAX_ENTRIES', 5000))
+
+def get_vision_cache_many(image_hashes, prompt_version):
+    """Look up cached Vision descriptions for several images at once
+
+    Returns:
+        dict: image_hash -> description for the hashes found (hits/misses recorded)
+    """
+    if not image_hashes:
+        return {}
+
+    unique_hashes = list(dict.fromkeys(image_hashes))
+    placeholders = ', '.join('?' for _ in unique_hashes)
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(f'''
+            SELECT image_hash, description FROM vision_cache
+            WHERE prompt_version = ? AND image_hash IN ({placeholders})
+        ''', (prompt_version, *unique_hashes))
+        found = {row['image_hash']: row['description'] for row in cursor.fetchall()}
+
+        if found:
+            found_placeholders = ', '.join('?' for _ in found)
+            cursor.execute(f'''
+                UPDATE vision_cache
+                SET hit_count = hit_count + 1, last_accessed_at = ?
+                WHERE prompt_version = ? AND image_hash IN ({found_placeholders})
+            ''', (datetime.now().isoformat(), prompt_version, *found))
+
+    if found:
+        record_cache_event('vision', 'hits', len(found))
+    if len(unique_hashes) > len(found):
+        record_cache_event('vision', 'misses', len(unique_hashes) - len(found))
+
+    return found
+
+def save_vision_cache(descriptions, prompt_version):
+    """Store Vision descriptions (dict of image_hash -> description) and evict LRU overflow"""
+    if not descriptions:
+        return
+
+    now = datetime.now().isoformat()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO vision_cache
+            (image_hash, prompt_version, description, created_at, last_accessed_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?)
+        ''', [(image_hash, prompt_version, description, now)
+              for image_hash, description in descriptions.items()])
+
+    print(f"💾 Saved {len(descriptions)} image descriptions to vision cache")
+    evict_vision_cache()
+
+def evict_vision_cache(max_entries=None):
+    """Evict least-recently-used Vision descriptions beyond max_entries"""
+    if max_entries is None:
+        max_entries = VISION_CACHE_MAX_ENTRIES
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM vision_cache WHERE rowid IN (
+                SELECT rowid FROM vision_cache
+                ORDER BY last_accessed_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (max_entries,))
+        evicted = cursor.rowcount
+
+    if evicted > 0:
+        record_cache_event('vision', 'evictions', evicted)
+        print(f"🗑️ Evicted {evicted} vision cache entries (LRU)")
+    return evicted
+
+def get_vision_cache_stats():
+    """Get Vision cache size and hit/miss counters"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) as entries FROM vision_cache')
+        entries = cursor.fetchone()['entries']
+
+    return {
+        'entries': entries,
+        'max_entries': VISION_CACHE_MAX_ENTRIES,
+        **get_cache_counters('vision')
+    }
+
+# ============================================================================
+# PAGE CACHE FUNCTIONS (Per-page results, shared across document versions)
+# ============================================================================
+
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 50000))
+
+def get_page_cache_many(page_hashes, extractor_version):
+    """Look up cached per-page tables for several pages at once
+
+    Returns:
+        dict: page_hash -> list of tables for the hashes found (hits/misses recorded)
+    """
+    if not page_hashes:
+        return {}
+
+    unique_hashes = list(dict.fromkeys(page_hashes))
+    found = {}
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        # Chunked to stay under SQLite's bound-parameter limit on long reports
+        for i in range(0, len(unique_hashes), 500):
+            chunk = unique_hashes[i:i + 500]
+            placeholders = ', '.join('?' for _ in chunk)
+            cursor.execute(f'''
+                SELECT page_hash, tables FROM page_cache
+                WHERE extractor_version = ? AND page_hash IN ({placeholders})
+            ''', (extractor_version, *chunk))
+            found.update({row['page_hash']: json.loads(row['tables']) for row in cursor.fetchall()})
+
+        now = datetime.now().isoformat()
+        cursor.executemany('''
+            UPDATE page_cache
+            SET hit_count = hit_count + 1, last_accessed_at = ?
+            WHERE extractor_version = ? AND page_hash = ?
+        ''', [(now, extractor_version, page_hash) for page_hash in found])
+
+    if found:
+        record_cache_event('page', 'hits', len(found))
+    if len(unique_hashes) > len(found):
+        record_cache_event('page', 'misses', len(unique_hashes) - len(found))
+
+    return found
+
+def save_page_cache(page_tables, extractor_version):
+    """Store per-page tables (dict of page_hash -> list of tables) and evict LRU overflow"""
+    if not page_tables:
+        return
+
+    now = datetime.now().isoformat()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO page_cache
+            (page_hash, extractor_version, tables, created_at, last_accessed_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?)
+        ''', [(page_hash, extractor_version, json.dumps(tables), now)
+              for page_hash, tables in page_tables.items()])
+
+    print(f"💾 Saved {len(page_tables)} pages to page cache")
+    evict_page_cache()
+
+def evict_page_cache(max_entries=None):
+    """Evict least-recently-used pages beyond max_entries"""
+    if max_entries is None:
+        max_entries = PAGE_CACHE_MAX_ENTRIES
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM page_cache WHERE rowid IN (
+                SELECT rowid FROM page_cache
+                ORDER BY last_accessed_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (max_entries,))
+        evicted = cursor.rowcount
+
+    if evicted > 0:
+        record_cache_event('page', 'evictions', evicted)
+        print(f"🗑️ Evicted {evicted} page cache entries (LRU)")
+    return evicted
+
+def get_page_cache_stats():
+    """Get page cache size and hit/miss counters"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) as entries FROM page_cache')
+        entries = cursor.fetchone()['entries']
+
+    return {
+        'entries': entries,
+        'max_entries': PAGE_CACHE_MAX_ENTRIES,
+        **get_cache_counters('page')
+    }
+
+# ============================================================================
+# ANALYSIS CACHE FUNCTIONS (Key details reused across document versions)
+# ============================================================================
+
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', 200))
+# Page text kept per analysis for diffing revised uploads; later pages keep
+# only their hash and length (a changed one then counts as fully changed)
+ANALYSIS_CACHE_TEXT_CHARS = int(os.environ.get('ANALYSIS_CACHE_TEXT_CHARS', 100000))
+
+def get_recent_analyses(context_key, limit=5):
+    """Most recent cached analyses for the same company/industry/report type, newest first"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, page_hashes, page_texts, page_lengths, key_details, created_at
+            FROM analysis_cache
+            WHERE context_key = ?
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (context_key, limit))
+
+        analyses = []
+        for row in cursor.fetchall():
+            analysis = dict(row)
+            analysis['page_hashes'] = json.loads(analysis['page_hashes'])
+            analysis['page_texts'] = json.loads(analysis['page_texts'])
+            if analysis['page_lengths']:
+                analysis['page_lengths'] = json.loads(analysis['page_lengths'])
+            else:
+                analysis['page_lengths'] = [len(text or '') for text in analysis['page_texts']]
+            analysis['key_details'] = json.loads(analysis['key_details'])
+            analyses.append(analysis)
+        return analyses
+
+def save_analysis_cache(context_key, page_hashes, page_texts, key_details):
+    """Store a key detail analysis with the document pages it was made from
+
+    Page texts are kept until ANALYSIS_CACHE_TEXT_CHARS is reached; the rest
+    are stored as null.
+    """
+    kept_texts = []
+    kept_chars = 0
+    for text in page_texts:
+        kept_chars += len(text)
+        kept_texts.append(text if kept_chars <= ANALYSIS_CACHE_TEXT_CHARS else None)
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO analysis_cache (context_key, page_hashes, page_texts, page_lengths, key_details)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (context_key, json.dumps(page_hashes), json.dumps(kept_texts),
+              json.dumps([len(text) for text in page_texts]), json.dumps(key_details)))
+
+        # Keep only the newest entries
+        cursor.execute('''
+            DELETE FROM analysis_cache WHERE id IN (
+                SELECT id FROM analysis_cache
+                ORDER BY id DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (ANALYSIS_CACHE_MAX_ENTRIES,))
+
+# ============================================================================
+# EXTRACTION JOB QUEUE (Background PDF processing shared across workers)
+# ============================================================================
+
+# Running jobs not updated for this long are assumed orphaned (worker died)
+EXTRACTION_JOB_STALE_MINUTES = 10
+# Orphaned jobs already claimed this many times are failed instead of reclaimed
+EXTRACTION_JOB_MAX_ATTEMPTS = 3
+
+def create_extraction_job(job_id, flask_session_id, pdf_path, validation=None, analyze_images=True):
+    """Queue a spooled PDF for background extraction
+
+    validation is the upload's prevalidation result, so the job doesn't repeat it.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO extraction_jobs
+            (job_id, flask_session_id, pdf_path, validation, analyze_images, status, stage, progress)
+            VALUES (?, ?, ?, ?, ?, 'queued', 'queued', 0)
+        ''', (job_id, flask_session_id, pdf_path,
+              json.dumps(validation) if validation else None, analyze_images))
+
+    print(f"📥 Queued extraction job {job_id[:8]}... ({os.path.getsize(pdf_path) / 1024 / 1024:.1f} MB)")
+
+def claim_next_extraction_job(worker_id):
+    """Atomically claim the oldest queued (or orphaned) job for this worker
+
+    Orphaned jobs that have already been claimed EXTRACTION_JOB_MAX_ATTEMPTS
+    times are marked as errors instead, so a PDF that reliably kills the
+    worker is not retried forever.
+
+    Returns:
+        dict with job fields including pdf_path and validation (None for jobs
+        queued without one), or None if the queue is empty
+    """
+    claim_token = f"{worker_id}:{datetime.now().isoformat()}"
+
+    now = datetime.now().isoformat()
+    stale_before = (datetime.now() - timedelta(minutes=EXTRACTION_JOB_STALE_MINUTES)).isoformat()
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE extraction_jobs
+            SET status = 'error', stage = 'error', updated_at = ?,
+                error = 'PDF extraction kept failing on this file - please try a different copy'
+            WHERE status = 'running' AND updated_at < ? AND COALESCE(attempts, 0) >= ?
+        ''', (now, stale_before, EXTRACTION_JOB_MAX_ATTEMPTS))
+        if cursor.rowcount:
+            print(f"❌ Gave up on {cursor.rowcount} extraction job(s) after {EXTRACTION_JOB_MAX_ATTEMPTS} attempts")
+
+        # Single UPDATE so two workers can never claim the same job
+        cursor.execute('''
+            UPDATE extraction_jobs
+            SET status = 'running', stage = 'starting', claim_token = ?, updated_at = ?,
+                attempts = COALESCE(attempts, 0) + 1
+            WHERE job_id = (
+                SELECT job_id FROM extraction_jobs
+                WHERE status = 'queued'
+                   OR (status = 'running' AND updated_at < ?)
+                ORDER BY created_at ASC
+                LIMIT 1
+            )
+        ''', (claim_token, now, stale_before))
+
+        if cursor.rowcount == 0:
+            return None
+
+        cursor.execute('''
+            SELECT job_id, flask_session_id, pdf_path, validation, analyze_images
+            FROM extraction_jobs WHERE claim_token = ?
+        ''', (claim_token,))
+        row = cursor.fetchone()
+
+    if not row:
+        return None
+
+    job = dict(row)
+    job['validation'] = json.loads(job['validation']) if job['validation'] else None
+    return job
+
+def update_extraction_job(job_id, **kwargs):
+    """Update job fields (status, stage, progress, error, result, pdf_path)"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        set_clauses = []
+        values = []
+
+        for key, value in kwargs.items():
+            set_clauses.append(f"{key} = ?")
+            # Serialize lists/dicts to JSON
+            if isinstance(value, (list, dict)):
+                values.append(json.dumps(value))
+            else:
+                values.append(value)
+
+        set_clauses.append("updated_at = ?")
+        values.append(datetime.now().isoformat())
+
+        values.append(job_id)
+
+        query = f"UPDATE extraction_jobs SET {', '.join(set_clauses)} WHERE job_id = ?"
+        cursor.execute(query, values)
+
+def get_extraction_job(job_id):
+    """Get job status (without the PDF path)"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT job_id, flask_session_id, status, stage, progress, error, result,
+                   created_at, updated_at
+            FROM extraction_jobs WHERE job_id = ?
+        ''', (job_id,))
+        row = cursor.fetchone()
+
+    if not row:
+        return None
+
+    job = dict(row)
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+def cleanup_old_extraction_jobs(hours=24):
+    """Delete finished or abandoned jobs older than the given number of hours"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM extraction_jobs
+            WHERE created_at < datetime('now', '-' || ? || ' hours')
+        ''', (hours,))
+        return cursor.rowcount
+
+# ============================================================================
+# PROGRESS EVENTS (Server-Sent Events feed shared across workers)
+# ============================================================================
+
+def add_progress_event(channel, stage, progress=None, detail=None):
+    """Append a progress event to a channel (the uploading session's cache ID)"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO progress_events (channel, stage, progress, detail)
+            VALUES (?, ?, ?, ?)
+        ''', (channel, stage, progress, detail))
+        return cursor.lastrowid
+
+def get_progress_events(channel, after_id=0):
+    """Get events on a channel newer than after_id, oldest first"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, stage, progress, detail, created_at
+            FROM progress_events
+            WHERE channel = ? AND id > ?
+            ORDER BY id ASC
+        ''', (channel, after_id))
+        return [dict(row) for row in cursor.fetchall()]
+
+def clear_progress_events(channel):
+    """Drop a channel's events (called when a new upload starts)"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM progress_events WHERE channel = ?', (channel,))
+
+def cleanup_old_progress_events(hours=24):
+    """Delete progress events older than the given number of hours"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM progress_events
+            WHERE created_at < datetime('now', '-' || ? || ' hours')
+        ''', (hours,))
+        return cursor.rowcount
+
 # ============================================================================
 
 # Initialize database when module is imported
@@ -0,0 +1,13 @@
+"""
+Extraction worker for the Executive Panel Simulator
+Claims queued PDF extraction jobs from SQLite and runs them outside the web workers.
+Started by the Gunicorn master (see gunicorn.conf.py); run it by hand with
+EXTRACTION_WORKER=external. It must run on the same host as the web app, since
+it shares the SQLite database and the upload spool directory.
+"""
+
+import app_v2
+
+
+if __name__ == '__main__':
+    app_v2.run_extraction_worker()
@@ -0,0 +1,83 @@
+"""
+Gunicorn settings for the Executive Panel Simulator
+Loaded by the Procfile; its command-line flags (bind, workers, timeouts) still apply
+"""
+
+import os
+import subprocess
+import sys
+import threading
+
+# Import the app once in the master and fork workers from it: workers boot
+# almost instantly and share the master's modules copy-on-write. app_v2 and
+# database open their SQLite connections and OpenAI client per process after
+# fork, so nothing stateful is shared. Note that with preloading, HUP restarts
+# workers but does not reload code; deploys restart the master anyway.
+# Set GUNICORN_PRELOAD=false to import the app in each worker instead
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+# Queued PDF extractions run in their own process (extraction_worker.py), which
+# the master starts next to the web workers: it must share their host, since
+# jobs live in SQLite and uploads in a local spool directory.
+# A supervisor thread in the master restarts it if it crashes or is OOM-killed.
+# Set EXTRACTION_WORKER=external to run it yourself instead
+EXTRACTION_WORKER_RESTART_SECONDS = 5
+extraction_worker = None
+extraction_worker_stopping = threading.Event()
+
+
+def when_ready(server):
+    """Load the heavy libraries in the master so workers don't each import their own
+
+    preload_app has already imported app_v2 by the time this runs; its
+    libraries are lazy, so they are loaded here explicitly.
+    """
+    start_extraction_worker(server)
+
+    if not preload_app:
+        return
+
+    app_v2 = sys.modules['app_v2']
+    app_v2.load_lazy_modules(*app_v2.PRELOAD_MODULES)
+    server.log.info("Preloaded app and heavy libraries in master %s", os.getpid())
+
+
+def start_extraction_worker(server):
+    """Start the extraction worker supervisor unless the worker is run separately"""
+    if os.environ.get('EXTRACTION_WORKER', '').lower() == 'external':
+        return
+
+    threading.Thread(
+        target=supervise_extraction_worker, args=(server,),
+        name='extraction-worker-supervisor', daemon=True
+    ).start()
+
+
+def supervise_extraction_worker(server):
+    """Run the extraction worker process, restarting it whenever it exits"""
+    global extraction_worker
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extraction_worker.py')
+
+    while not extraction_worker_stopping.is_set():
+        extraction_worker = subprocess.Popen([sys.executable, script])
+        server.log.info("Started extraction worker %s", extraction_worker.pid)
+
+        returncode = extraction_worker.wait()
+        if extraction_worker_stopping.is_set():
+            return
+        server.log.error("Extraction worker %s exited with code %s, restarting in %ss",
+                         extraction_worker.pid, returncode, EXTRACTION_WORKER_RESTART_SECONDS)
+        extraction_worker_stopping.wait(EXTRACTION_WORKER_RESTART_SECONDS)
+
+
+def on_exit(server):
+    """Stop the extraction worker along with the master"""
+    extraction_worker_stopping.set()
+    if extraction_worker is None or extraction_worker.poll() is not None:
+        return
+
+    extraction_worker.terminate()
+    try:
+        extraction_worker.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        extraction_worker.kill()
@@ -0,0 +1,154 @@
+"""
+Token budgeting for prompts sent to OpenAI models
+Counts tokens with a local tokenizer, caches counts per text segment and
+fits prompt parts into an exact token budget by priority
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# gpt-4o and gpt-4o-mini share this encoding
+ENCODING_NAME = 'o200k_base'
+
+# Chat format overhead (role and separators per message, plus the reply primer)
+MESSAGE_OVERHEAD_TOKENS = 3
+REPLY_PRIMING_TOKENS = 3
+
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get('TOKEN_COUNT_CACHE_SIZE', 4096))
+CACHE_KEY_MIN_CHARS = 256  # Longer segments are cached under a digest, not the text itself
+
+# Fallback when tiktoken is not installed: letter runs of up to 8, digit
+# groups of up to 3 and single symbols each count as one token. Slightly
+# overestimates English prose, so budgets stay safe
+ESTIMATE_TOKEN_RE = re.compile(r'[^\W\d_]{1,8}|\d{1,3}|[^\w\s]|_')
+
+_encoding = None
+_encoding_unavailable = False
+_encoding_lock = threading.Lock()
+
+_count_cache = OrderedDict()
+_count_cache_lock = threading.Lock()
+
+def get_encoding():
+    """The local tokenizer, loaded on first use (None if tiktoken is unavailable)"""
+    global _encoding, _encoding_unavailable
+
+    if _encoding is None and not _encoding_unavailable:
+        with _encoding_lock:
+            if _encoding is None and not _encoding_unavailable:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception as e:
+                    _encoding_unavailable = True
+                    print(f"⚠️ tiktoken unavailable, estimating token counts: {e}")
+    return _encoding
+
+def _count_uncached(text):
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(ESTIMATE_TOKEN_RE.findall(text))
+
+def count_tokens(text):
+    """Number of tokens in text, cached per segment (LRU)"""
+    if not text:
+        return 0
+
+    key = text
+    if len(text) >= CACHE_KEY_MIN_CHARS:
+        key = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+    with _count_cache_lock:
+        if key in _count_cache:
+            _count_cache.move_to_end(key)
+            return _count_cache[key]
+
+    tokens = _count_uncached(text)
+
+    with _count_cache_lock:
+        _count_cache[key] = tokens
+        if len(_count_cache) > TOKEN_COUNT_CACHE_SIZE:
+            _count_cache.popitem(last=False)
+    return tokens
+
+def count_message_tokens(messages):
+    """Prompt tokens for a list of chat messages
+
+    For list content (Vision requests) only the text parts are counted;
+    image parts are billed separately by the API.
+    """
+    total = REPLY_PRIMING_TOKENS
+    for message in messages:
+        content = message['content']
+        if isinstance(content, str):
+            content_tokens = count_tokens(content)
+        else:
+            content_tokens = sum(count_tokens(part.get('text', '')) for part in content if part.get('type') == 'text')
+        total += MESSAGE_OVERHEAD_TOKENS + count_tokens(message['role']) + content_tokens
+    return total
+
+def truncate_to_tokens(text, max_tokens, suffix=''):
+    """Longest prefix of text that fits in max_tokens, cut at a token boundary
+
+    suffix (e.g. '...') is appended when the text is cut and counts
+    towards max_tokens.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    budget = max(0, max_tokens - count_tokens(suffix))
+    encoding = get_encoding()
+    if encoding is not None:
+        # A cut inside a multi-byte character decodes to a replacement character
+        prefix = encoding.decode(encoding.encode(text, disallowed_special=())[:budget]).rstrip('�')
+    else:
+        matches = list(ESTIMATE_TOKEN_RE.finditer(text))
+        prefix = text[:matches[budget - 1].end()] if budget > 0 else ''
+
+    return prefix + suffix
+
+def fit_parts(parts, max_tokens, min_part_tokens=20):
+    """Fit prompt parts into max_tokens, filling the highest priority parts first
+
+    parts is a list of dicts with 'key' and 'text', plus optional
+    'priority' (lower fills first, default 0), 'required' (never cut or
+    dropped), 'truncate' (False drops the part whole rather than cutting
+    it) and 'suffix' (appended when the part is cut, default '...').
+    Required parts are always counted first. The first optional part that
+    does not fit is cut to the remaining budget, unless fewer than
+    min_part_tokens remain; any part left after the budget runs out is
+    dropped.
+
+    Returns:
+        tuple: ({key: fitted text ('' if dropped)}, total tokens, keys that were cut or dropped)
+    """
+    fitted = {}
+    cut = []
+    used = 0
+
+    for part in parts:
+        if part.get('required'):
+            fitted[part['key']] = part['text']
+            used += count_tokens(part['text'])
+
+    optional = sorted((part for part in parts if not part.get('required')), key=lambda part: part.get('priority', 0))
+    for part in optional:
+        tokens = count_tokens(part['text'])
+        remaining = max_tokens - used
+
+        if tokens <= remaining:
+            fitted[part['key']] = part['text']
+            used += tokens
+        elif remaining >= min_part_tokens and part.get('truncate', True):
+            fitted[part['key']] = truncate_to_tokens(part['text'], remaining, part.get('suffix', '...'))
+            used += count_tokens(fitted[part['key']])
+            cut.append(part['key'])
+        else:
+            fitted[part['key']] = ''
+            cut.append(part['key'])
+
+    return fitted, used, cut